@@ -0,0 +1,121 @@
+"""Page level checkpoints for issue fetches.
+
+A full update pages through tens of thousands of issues and can run for the
+better part of an hour. To not lose that work to a crash, a network problem
+or the rate limit, every fetched page is appended to a per repo checkpoint
+file. A restarted update picks up the issues fetched so far and continues
+with the first page it does not have yet.
+
+The checkpoint file is a sequence of JSON lines. The first one records the
+URL the fetch started with, so we never resume a different query, and when
+the fetch started. Each following line holds the issues of one page and the
+URL of the next page, which is null once the last page has been read.
+
+Pages fetched long ago may have changed since, and the issues on them would
+be stored as current. Checkpoints older than MAX_AGE_S are thrown away.
+"""
+
+import json
+import os
+import time
+
+
+CHECKPOINT_DIR = '.update_checkpoints'
+
+# Long enough to resume after waiting out the hourly rate limit.
+MAX_AGE_S = 6 * 60 * 60
+
+
+class RepoCheckpoint(object):
+  """The checkpoint of fetching the issues of one repository."""
+
+  def __init__(self, repo, checkpoint_dir=CHECKPOINT_DIR, max_age=MAX_AGE_S,
+               clock=time.time):
+    self.repo = repo
+    self.path = os.path.join(checkpoint_dir, repo.replace('/', '__') + '.json')
+    self.max_age = max_age
+    self._clock = clock
+    self._out = None
+
+  def _read(self, start_url):
+    """Returns (started_at, next_url, issues) recorded for start_url, or
+    None."""
+    try:
+      with open(self.path, 'r') as inp:
+        lines = inp.readlines()
+    except FileNotFoundError:
+      return None
+    try:
+      header = json.loads(lines[0])
+    except (IndexError, ValueError):
+      return None
+    if not isinstance(header, dict) or header.get('start_url') != start_url:
+      return None
+    started_at = header.get('started_at')
+    if (not isinstance(started_at, (int, float))
+        or self._clock() - started_at > self.max_age):
+      return None
+    next_url = start_url
+    issues = []
+    for line in lines[1:]:
+      try:
+        page = json.loads(line)
+        page_next_url, page_issues = page['next_url'], page['issues']
+      except (ValueError, KeyError, TypeError):
+        # A torn write of the last page. We will fetch that page again.
+        break
+      next_url = page_next_url
+      issues.extend(page_issues)
+    return started_at, next_url, issues
+
+  def resume(self, start_url):
+    """Starts or resumes a fetch.
+
+    Args:
+      start_url: (str) the URL of the first page.
+    Returns:
+      (next_url, issues): the URL to continue with, None if all pages have
+      been fetched, and the issues fetched so far.
+    """
+    saved = self._read(start_url)
+    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    if saved:
+      started_at, next_url, issues = saved
+      # Rewrite rather than append, to drop a torn last line.
+      self._open(start_url, started_at)
+      self._write({'next_url': next_url, 'issues': issues})
+      return next_url, issues
+    self._open(start_url, self._clock())
+    return start_url, []
+
+  def _open(self, start_url, started_at):
+    self.close()
+    self._out = open(self.path, 'w')
+    self._write({'start_url': start_url, 'started_at': started_at})
+
+  def _write(self, record):
+    self._out.write(json.dumps(record))
+    self._out.write('\n')
+    self._out.flush()
+
+  def page_done(self, next_url, issues):
+    """Records a fetched page.
+
+    Args:
+      next_url: (str) the URL of the next page, None after the last page.
+      issues: (list) the issues of the page.
+    """
+    self._write({'next_url': next_url, 'issues': issues})
+
+  def close(self):
+    if self._out:
+      self._out.close()
+      self._out = None
+
+  def remove(self):
+    """Drops the checkpoint, once its issues are safely in the store."""
+    self.close()
+    try:
+      os.remove(self.path)
+    except FileNotFoundError:
+      pass
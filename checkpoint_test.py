@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Tests for checkpoint."""
+
+import os
+import tempfile
+import unittest
+
+import checkpoint
+
+START_URL = 'https://api.github.com/repos/bazelbuild/bazel/issues?page=1'
+PAGE_2 = 'https://api.github.com/repos/bazelbuild/bazel/issues?page=2'
+PAGE_3 = 'https://api.github.com/repos/bazelbuild/bazel/issues?page=3'
+
+
+class RepoCheckpointTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.dir = os.path.join(self.tmp.name, 'checkpoints')
+    self.now = 1000000.0
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def new_checkpoint(self):
+    cp = checkpoint.RepoCheckpoint('bazelbuild/bazel', checkpoint_dir=self.dir,
+                                   clock=lambda: self.now)
+    self.addCleanup(cp.close)
+    return cp
+
+  def fetch_two_pages(self):
+    cp = self.new_checkpoint()
+    self.assertEqual(cp.resume(START_URL), (START_URL, []))
+    cp.page_done(PAGE_2, [{'number': 1}, {'number': 2}])
+    cp.page_done(PAGE_3, [{'number': 3}])
+    cp.close()
+    return cp
+
+  def test_resume_from_saved_page(self):
+    self.fetch_two_pages()
+    cp = self.new_checkpoint()
+    self.assertEqual(cp.resume(START_URL),
+                     (PAGE_3, [{'number': 1}, {'number': 2}, {'number': 3}]))
+    # Pages fetched after resuming add to the checkpoint.
+    cp.page_done(None, [{'number': 4}])
+    cp.close()
+    next_url, issues = self.new_checkpoint().resume(START_URL)
+    self.assertIsNone(next_url)
+    self.assertEqual([issue['number'] for issue in issues], [1, 2, 3, 4])
+
+  def test_other_query_starts_afresh(self):
+    self.fetch_two_pages()
+    other = START_URL + '&since=2019-08-01T00:00:00Z'
+    self.assertEqual(self.new_checkpoint().resume(other), (other, []))
+
+  def test_stale_checkpoint_starts_afresh(self):
+    self.fetch_two_pages()
+    self.now += checkpoint.MAX_AGE_S - 1
+    cp = self.new_checkpoint()
+    self.assertEqual(cp.resume(START_URL)[0], PAGE_3)
+    cp.close()
+    # Resuming does not make the pages any younger.
+    self.now += 2
+    self.assertEqual(self.new_checkpoint().resume(START_URL), (START_URL, []))
+
+  def test_checkpoint_without_start_time(self):
+    os.makedirs(self.dir)
+    cp = self.new_checkpoint()
+    with open(cp.path, 'w') as out:
+      out.write('{"start_url": "%s"}\n' % START_URL)
+      out.write('{"next_url": "%s", "issues": [{"number": 1}]}\n' % PAGE_2)
+    self.assertEqual(cp.resume(START_URL), (START_URL, []))
+
+  def test_missing_file(self):
+    self.assertEqual(self.new_checkpoint().resume(START_URL), (START_URL, []))
+
+  def test_torn_last_page(self):
+    cp = self.fetch_two_pages()
+    with open(cp.path, 'a') as out:
+      out.write('{"next_url": "https://api.github.com/re')
+    cp = self.new_checkpoint()
+    self.assertEqual(cp.resume(START_URL),
+                     (PAGE_3, [{'number': 1}, {'number': 2}, {'number': 3}]))
+    cp.page_done(None, [{'number': 4}])
+    cp.close()
+    # The torn line was dropped, so the checkpoint reads back cleanly.
+    next_url, issues = self.new_checkpoint().resume(START_URL)
+    self.assertIsNone(next_url)
+    self.assertEqual(len(issues), 4)
+
+  def test_corrupt_file(self):
+    for content in ('', 'not json\n', '[1, 2]\n'):
+      os.makedirs(self.dir, exist_ok=True)
+      cp = self.new_checkpoint()
+      with open(cp.path, 'w') as out:
+        out.write(content)
+      self.assertEqual(cp.resume(START_URL), (START_URL, []), content)
+      cp.close()
+
+  def test_remove_once_done(self):
+    cp = self.fetch_two_pages()
+    cp = self.new_checkpoint()
+    cp.resume(START_URL)
+    cp.page_done(None, [{'number': 4}])
+    cp.remove()
+    self.assertFalse(os.path.exists(cp.path))
+    self.assertEqual(self.new_checkpoint().resume(START_URL), (START_URL, []))
+    # Removing a checkpoint which is not there is fine.
+    self.new_checkpoint().remove()
+
+
+if __name__ == '__main__':
+  unittest.main()
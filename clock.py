@@ -0,0 +1,47 @@
+"""The moment a run measures the age of issues against.
+
+All reports of one run compare the issues against the same time, taken on
+first use, so their ages and staleness agree even if the run straddles
+midnight. Like the reports always did, it is the local time, compared with
+the UTC timestamps of GitHub.
+"""
+
+import bisect
+import datetime
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_SECONDS_PER_DAY = 24 * 60 * 60
+
+# Issues not updated for at least this many days fall into the staleness
+# bucket of that index plus one, see staleness().
+STALENESS_DAYS = (7, 14, 30, 90, 365)
+
+_now = None
+_now_epoch = None
+
+
+def freeze(at=None):
+  """Sets the time of the run, by default to the current time."""
+  global _now, _now_epoch
+  _now = at or datetime.datetime.now()
+  _now_epoch = int((_now - _EPOCH).total_seconds())
+
+
+def now():
+  """Returns the time of the run, as a naive datetime."""
+  if _now is None:
+    freeze()
+  return _now
+
+
+def days_since(epoch):
+  """Returns the full days from epoch, in seconds, to the time of the run."""
+  if _now is None:
+    freeze()
+  return (_now_epoch - epoch) // _SECONDS_PER_DAY
+
+
+def staleness(age_days):
+  """Returns the number of STALENESS_DAYS that age_days reaches."""
+  return bisect.bisect_right(STALENESS_DAYS, age_days)
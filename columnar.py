@@ -0,0 +1,411 @@
+"""A columnar, memory mapped table of issues.
+
+Loading all issues as JSON takes long and needs a lot of memory, and both
+grow with every year of history. The table keeps the fields the reports use
+in fixed width columns, one array per field, and the titles, bodies and
+assignees in string heaps. Opening it maps the file into memory and parses
+only a small directory, so the cost of a report depends on the columns it
+reads, not on the size of the store.
+
+File layout, all integers little endian:
+  magic (8 bytes), version (uint32), directory length (uint32)
+  directory: JSON, see write_table()
+  padding to 8 bytes
+  columns and heaps, each starting at a multiple of 8 bytes
+
+Rows are only materialized as IssueRow objects, which read their fields from
+the columns on access.
+"""
+
+import array
+import datetime
+import json
+import mmap
+import os
+import struct
+import sys
+
+import clock
+
+
+MAGIC = b'ISSUECOL'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sII')
+_EPOCH = datetime.datetime(1970, 1, 1)
+_NONE = -1
+
+_STATES = ('open', 'closed')
+
+# name -> array typecode of the fixed width columns.
+_COLUMNS = (
+    ('repo', 'i'),
+    ('number', 'q'),
+    ('state', 'b'),
+    ('is_pr', 'b'),
+    ('created', 'q'),
+    ('updated', 'q'),
+    ('closed', 'q'),
+    ('author', 'i'),
+    ('assignee', 'i'),
+)
+
+_HEAPS = ('title', 'body', 'assignees')
+
+
+def to_epoch(timestamp):
+  """Returns the seconds since the epoch of a naive UTC datetime, or -1."""
+  if timestamp is None:
+    return _NONE
+  return int((timestamp - _EPOCH).total_seconds())
+
+
+def from_epoch(seconds):
+  if seconds == _NONE:
+    return None
+  return _EPOCH + datetime.timedelta(seconds=seconds)
+
+
+def _pad(n):
+  return -n % 8
+
+
+class _Interner(object):
+  """Assigns consecutive ids to strings."""
+
+  def __init__(self):
+    self.ids = {}
+    self.values = []
+
+  def id(self, value):
+    if value is None:
+      return _NONE
+    ret = self.ids.get(value)
+    if ret is None:
+      ret = self.ids[value] = len(self.values)
+      self.values.append(value)
+    return ret
+
+
+def write_table(path, issues, labels):
+  """Writes issues as a table.
+
+  Args:
+    path: (str) the file to write.
+    issues: database.Issue objects, or anything with the same attributes.
+    labels: function returning the (name, color) of a label bit number.
+  Returns:
+    the number of issues written.
+  """
+  repos = _Interner()
+  users = _Interner()
+  columns = {name: array.array(typecode) for name, typecode in _COLUMNS}
+  label_words = array.array('Q')
+  heaps = {name: bytearray() for name in _HEAPS}
+  offsets = {name: array.array('q', [0]) for name in _HEAPS}
+  all_bits = 0
+  bit_masks = []
+  for issue in issues:
+    columns['repo'].append(repos.id(issue.repo))
+    columns['number'].append(issue.number)
+    columns['state'].append(_STATES.index(issue.state))
+    columns['is_pr'].append(int(issue.is_pr))
+    columns['created'].append(to_epoch(issue.created_at))
+    columns['updated'].append(to_epoch(issue.updated_at))
+    columns['closed'].append(to_epoch(issue.closed_at))
+    columns['author'].append(users.id(issue.author))
+    columns['assignee'].append(users.id(issue.assignee))
+    for name, value in (('title', issue.title),
+                        ('body', issue.body or ''),
+                        ('assignees', ','.join(issue.assignees))):
+      heaps[name] += value.encode('utf-8')
+      offsets[name].append(len(heaps[name]))
+    all_bits |= issue.label_bits
+    bit_masks.append(issue.label_bits)
+
+  # Every row holds the same number of 64 bit words of label bits.
+  words = max(1, (all_bits.bit_length() + 63) // 64)
+  for bits in bit_masks:
+    for _ in range(words):
+      label_words.append(bits & 0xffffffffffffffff)
+      bits >>= 64
+
+  blobs = [(name, columns[name]) for name, _ in _COLUMNS]
+  blobs.append(('labels', label_words))
+  for name in _HEAPS:
+    blobs.append((name + '_offsets', offsets[name]))
+    blobs.append((name + '_heap', heaps[name]))
+  directory = {
+      'count': len(bit_masks),
+      'repos': repos.values,
+      'users': users.values,
+      'labels': [list(labels(bit)) if all_bits >> bit & 1 else None
+                 for bit in range(all_bits.bit_length())],
+      'label_words': words,
+      'blobs': {},
+  }
+  position = 0
+  for name, blob in blobs:
+    size = len(blob) * (blob.itemsize if hasattr(blob, 'itemsize') else 1)
+    typecode = blob.typecode if hasattr(blob, 'typecode') else 'B'
+    directory['blobs'][name] = [position, size, typecode]
+    position += size + _pad(size)
+  directory = json.dumps(directory).encode('utf-8')
+  header = _HEADER.pack(MAGIC, VERSION, len(directory)) + directory
+  header += b'\0' * _pad(len(header))
+
+  if sys.byteorder != 'little':
+    for _, blob in blobs:
+      if hasattr(blob, 'byteswap'):
+        blob.byteswap()
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'wb') as out:
+    out.write(header)
+    for _, blob in blobs:
+      data = bytes(blob)
+      out.write(data)
+      out.write(b'\0' * _pad(len(data)))
+  os.replace(tmp_path, path)
+  return len(bit_masks)
+
+
+class IssueTable(object):
+  """A table written by write_table(), mapped into memory.
+
+  Supports len(), indexing and iteration, which yield IssueRow objects.
+  """
+
+  def __init__(self, path, label_bit):
+    """Opens a table.
+
+    Args:
+      path: (str) the table file.
+      label_bit: function returning the bit of a raw label in the label
+          numbering of the running process, like database.LabelDB.bit.
+    """
+    if sys.byteorder != 'little':
+      raise NotImplementedError('Issue tables need a little endian machine')
+    self.path = path
+    with open(path, 'rb') as inp:
+      self._mm = mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, directory_len = _HEADER.unpack_from(self._mm)
+    if magic != MAGIC or version != VERSION:
+      raise ValueError('%s is not an issue table of version %d'
+                       % (path, VERSION))
+    start = _HEADER.size
+    directory = json.loads(self._mm[start:start + directory_len])
+    start += directory_len
+    start += _pad(start)
+    self.count = directory['count']
+    self.repos = [sys.intern(r) for r in directory['repos']]
+    self.users = directory['users']
+    self.label_words = directory['label_words']
+    # Bits no issue uses are null.
+    self._label_names = [label and label[0] for label in directory['labels']]
+    self._label_bits = [
+        label and label_bit({'name': label[0], 'color': label[1]})
+        for label in directory['labels']]
+    self._translated = {}
+    self._view = memoryview(self._mm)
+    self.columns = {}
+    for name, (offset, size, typecode) in directory['blobs'].items():
+      self.columns[name] = self._view[
+          start + offset:start + offset + size].cast(typecode)
+
+  def close(self):
+    """Unmaps the file. Rows of the table must not be used afterwards."""
+    for column in self.columns.values():
+      column.release()
+    self.columns = {}
+    self._view.release()
+    self._mm.close()
+
+  def __len__(self):
+    return self.count
+
+  def __getitem__(self, row):
+    if not 0 <= row < self.count:
+      raise IndexError(row)
+    return IssueRow(self, row)
+
+  def __iter__(self):
+    for row in range(self.count):
+      yield IssueRow(self, row)
+
+  def string(self, heap, row):
+    offsets = self.columns[heap + '_offsets']
+    return str(self.columns[heap + '_heap'][offsets[row]:offsets[row + 1]],
+               'utf-8')
+
+  def raw_label_bits(self, row):
+    """Returns the label bits of a row in the numbering of the file."""
+    words = self.label_words
+    column = self.columns['labels']
+    bits = 0
+    for i in range(words):
+      bits |= column[row * words + i] << (64 * i)
+    return bits
+
+  def label_names(self, row):
+    raw = self.raw_label_bits(row)
+    while raw:
+      low = raw & -raw
+      yield self._label_names[low.bit_length() - 1]
+      raw ^= low
+
+  def label_bits(self, row):
+    """Returns the label bits of a row in the numbering of the process."""
+    raw = self.raw_label_bits(row)
+    # Few distinct label sets are shared by many issues.
+    bits = self._translated.get(raw)
+    if bits is None:
+      bits = 0
+      mask = raw
+      while mask:
+        low = mask & -mask
+        bits |= self._label_bits[low.bit_length() - 1]
+        mask ^= low
+      self._translated[raw] = bits
+    return bits
+
+  def raw_mask(self, label_bits):
+    """Returns label bits of the process in the numbering of the file."""
+    mask = 0
+    for bit, process_bit in enumerate(self._label_bits):
+      if process_bit and process_bit & label_bits:
+        mask |= 1 << bit
+    return mask
+
+  def rows(self, repo=None, state=None, is_pull_request=None, author=None,
+           assignee=None, label_bit=None):
+    """Returns the row numbers matching all of the given conditions.
+
+    The arguments are like those of database.IssueStore.query, except that
+    repo, author and assignee must be lists and the label is given by its
+    bit.
+    """
+    checks = []
+    if repo is not None:
+      ids = {i for i, name in enumerate(self.repos) if name in repo}
+      checks.append((self.columns['repo'], ids))
+    if state is not None:
+      checks.append((self.columns['state'],
+                     {_STATES.index(state)} if state in _STATES else set()))
+    if is_pull_request is not None:
+      checks.append((self.columns['is_pr'], {int(is_pull_request)}))
+    for column, logins in (('author', author), ('assignee', assignee)):
+      if logins is not None:
+        ids = {i for i, name in enumerate(self.users) if name in logins}
+        checks.append((self.columns[column], ids))
+    ret = []
+    for row in range(self.count):
+      for column, values in checks:
+        if column[row] not in values:
+          break
+      else:
+        if label_bit is None or self.label_bits(row) & label_bit:
+          ret.append(row)
+    return ret
+
+
+class IssueRow(object):
+  """One issue of an IssueTable, with the attributes of database.Issue."""
+
+  __slots__ = ('_table', '_row')
+
+  def __init__(self, table, row):
+    self._table = table
+    self._row = row
+
+  def _column(self, name):
+    return self._table.columns[name][self._row]
+
+  def _user(self, name):
+    user = self._column(name)
+    return None if user == _NONE else self._table.users[user]
+
+  @property
+  def repo(self):
+    return self._table.repos[self._column('repo')]
+
+  @property
+  def number(self):
+    return self._column('number')
+
+  @property
+  def url(self):
+    return 'https://api.github.com/repos/%s/issues/%d' % (self.repo,
+                                                          self.number)
+
+  @property
+  def html_url(self):
+    return 'https://github.com/%s/%s/%d' % (
+        self.repo, 'pull' if self.is_pr else 'issues', self.number)
+
+  @property
+  def state(self):
+    return _STATES[self._column('state')]
+
+  @property
+  def is_pr(self):
+    return bool(self._column('is_pr'))
+
+  @property
+  def title(self):
+    return self._table.string('title', self._row)
+
+  @property
+  def body(self):
+    return self._table.string('body', self._row)
+
+  @property
+  def author(self):
+    return self._user('author')
+
+  @property
+  def assignee(self):
+    return self._user('assignee')
+
+  @property
+  def assignees(self):
+    assignees = self._table.string('assignees', self._row)
+    return tuple(assignees.split(',')) if assignees else ()
+
+  @property
+  def label_bits(self):
+    return self._table.label_bits(self._row)
+
+  @property
+  def labels(self):
+    return frozenset(self._table.label_names(self._row))
+
+  @property
+  def created_at(self):
+    return from_epoch(self._column('created'))
+
+  @property
+  def updated_at(self):
+    return from_epoch(self._column('updated'))
+
+  @property
+  def closed_at(self):
+    return from_epoch(self._column('closed'))
+
+  @property
+  def created_epoch(self):
+    return self._column('created')
+
+  @property
+  def updated_epoch(self):
+    return self._column('updated')
+
+  @property
+  def age_days(self):
+    return clock.days_since(self._column('updated'))
+
+  @property
+  def staleness(self):
+    return clock.staleness(self.age_days)
+
+  def __repr__(self):
+    return 'IssueRow(%s#%d)' % (self.repo, self.number)
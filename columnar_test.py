@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Tests for columnar."""
+
+import os
+import tempfile
+import unittest
+
+import columnar
+import database
+from database_test import SAMPLE_ISSUES, make_issue
+
+_FIELDS = ('url', 'html_url', 'repo', 'number', 'state', 'is_pr', 'title',
+           'body', 'author', 'assignee', 'assignees', 'label_bits', 'labels',
+           'created_at', 'updated_at', 'closed_at', 'created_epoch',
+           'updated_epoch', 'age_days', 'staleness')
+
+
+class IssueTableTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp.name, 'issues.table')
+    raw = SAMPLE_ISSUES + [
+        make_issue('bazelbuild/bazel', 4, state='closed', author='dave',
+                   labels=['cla: yes', 'team-Core'])]
+    raw[-1]['closed_at'] = '2019-08-02T00:00:00Z'
+    raw[-1]['title'] = 'Unicode ✓'
+    raw[-1]['body'] = None
+    self.issues = [database.Issue(issue) for issue in raw]
+    self.assertEqual(columnar.write_table(self.path, self.issues,
+                                          database.label_db.label_info), 5)
+    self.table = columnar.IssueTable(self.path, database.label_db.bit)
+
+  def tearDown(self):
+    self.table.close()
+    self.tmp.cleanup()
+
+  def test_rows_match_issues(self):
+    self.assertEqual(len(self.table), 5)
+    for issue, row in zip(self.issues, self.table):
+      for field in _FIELDS:
+        expected = getattr(issue, field)
+        if field == 'body':
+          expected = expected or ''
+        self.assertEqual(getattr(row, field), expected, field)
+
+  def test_query(self):
+    def numbers(**filters):
+      return [(row.repo, row.number)
+              for row in database.query_table(self.table, **filters)]
+
+    self.assertEqual(numbers(state='closed'),
+                     [('bazelbuild/bazel', 2), ('bazelbuild/bazel', 4)])
+    self.assertEqual(numbers(repo='bazelbuild/starlark'),
+                     [('bazelbuild/starlark', 1)])
+    self.assertEqual(numbers(is_pull_request=True), [('bazelbuild/bazel', 3)])
+    self.assertEqual(numbers(author=['bob', 'dave']),
+                     [('bazelbuild/bazel', 3), ('bazelbuild/bazel', 4)])
+    self.assertEqual(numbers(assignee='carol'), [('bazelbuild/starlark', 1)])
+    self.assertEqual(numbers(state='open', label='cla:yes'),
+                     [('bazelbuild/bazel', 3)])
+    self.assertEqual(numbers(author='nobody'), [])
+
+  def test_epoch(self):
+    row = self.table[4]
+    self.assertEqual(columnar.to_epoch(row.closed_at), 1564704000)
+    self.assertIsNone(self.table[0].closed_at)
+
+  def test_not_a_table(self):
+    with open(self.path, 'wb') as out:
+      out.write(b'[]' * 16)
+    with self.assertRaises(ValueError):
+      columnar.IssueTable(self.path, database.label_db.bit)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -2,9 +2,39 @@
 
 import collections
 import datetime
+import gzip
+import hashlib
+import itertools
 import json
+import os
+import pickle
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+import clock
+import columnar
 
 all_issues_file = 'all-issues.json'
+# all_issues_file may also be kept compressed, in a file with one of these
+# suffixes added. See open_json_file().
+COMPRESSED_SUFFIXES = ('.gz', '.zst')
+# If this exists, it is used instead of all_issues_file.
+issues_db_file = 'all-issues.db'
+sync_state_file = 'sync-state.json'
+issue_hashes_file = 'issue-hashes.json'
+# If this exists (and issues_db_file does not), the issues are kept in one
+# JSON store per repository in this directory.
+issues_shard_dir = 'issues'
+# If this exists and is up to date, reports read the issues from it.
+issues_table_file = 'all-issues.table'
 
 
 # GitHub API datetime-stamps are already in UTC / Zulu time (+0000)
@@ -12,11 +42,1121 @@ def parse_datetime(datetime_string):
   return datetime.datetime.strptime(datetime_string, '%Y-%m-%dT%H:%M:%SZ')
 
 
-def get_issues(predicate=None):
-  issues = json.load(open(all_issues_file))
-  if predicate:
-    return filter(predicate, issues)
-  return issues
+def repo_name(issue):
+  """Returns '<organization>/<repo>' of an issue."""
+  return '/'.join(issue['repository_url'].split('/')[-2:])
+
+
+def repo_of_url(url):
+  """Returns '<organization>/<repo>' of an issue API URL."""
+  return '/'.join(url.split('/')[-4:-2])
+
+
+def get_issues(predicate=None, **filters):
+  """Returns the issues in the store, as a list of Issue objects.
+
+  Args:
+    predicate: optional function to select issues by.
+    filters: conditions on indexed fields, see IssueStore.query. The SQLite
+        store evaluates them without loading the other issues.
+  """
+  return list(iter_issues(predicate, **filters))
+
+
+def iter_issues(predicate=None, **filters):
+  """Yields the issues in the store, as Issue objects, one at a time.
+
+  Issues are read incrementally where the store supports it, so a caller
+  which only makes one pass needs memory for the issues it keeps, not for
+  the whole store. Arguments are those of get_issues().
+  """
+  table = open_table()
+  if table:
+    issues = query_table(table, **filters)
+  else:
+    store = open_store()
+    issues = (Issue(issue, cold=store.get_cold)
+              for issue in store.scan(**filters))
+  for issue in issues:
+    if not predicate or predicate(issue):
+      yield issue
+
+
+def open_store():
+  if os.path.exists(issues_db_file):
+    return SqliteIssueStore(issues_db_file)
+  if os.path.isdir(issues_shard_dir):
+    return ShardedIssueStore(issues_shard_dir)
+  return JsonIssueStore(json_store_path())
+
+
+def json_store_path():
+  """Returns all_issues_file, or the compressed variant of it which exists."""
+  for suffix in ('',) + COMPRESSED_SUFFIXES:
+    if os.path.exists(all_issues_file + suffix):
+      return all_issues_file + suffix
+  return all_issues_file
+
+
+def build_table(path=None):
+  """Writes the issues of the store into a columnar table.
+
+  Returns:
+    the number of issues in the table.
+  """
+  issues = open_store().load()
+  for i, issue in enumerate(issues):
+    issues[i] = Issue(issue)
+  return columnar.write_table(path or issues_table_file, issues,
+                              label_db.label_info)
+
+
+def open_table(path=None):
+  """Returns the columnar.IssueTable of the issues, or None.
+
+  There is none if it was never built, or if the store has changed since.
+  """
+  path = path or issues_table_file
+  try:
+    if os.path.getmtime(path) < open_store().last_modified():
+      return None
+  except (FileNotFoundError, ValueError):
+    return None
+  return columnar.IssueTable(path, label_db.bit)
+
+
+def query_table(table, repo=None, state=None, is_pull_request=None,
+                author=None, assignee=None, label=None):
+  """Like IssueStore.query, but over a columnar.IssueTable.
+
+  Returns:
+    a list of columnar.IssueRow.
+  """
+  rows = table.rows(
+      repo=_as_list(repo), state=state, is_pull_request=is_pull_request,
+      author=_as_list(author), assignee=_as_list(assignee),
+      label_bit=label_db.bit(label) if label is not None else None)
+  return [columnar.IssueRow(table, row) for row in rows]
+
+
+#
+# Issue stores
+#
+
+_JSON_SEPARATORS = re.compile(r'[\s,]*')
+_JSON_WHITESPACE = re.compile(r'\s*')
+
+
+def iter_json_array(inp, chunk_size=64 * 1024):
+  """Yields the elements of the JSON array in a file, one at a time.
+
+  Only the element being parsed and one chunk of the file are held in
+  memory.
+  """
+  decoder = json.JSONDecoder()
+  buf = ''
+  for chunk in iter(lambda: inp.read(chunk_size), ''):
+    buf = chunk.lstrip()
+    if buf:
+      break
+  if not buf.startswith('['):
+    raise ValueError('Expected a JSON array')
+  pos = 1
+  eof = False
+  while True:
+    pos = _JSON_SEPARATORS.match(buf, pos).end()
+    if buf.startswith(']', pos):
+      return
+    try:
+      value, end = decoder.raw_decode(buf, pos)
+      # Only the next separator shows that a value, like a number cut in
+      # two by the chunks, is complete.
+      follow = _JSON_WHITESPACE.match(buf, end).end()
+      complete = buf[follow:follow + 1] in (',', ']')
+    except ValueError:
+      complete = False
+    if not complete:
+      if eof:
+        raise ValueError('Truncated or invalid JSON array')
+      chunk = inp.read(chunk_size)
+      eof = not chunk
+      buf = buf[pos:] + chunk
+      pos = 0
+      continue
+    yield value
+    pos = end
+
+
+def _as_list(value):
+  if value is None or isinstance(value, (list, tuple, set, frozenset)):
+    return value
+  return [value]
+
+
+def _filter_predicate(repo=None, state=None, is_pull_request=None,
+                      author=None, assignee=None, label=None):
+  """Returns a predicate implementing IssueStore.query filters in Python."""
+  repos = _as_list(repo)
+  authors = _as_list(author)
+  assignees = _as_list(assignee)
+
+  def predicate(issue):
+    if repos is not None and repo_name(issue) not in repos:
+      return False
+    if state is not None and issue['state'] != state:
+      return False
+    if (is_pull_request is not None
+        and ('pull_request' in issue) != is_pull_request):
+      return False
+    if authors is not None and (issue.get('user') or {}).get(
+        'login') not in authors:
+      return False
+    if assignees is not None and (issue.get('assignee') or {}).get(
+        'login') not in assignees:
+      return False
+    if label is not None and not any(
+        l['name'] == label for l in issue['labels']):
+      return False
+    return True
+
+  return predicate
+
+
+# The parts of a GitHub issue that are worth keeping. GitHub sends a lot
+# more, like reactions, the full user objects and dozens of URL templates.
+# Each field maps to None to keep its value as is, or to the projection of
+# its value, which applies to each element of a list.
+_USER_PROJECTION = {'login': None, 'html_url': None}
+ISSUE_PROJECTION = {
+    'url': None,
+    'repository_url': None,
+    'html_url': None,
+    'number': None,
+    'title': None,
+    'body': None,
+    'state': None,
+    'created_at': None,
+    'updated_at': None,
+    'closed_at': None,
+    'user': _USER_PROJECTION,
+    'assignee': _USER_PROJECTION,
+    'assignees': _USER_PROJECTION,
+    'labels': {'name': None, 'color': None, 'url': None},
+    'pull_request': {'url': None, 'html_url': None},
+}
+
+
+def issue_projection(keep_fields=()):
+  """Returns ISSUE_PROJECTION, extended to keep some more fields in full."""
+  projection = dict(ISSUE_PROJECTION)
+  for field in keep_fields:
+    projection[field] = None
+  return projection
+
+
+def project(value, projection):
+  """Returns value with only the fields in projection."""
+  if projection is None or value is None:
+    return value
+  if isinstance(value, list):
+    return [project(v, projection) for v in value]
+  return {field: project(value[field], sub_projection)
+          for field, sub_projection in projection.items() if field in value}
+
+
+# Large fields that only few commands read. The stores keep them apart from
+# the rest of the issue, so loading issues does not have to read them.
+COLD_FIELDS = ('body',)
+
+
+def split_cold(issue):
+  """Returns (hot, cold), the issue without COLD_FIELDS and those fields.
+
+  cold is None if the issue has none of them.
+  """
+  if not any(field in issue for field in COLD_FIELDS):
+    return issue, None
+  hot = dict(issue)
+  cold = {field: hot.pop(field) for field in COLD_FIELDS if field in hot}
+  return hot, cold
+
+
+class ColdStore(object):
+  """The cold fields of issues, by issue URL, in an SQLite table.
+
+  Does not commit, that is up to the user of the connection.
+  """
+
+  _SCHEMA = """
+CREATE TABLE IF NOT EXISTS cold (
+  url TEXT PRIMARY KEY,
+  data TEXT NOT NULL
+);
+"""
+
+  def __init__(self, connection):
+    self.connection = connection
+    self.connection.executescript(self._SCHEMA)
+
+  def get(self, url):
+    """Returns the cold fields of an issue, as a dict."""
+    row = self.connection.execute(
+        'SELECT data FROM cold WHERE url = ?', (url,)).fetchone()
+    return json.loads(row[0]) if row else {}
+
+  def all(self):
+    """Returns the cold fields of all issues, as url -> dict."""
+    return {url: json.loads(data) for url, data in
+            self.connection.execute('SELECT url, data FROM cold')}
+
+  def put(self, url, cold):
+    self.connection.execute(
+        'INSERT OR REPLACE INTO cold (url, data) VALUES (?, ?)',
+        (url, json.dumps(cold, separators=(',', ':'))))
+
+  def clear(self):
+    self.connection.execute('DELETE FROM cold')
+
+
+class IssueStore(object):
+  """Interface of the issue stores.
+
+  Issues are the raw GitHub JSON records, identified by their 'url'.
+  """
+
+  def load(self):
+    """Returns all issues, including their COLD_FIELDS."""
+    raise NotImplementedError()
+
+  def query(self, repo=None, state=None, is_pull_request=None, author=None,
+            assignee=None, label=None):
+    """Returns the issues matching all of the given conditions.
+
+    The issues may lack the COLD_FIELDS, see get_cold().
+
+    Args:
+      repo: (str or list) '<organization>/<repo>' name(s).
+      state: (str) 'open' or 'closed'.
+      is_pull_request: (bool) pull requests only, or issues only.
+      author: (str or list) login(s) of the issue creator.
+      assignee: (str or list) login(s) of the (first) assignee.
+      label: (str) name of a label the issue must have.
+    """
+    raise NotImplementedError()
+
+  def scan(self, **filters):
+    """Like query(), but yields the issues one at a time.
+
+    Stores which can read their issues incrementally override this.
+    """
+    return iter(self.query(**filters))
+
+  def get_cold(self, url):
+    """Returns the COLD_FIELDS of an issue, as a dict."""
+    raise NotImplementedError()
+
+  def files(self):
+    """Returns the paths of the files the store is kept in."""
+    raise NotImplementedError()
+
+  def last_modified(self):
+    """Returns the time of the last change, in seconds since the epoch."""
+    raise NotImplementedError()
+
+  def compact(self, projection=ISSUE_PROJECTION):
+    """Drops the fields outside of projection from all issues.
+
+    Returns:
+      the number of issues.
+    """
+    issues = self.load()
+    for i, issue in enumerate(issues):
+      issues[i] = project(issue, projection)
+    self.save(issues)
+    return len(issues)
+
+  def save(self, issues):
+    """Replaces the content of the store."""
+    raise NotImplementedError()
+
+  def replace_repos(self, repos, issues):
+    """Replaces the issues of some repositories, keeping all others.
+
+    Args:
+      repos: (list of str) the repositories to replace the issues of.
+      issues: (list) the new issues of those repositories.
+    """
+    repos = set(repos)
+    if not repos:
+      return
+    try:
+      kept = [issue for issue in self.load() if repo_name(issue) not in repos]
+    except FileNotFoundError:
+      # A new store.
+      kept = []
+    self.save(kept + issues)
+
+  def update(self, issues):
+    """Adds or replaces issues.
+
+    Returns:
+      list of (issue, is_new), in the order of issues.
+    """
+    raise NotImplementedError()
+
+
+class JsonIssueStore(IssueStore):
+  """All issues in a single JSON array.
+
+  Parsing the JSON dominates the run time of every report, so the store keeps
+  a pickled snapshot of the issues next to the file, which loads faster. The
+  snapshot records the size, modification time and a sampled hash of the
+  JSON file it was made from, and is rebuilt when it no longer matches. It
+  holds the issues in chunks of _SNAPSHOT_CHUNK, so scan() can read it one
+  chunk at a time.
+
+  The COLD_FIELDS are kept in a separate SQLite file next to the JSON file.
+  Stores written before that have them inline, they move out on the next
+  save or update.
+
+  update() does not rewrite the JSON file. It appends the changed issues to
+  a change log, one JSON record per line, which readers replay on top of the
+  JSON file. Once the log grows past max_log_bytes, it is folded into a new
+  JSON file, which replaces the old one atomically. Replaying a log a
+  second time does no harm, so a crash between the two steps loses nothing.
+
+  The JSON file is compressed if its name ends in one of
+  COMPRESSED_SUFFIXES, see open_json_file(). The change log is not.
+  """
+
+  SNAPSHOT_SUFFIX = '.snapshot'
+  COLD_SUFFIX = '.cold'
+  LOG_SUFFIX = '.log'
+  MAX_LOG_BYTES = 8 * 1024 * 1024
+  _SNAPSHOT_VERSION = 2
+  _SNAPSHOT_CHUNK = 1000
+  # Bytes hashed at the start and the end of the JSON file.
+  _HASH_SAMPLE = 64 * 1024
+
+  def __init__(self, path, use_snapshot=True, max_log_bytes=MAX_LOG_BYTES):
+    self.path = path
+    self.snapshot_path = path + self.SNAPSHOT_SUFFIX
+    self.cold_path = path + self.COLD_SUFFIX
+    self.log_path = path + self.LOG_SUFFIX
+    self.use_snapshot = use_snapshot
+    self.max_log_bytes = max_log_bytes
+    self._cold = None
+
+  @property
+  def cold(self):
+    # Opened on first use, most commands never need it.
+    if not self._cold:
+      self._cold = ColdStore(sqlite3.connect(self.cold_path))
+    return self._cold
+
+  def _source_key(self):
+    st = os.stat(self.path)
+    digest = hashlib.blake2b()
+    with open(self.path, 'rb') as inp:
+      digest.update(inp.read(self._HASH_SAMPLE))
+      if st.st_size > self._HASH_SAMPLE:
+        inp.seek(max(self._HASH_SAMPLE, st.st_size - self._HASH_SAMPLE))
+        digest.update(inp.read())
+    return (self._SNAPSHOT_VERSION, st.st_size, st.st_mtime_ns,
+            digest.hexdigest())
+
+  def _open_snapshot(self, key):
+    """Returns the snapshot file, past its key, if it was made for key."""
+    try:
+      inp = open(self.snapshot_path, 'rb')
+    except OSError:
+      return None
+    try:
+      if pickle.load(inp) == key:
+        return inp
+    except (OSError, EOFError, pickle.UnpicklingError):
+      pass
+    inp.close()
+    return None
+
+  @staticmethod
+  def _read_chunks(inp):
+    """Yields the lists of issues of an open snapshot.
+
+    Raises:
+      EOFError: if the snapshot ends before its end marker.
+    """
+    while True:
+      chunk = pickle.load(inp)
+      if chunk is None:
+        return
+      yield chunk
+
+  def _load_snapshot(self, key):
+    inp = self._open_snapshot(key)
+    if not inp:
+      return None
+    issues = []
+    try:
+      with inp:
+        for chunk in self._read_chunks(inp):
+          issues.extend(chunk)
+    except (OSError, EOFError, pickle.UnpicklingError):
+      return None
+    return issues
+
+  def _save_snapshot(self, key, issues):
+    try:
+      fd, tmp_path = tempfile.mkstemp(
+          dir=os.path.dirname(self.snapshot_path) or '.', prefix='.tmp-')
+      with os.fdopen(fd, 'wb') as out:
+        pickle.dump(key, out, protocol=pickle.HIGHEST_PROTOCOL)
+        for i in range(0, len(issues), self._SNAPSHOT_CHUNK):
+          pickle.dump(issues[i:i + self._SNAPSHOT_CHUNK], out,
+                      protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(None, out, protocol=pickle.HIGHEST_PROTOCOL)
+      os.replace(tmp_path, self.snapshot_path)
+    except OSError:
+      # The snapshot is only an optimization, e.g. the directory may be
+      # read only.
+      pass
+
+  def _load_base(self):
+    key = self._source_key() if self.use_snapshot else None
+    if key:
+      issues = self._load_snapshot(key)
+      if issues is not None:
+        return issues
+    with open_json_file(self.path) as issues_db:
+      issues = json.load(issues_db)
+    if key:
+      self._save_snapshot(key, issues)
+    return issues
+
+  def _scan_base(self):
+    """Yields the issues of the JSON file, read from the snapshot if it is
+    up to date."""
+    seen = 0
+    inp = self._open_snapshot(self._source_key()) if self.use_snapshot else None
+    if inp:
+      try:
+        with inp:
+          for chunk in self._read_chunks(inp):
+            for issue in chunk:
+              yield issue
+            seen += len(chunk)
+        return
+      except (OSError, EOFError, pickle.UnpicklingError):
+        # Go on with the issues after those of the good chunks.
+        pass
+    with open_json_file(self.path) as inp:
+      for issue in itertools.islice(iter_json_array(inp), seen, None):
+        yield issue
+
+  def _read_log(self):
+    """Returns the issues in the change log, oldest first."""
+    changes = []
+    try:
+      with open(self.log_path) as log:
+        for line in log:
+          if not line.endswith('\n'):
+            # A torn last write. Its update never finished.
+            break
+          changes.append(json.loads(line))
+    except FileNotFoundError:
+      pass
+    return changes
+
+  def _drop_torn_record(self):
+    """Truncates the change log after its last complete record.
+
+    Appending to a torn last record would join it and the next record into
+    one invalid line.
+    """
+    try:
+      with open(self.log_path, 'rb+') as log:
+        data = log.read()
+        if data and not data.endswith(b'\n'):
+          log.truncate(data.rfind(b'\n') + 1)
+    except FileNotFoundError:
+      pass
+
+  @staticmethod
+  def _merge(issues, changes):
+    """Adds or replaces changes in issues, by URL.
+
+    Returns:
+      list of is_new, in the order of changes.
+    """
+    url_to_index = {issue['url']: i for i, issue in enumerate(issues)}
+    ret = []
+    for issue in changes:
+      index = url_to_index.get(issue['url'])
+      if index is None:
+        url_to_index[issue['url']] = len(issues)
+        issues.append(issue)
+      else:
+        issues[index] = issue
+      ret.append(index is None)
+    return ret
+
+  def _load_hot(self):
+    issues = self._load_base()
+    changes = self._read_log()
+    if changes:
+      self._merge(issues, changes)
+    return issues
+
+  def last_modified(self):
+    return max(os.path.getmtime(path) for path in (self.path, self.log_path)
+               if os.path.exists(path))
+
+  def load(self):
+    issues = self._load_hot()
+    if not os.path.exists(self.cold_path):
+      return issues
+    url_to_cold = self.cold.all()
+    for i, issue in enumerate(issues):
+      cold = url_to_cold.get(issue['url'])
+      if cold:
+        issues[i] = dict(issue, **cold)
+    return issues
+
+  def query(self, **filters):
+    issues = self._load_hot()
+    if not any(v is not None for v in filters.values()):
+      return issues
+    return list(filter(_filter_predicate(**filters), issues))
+
+  def scan(self, **filters):
+    predicate = _filter_predicate(**filters)
+    # Replay the log like _merge() does: changed issues replace the old ones
+    # in place, new ones follow at the end.
+    changes = collections.OrderedDict(
+        (issue['url'], issue) for issue in self._read_log())
+    for issue in self._scan_base():
+      issue = changes.pop(issue['url'], issue)
+      if predicate(issue):
+        yield issue
+    for issue in changes.values():
+      if predicate(issue):
+        yield issue
+
+  def get_cold(self, url):
+    if not os.path.exists(self.cold_path):
+      return {}
+    return self.cold.get(url)
+
+  def files(self):
+    return [path for path in (self.path, self.log_path, self.cold_path,
+                              self.snapshot_path)
+            if os.path.exists(path)]
+
+  def compact(self, projection=ISSUE_PROJECTION):
+    count = super(JsonIssueStore, self).compact(projection)
+    self.cold.connection.execute('VACUUM')
+    return count
+
+  def _split(self, issues, clear_cold=False):
+    """Moves the cold fields of issues to the cold store.
+
+    Returns:
+      the issues without their cold fields.
+    """
+    hot_issues = []
+    with self.cold.connection:
+      if clear_cold:
+        self.cold.clear()
+      for issue in issues:
+        hot, cold = split_cold(issue)
+        if cold is not None:
+          self.cold.put(issue['url'], cold)
+        hot_issues.append(hot)
+    return hot_issues
+
+  def _write_base(self, hot_issues):
+    """Replaces the JSON file and drops the change log."""
+    write_json_atomically(self.path, hot_issues, separators=(',', ':'))
+    if self.use_snapshot:
+      self._save_snapshot(self._source_key(), hot_issues)
+    try:
+      os.remove(self.log_path)
+    except FileNotFoundError:
+      pass
+
+  def save(self, issues):
+    self._write_base(self._split(issues, clear_cold=True))
+
+  def merge_log(self):
+    """Folds the change log into the JSON file."""
+    # Also moves out the inline cold fields of old stores.
+    self._write_base(self._split(self._load_hot()))
+
+  def update(self, issues):
+    # Issues that have not changed keep their cold fields as they are.
+    all_issues = self._load_hot()
+    changes = self._split(issues)
+    is_new = self._merge(all_issues, changes)
+    self._drop_torn_record()
+    with open(self.log_path, 'a') as log:
+      for issue in changes:
+        log.write(json.dumps(issue, separators=(',', ':')))
+        log.write('\n')
+      log.flush()
+      os.fsync(log.fileno())
+    if os.path.getsize(self.log_path) > self.max_log_bytes:
+      self._write_base(self._split(all_issues))
+    return list(zip(issues, is_new))
+
+
+class ShardedIssueStore(IssueStore):
+  """A JsonIssueStore per repository, all in one directory.
+
+  Queries for some repositories only read their shards, and updates only
+  write the shards of the repositories they touch. Issues come back grouped
+  by repository, in the order of the repository names.
+  """
+
+  SHARD_SUFFIX = '.json'
+
+  def __init__(self, directory):
+    self.directory = directory
+    self._shards = {}
+
+  def _path(self, repo):
+    return os.path.join(self.directory,
+                        repo.replace('/', '__') + self.SHARD_SUFFIX)
+
+  def repos(self):
+    """Returns the names of the repositories with a shard, sorted."""
+    try:
+      names = os.listdir(self.directory)
+    except FileNotFoundError:
+      return []
+    return sorted(name[:-len(self.SHARD_SUFFIX)].replace('__', '/')
+                  for name in names if name.endswith(self.SHARD_SUFFIX))
+
+  def shard(self, repo):
+    """Returns the JsonIssueStore of a repository."""
+    if repo not in self._shards:
+      self._shards[repo] = JsonIssueStore(self._path(repo))
+    return self._shards[repo]
+
+  @staticmethod
+  def _group(issues):
+    """Returns repo -> indexes of the issues of that repo."""
+    repo_to_indexes = collections.OrderedDict()
+    for i, issue in enumerate(issues):
+      repo_to_indexes.setdefault(repo_name(issue), []).append(i)
+    return repo_to_indexes
+
+  def load(self):
+    ret = []
+    for repo in self.repos():
+      ret.extend(self.shard(repo).load())
+    return ret
+
+  def query(self, repo=None, **filters):
+    repos = self.repos()
+    if repo is not None:
+      wanted = _as_list(repo)
+      repos = [r for r in repos if r in wanted]
+    ret = []
+    for r in repos:
+      ret.extend(self.shard(r).query(**filters))
+    return ret
+
+  def scan(self, repo=None, **filters):
+    repos = self.repos()
+    if repo is not None:
+      wanted = _as_list(repo)
+      repos = [r for r in repos if r in wanted]
+    for r in repos:
+      for issue in self.shard(r).scan(**filters):
+        yield issue
+
+  def get_cold(self, url):
+    repo = repo_of_url(url)
+    if not os.path.exists(self._path(repo)):
+      return {}
+    return self.shard(repo).get_cold(url)
+
+  def files(self):
+    ret = []
+    for repo in self.repos():
+      ret.extend(self.shard(repo).files())
+    return ret
+
+  def last_modified(self):
+    return max(self.shard(repo).last_modified() for repo in self.repos())
+
+  def compact(self, projection=ISSUE_PROJECTION):
+    # One shard at a time, to not hold all issues in memory.
+    return sum(self.shard(repo).compact(projection) for repo in self.repos())
+
+  def save(self, issues):
+    os.makedirs(self.directory, exist_ok=True)
+    repo_to_indexes = self._group(issues)
+    for repo, indexes in repo_to_indexes.items():
+      self.shard(repo).save([issues[i] for i in indexes])
+    for repo in self.repos():
+      if repo not in repo_to_indexes:
+        for path in self.shard(repo).files():
+          os.remove(path)
+
+  def replace_repos(self, repos, issues):
+    # Only the shards of repos are written.
+    os.makedirs(self.directory, exist_ok=True)
+    repo_to_indexes = self._group(issues)
+    for repo in repos:
+      indexes = repo_to_indexes.get(repo)
+      if indexes:
+        self.shard(repo).save([issues[i] for i in indexes])
+      elif os.path.exists(self._path(repo)):
+        for path in self.shard(repo).files():
+          os.remove(path)
+
+  def update(self, issues):
+    os.makedirs(self.directory, exist_ok=True)
+    ret = [None] * len(issues)
+    for repo, indexes in self._group(issues).items():
+      shard = self.shard(repo)
+      if not os.path.exists(shard.path):
+        shard.save([])
+      results = shard.update([issues[i] for i in indexes])
+      for i, result in zip(indexes, results):
+        ret[i] = result
+    return ret
+
+
+def shard_store(json_path=None, shard_dir=None):
+  """Splits the issues of the JSON store into a ShardedIssueStore.
+
+  Returns:
+    the number of repositories.
+  """
+  shard_dir = shard_dir or issues_shard_dir
+  tmp_dir = shard_dir + '.tmp'
+  if os.path.exists(tmp_dir):
+    shutil.rmtree(tmp_dir)
+  store = ShardedIssueStore(tmp_dir)
+  store.save(JsonIssueStore(json_path or json_store_path()).load())
+  count = len(store.repos())
+  # Only switch over once all shards are complete.
+  os.rename(tmp_dir, shard_dir)
+  return count
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS issues (
+  url TEXT PRIMARY KEY,
+  repo TEXT NOT NULL,
+  number INTEGER NOT NULL,
+  state TEXT NOT NULL,
+  is_pull_request INTEGER NOT NULL,
+  updated_at TEXT NOT NULL,
+  author TEXT,
+  assignee TEXT,
+  data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS issues_repo ON issues (repo, number);
+CREATE INDEX IF NOT EXISTS issues_state ON issues (state, is_pull_request);
+CREATE INDEX IF NOT EXISTS issues_updated_at ON issues (updated_at);
+CREATE INDEX IF NOT EXISTS issues_author ON issues (author);
+CREATE INDEX IF NOT EXISTS issues_assignee ON issues (assignee);
+CREATE TABLE IF NOT EXISTS labels (
+  issue_url TEXT NOT NULL REFERENCES issues (url) ON DELETE CASCADE,
+  name TEXT NOT NULL,
+  PRIMARY KEY (issue_url, name)
+);
+CREATE INDEX IF NOT EXISTS labels_name ON labels (name);
+"""
+
+
+class SqliteIssueStore(IssueStore):
+  """Issues in SQLite, with the fields we filter on in indexed columns.
+
+  The rest of the record is kept as JSON in the data column, the
+  COLD_FIELDS in the cold table. Issues come back in the order they were
+  first added, like they do from the JSON store.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.connection = sqlite3.connect(path)
+    self.connection.execute('PRAGMA foreign_keys = ON')
+    self.connection.executescript(_SQLITE_SCHEMA)
+    self.cold = ColdStore(self.connection)
+
+  def load(self):
+    ret = []
+    for data, cold in self.connection.execute(
+        'SELECT issues.data, cold.data FROM issues'
+        ' LEFT JOIN cold ON issues.url = cold.url ORDER BY issues.rowid'):
+      issue = json.loads(data)
+      if cold:
+        issue.update(json.loads(cold))
+      ret.append(issue)
+    return ret
+
+  def get_cold(self, url):
+    return self.cold.get(url)
+
+  def files(self):
+    return [self.path]
+
+  def last_modified(self):
+    return os.path.getmtime(self.path)
+
+  def compact(self, projection=ISSUE_PROJECTION):
+    count = super(SqliteIssueStore, self).compact(projection)
+    self.connection.execute('VACUUM')
+    return count
+
+  def query(self, **filters):
+    return list(self.scan(**filters))
+
+  def scan(self, repo=None, state=None, is_pull_request=None, author=None,
+           assignee=None, label=None):
+    where = []
+    args = []
+    for column, values in (('repo', _as_list(repo)),
+                           ('author', _as_list(author)),
+                           ('assignee', _as_list(assignee))):
+      if values is not None:
+        values = list(values)
+        where.append('%s IN (%s)' % (column, ','.join('?' * len(values))))
+        args.extend(values)
+    if state is not None:
+      where.append('state = ?')
+      args.append(state)
+    if is_pull_request is not None:
+      where.append('is_pull_request = ?')
+      args.append(int(is_pull_request))
+    if label is not None:
+      where.append('url IN (SELECT issue_url FROM labels WHERE name = ?)')
+      args.append(label)
+    sql = 'SELECT data FROM issues'
+    if where:
+      sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY rowid'
+    for row in self.connection.execute(sql, args):
+      yield json.loads(row[0])
+
+  def _upsert(self, issue):
+    """Returns True if the issue is new."""
+    url = issue['url']
+    hot, cold = split_cold(issue)
+    is_new = self.connection.execute(
+        'SELECT 1 FROM issues WHERE url = ?', (url,)).fetchone() is None
+    self.connection.execute(
+        'INSERT INTO issues (url, repo, number, state, is_pull_request,'
+        ' updated_at, author, assignee, data)'
+        ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+        ' ON CONFLICT (url) DO UPDATE SET'
+        '   repo = excluded.repo, number = excluded.number,'
+        '   state = excluded.state, is_pull_request = excluded.is_pull_request,'
+        '   updated_at = excluded.updated_at, author = excluded.author,'
+        '   assignee = excluded.assignee, data = excluded.data',
+        (url, repo_name(issue), issue['number'], issue['state'],
+         int('pull_request' in issue), issue['updated_at'],
+         (issue.get('user') or {}).get('login'),
+         (issue.get('assignee') or {}).get('login'),
+         json.dumps(hot, separators=(',', ':'))))
+    if cold is not None:
+      self.cold.put(url, cold)
+    self.connection.execute('DELETE FROM labels WHERE issue_url = ?', (url,))
+    self.connection.executemany(
+        'INSERT OR IGNORE INTO labels (issue_url, name) VALUES (?, ?)',
+        [(url, label['name']) for label in issue['labels']])
+    return is_new
+
+  def save(self, issues):
+    with self.connection:
+      self.connection.execute('DELETE FROM labels')
+      self.cold.clear()
+      self.connection.execute('DELETE FROM issues')
+      for issue in issues:
+        self._upsert(issue)
+
+  def update(self, issues):
+    with self.connection:
+      return [(issue, self._upsert(issue)) for issue in issues]
+
+  def close(self):
+    self.connection.close()
+
+
+def migrate_to_sqlite(json_path=None, db_path=None):
+  """Copies the issues of the JSON store into a new SQLite store.
+
+  Returns:
+    the number of issues migrated.
+  """
+  issues = JsonIssueStore(json_path or json_store_path()).load()
+  db_path = db_path or issues_db_file
+  tmp_path = db_path + '.tmp'
+  if os.path.exists(tmp_path):
+    os.remove(tmp_path)
+  store = SqliteIssueStore(tmp_path)
+  store.save(issues)
+  store.close()
+  # Only switch over once the database is complete.
+  os.replace(tmp_path, db_path)
+  return len(issues)
+
+
+def compact_store(projection=ISSUE_PROJECTION):
+  """Slims down the issue store to the fields in projection.
+
+  Returns:
+    (number of issues, bytes before, bytes after).
+  """
+  store = open_store()
+  size = lambda: sum(os.path.getsize(path) for path in store.files())
+  before = size()
+  count = store.compact(projection)
+  return count, before, size()
+
+
+def open_json_file(path, mode='r'):
+  """Opens a JSON file as text, compressed as its extension says.
+
+  Args:
+    path: (str) the file. Files ending in .gz are gzip compressed, files
+        ending in .zst zstd compressed, which needs the zstandard module.
+    mode: (str) 'r' or 'w'.
+  """
+  if path.endswith('.gz'):
+    # The default level 9 takes several times longer for a few percent.
+    return gzip.open(path, mode + 't', compresslevel=6, encoding='utf-8')
+  if path.endswith('.zst'):
+    return _zstandard(path).open(path, mode + 't', encoding='utf-8')
+  return open(path, mode)
+
+
+def _zstandard(path):
+  if not zstandard:
+    raise RuntimeError('Reading or writing %s needs the zstandard module:'
+                       ' pip install zstandard' % path)
+  return zstandard
+
+
+def convert_json_store(suffix, json_path=None):
+  """Moves the JSON store to all_issues_file with suffix added.
+
+  Args:
+    suffix: (str) '' for plain JSON, or one of COMPRESSED_SUFFIXES.
+    json_path: (str) the store to convert, by default the current one.
+  Returns:
+    (number of issues, bytes of the JSON file before, bytes after).
+  """
+  old = JsonIssueStore(json_path or json_store_path())
+  new = JsonIssueStore(all_issues_file + suffix)
+  if new.path == old.path:
+    raise ValueError('The store is already in %s' % old.path)
+  if suffix == '.zst':
+    _zstandard(new.path)
+  before = os.path.getsize(old.path)
+  old_files = old.files()
+  issues = old.load()
+  new.save(issues)
+  for path in old_files:
+    os.remove(path)
+  return len(issues), before, os.path.getsize(new.path)
+
+
+def write_json_atomically(path, data, **kwargs):
+  """Writes data as JSON, so that path has either the old or the new content.
+
+  The data is compressed if the extension of path asks for it, see
+  open_json_file().
+
+  Args:
+    path: (str) file to replace.
+    data: the object to serialize.
+    kwargs: passed on to json.dump.
+  """
+  fd, tmp_path = tempfile.mkstemp(
+      dir=os.path.dirname(path) or '.', prefix='.tmp-',
+      suffix=os.path.splitext(path)[1])
+  os.close(fd)
+  try:
+    with open_json_file(tmp_path, 'w') as out:
+      json.dump(data, out, **kwargs)
+    os.replace(tmp_path, path)
+  except BaseException:
+    os.remove(tmp_path)
+    raise
+
+
+#
+# Sync state
+#
+# Per repo watermarks of the last successful update, so an incremental update
+# does not have to scan the whole store to find out where to continue:
+#   repo -> {
+#     'last_update': GitHub timestamp of the newest change we have,
+#     'etag': ETag of the last incremental fetch, if it fit on one page,
+#   }
+
+def load_sync_state():
+  try:
+    with open(sync_state_file, 'r') as inp:
+      return json.load(inp)
+  except FileNotFoundError:
+    return {}
+
+
+def save_sync_state(sync_state):
+  write_json_atomically(sync_state_file, sync_state, indent=2, sort_keys=True)
+
+
+#
+# Change detection
+#
+# Most issues an incremental update fetches again differ from the stored ones
+# only in fields we do not keep. A short hash of the projected fields of every
+# issue, url -> hash, tells which ones really changed without reading the
+# store.
+
+def issue_hash(issue, projection=ISSUE_PROJECTION):
+  """Returns a stable hash of the fields of an issue we keep.
+
+  The hash includes updated_at, which the reports read to tell the age of
+  an issue. An issue GitHub returns with a newer updated_at, e.g. after a
+  comment, has changed even if none of the other fields we keep did.
+  """
+  data = json.dumps(project(issue, projection), sort_keys=True,
+                    separators=(',', ':'))
+  return hashlib.blake2b(data.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def load_issue_hashes(store=None, projection=ISSUE_PROJECTION):
+  """Returns the hashes of the stored issues.
+
+  If there are none yet, they are computed from store, once.
+  """
+  try:
+    with open(issue_hashes_file, 'r') as inp:
+      return json.load(inp)
+  except FileNotFoundError:
+    pass
+  store = store or open_store()
+  try:
+    issues = store.load()
+  except FileNotFoundError:
+    # No store yet either.
+    return {}
+  hashes = {issue['url']: issue_hash(issue, projection) for issue in issues}
+  # Saved right away, so that the next run does not load the whole store
+  # again even if this one changes nothing.
+  save_issue_hashes(hashes)
+  return hashes
+
+
+def save_issue_hashes(hashes):
+  write_json_atomically(issue_hashes_file, hashes, separators=(',', ':'))
 
 
 #
@@ -27,9 +1167,85 @@ def update_time(issue):
   return parse_datetime(issue['updated_at'])
 
 
+def _parse_timestamp(timestamp):
+  # Several times faster than parse_datetime, which matters at load time.
+  if not timestamp:
+    return None
+  return datetime.datetime.fromisoformat(timestamp.rstrip('Z'))
+
+
+class Issue(object):
+  """The fields of an issue that the reports use.
+
+  The raw issues from GitHub are large nested dicts of which the reports read
+  only a handful of fields, so get_issues() hands out these instead.
+
+  Besides the fields of the raw issue, it has some derived from them once,
+  when the issue is loaded:
+    created_epoch, updated_epoch: the timestamps in seconds since the epoch.
+    age_days: full days since the last update, see clock.days_since().
+    staleness: the staleness bucket of age_days, see clock.staleness().
+  """
+
+  __slots__ = ('url', 'html_url', 'repo', 'number', 'state', 'is_pr',
+               'title', '_body', '_cold', 'author', 'assignee', 'assignees',
+               'label_bits', 'created_at', 'updated_at', 'closed_at',
+               'created_epoch', 'updated_epoch', 'age_days', 'staleness')
+
+  def __init__(self, issue, cold=None):
+    """Builds an Issue from the raw GitHub JSON of one.
+
+    Args:
+      issue: (dict) the raw issue.
+      cold: function returning the COLD_FIELDS of an issue by URL, like
+          IssueStore.get_cold. Used if the raw issue lacks them.
+    """
+    self.url = issue['url']
+    self.html_url = issue['html_url']
+    self.repo = sys.intern(repo_name(issue))
+    self.number = issue['number']
+    self.state = sys.intern(issue['state'])
+    self.is_pr = 'pull_request' in issue
+    self.title = issue['title']
+    if 'body' in issue or not cold:
+      self._body = issue.get('body')
+      self._cold = None
+    else:
+      self._cold = cold
+    self.author = (issue.get('user') or {}).get('login')
+    self.assignee = (issue.get('assignee') or {}).get('login')
+    self.assignees = tuple(a['login'] for a in issue.get('assignees') or ())
+    self.label_bits = label_db.mask_of(issue['labels'])
+    self.created_at = _parse_timestamp(issue.get('created_at'))
+    self.updated_at = _parse_timestamp(issue.get('updated_at'))
+    self.closed_at = _parse_timestamp(issue.get('closed_at'))
+    self.created_epoch = columnar.to_epoch(self.created_at)
+    self.updated_epoch = columnar.to_epoch(self.updated_at)
+    self.age_days = clock.days_since(self.updated_epoch)
+    self.staleness = clock.staleness(self.age_days)
+
+  @property
+  def body(self):
+    """The body of the issue, read from the cold store on first use."""
+    if self._cold:
+      self._body = self._cold(self.url).get('body')
+      self._cold = None
+    return self._body
+
+  @property
+  def labels(self):
+    """The names of the labels of the issue, as a frozenset."""
+    return frozenset(label_db.names(self.label_bits))
+
+  def __repr__(self):
+    return 'Issue(%s#%d)' % (self.repo, self.number)
+
+
 def created_by(issue):
   """Returns the user of the issue creator."""
-  return User(issue.get('user'))
+  if isinstance(issue, dict):
+    return User(issue.get('user'))
+  return User.from_login(issue.author)
 
 
 class User(object):
@@ -37,6 +1253,10 @@ class User(object):
    def __init__(self, json):
      self.data = json
 
+   @classmethod
+   def from_login(cls, login):
+     return cls({'login': login, 'html_url': 'https://github.com/' + login})
+
    @property
    def name(self):
      return self.data['login']
@@ -60,10 +1280,22 @@ class LabelDB(object):
   The intent is that the color choices for main repo win over those in the
   secondary ones. To accomplish that we preload the labels from the main
   repo and add new ones lazily as we encounter them.
+
+  Every label also gets a small integer id, so that the labels of an issue
+  can be kept as a bitmask (bit 1 << id) and label tests become single bit
+  operations. Labels that differ only in punctuation or case share an id.
   """
 
   def __init__(self, db_file):
     self.key_to_label = {}
+    self.key_to_id = {}
+    # id -> Label
+    self._labels = []
+    # Caches of the bits of label names asked about, of the names of raw
+    # labels seen on issues, and of queries over them.
+    self._name_to_bit = {}
+    self._seen_to_bit = {}
+    self._masks = {}
     self._load(db_file)
 
   def _load(self, db_file):
@@ -83,9 +1315,17 @@ class LabelDB(object):
         key=key,
         name=name,
         color=label['color'],
-        url=label['url'],
+        url=label.get('url'),
     )
     self.key_to_label[key] = label
+    label_id = self.key_to_id.get(key)
+    if label_id is None:
+      self.key_to_id[key] = len(self._labels)
+      self._labels.append(label)
+      # A new label can match prefixes that were asked for before.
+      self._masks.clear()
+    else:
+      self._labels[label_id] = label
     return label
 
   @staticmethod
@@ -100,9 +1340,11 @@ class LabelDB(object):
     """Gets the Label struct for a given label name.
 
     Args:
-      label: a label name. If the name is not in the database, a new Label
-          object is created and that is returned.
+      label: a raw label or a label name. If the label is not in the
+          database, a new Label object is created and that is returned.
     """
+    if isinstance(label, str):
+      label = {'name': label, 'color': 'ededed', 'url': ''}
     key = self._normalize(label['name'])
     ret = self.key_to_label.get(key)
     if not ret:
@@ -112,6 +1354,65 @@ class LabelDB(object):
   def all(self):
     return self.key_to_label.values()
 
+  def bit(self, label):
+    """Returns the bit of a label, given as a raw label or a name."""
+    if isinstance(label, str):
+      bit = self._name_to_bit.get(label)
+      if bit is None:
+        key = self._normalize(label)
+        if key not in self.key_to_id:
+          # Only asked about. Reserve an id, without adding it to all().
+          self.key_to_id[key] = len(self._labels)
+          self._labels.append(Label(key=key, name=label, color='ededed',
+                                    url=None))
+          self._masks.clear()
+        bit = self._name_to_bit[label] = 1 << self.key_to_id[key]
+      return bit
+    name = label['name']
+    bit = self._seen_to_bit.get(name)
+    if bit is None:
+      key = self.get(label).key
+      bit = self._seen_to_bit[sys.intern(name)] = 1 << self.key_to_id[key]
+    return bit
+
+  def mask_of(self, labels):
+    """Returns the bitmask of a list of raw labels or label names."""
+    bits = 0
+    for label in labels:
+      bits |= self.bit(label)
+    return bits
+
+  def mask(self, names):
+    """Returns the bitmask of label names, cached for repeated queries."""
+    names = tuple(names)
+    bits = self._masks.get(names)
+    if bits is None:
+      bits = self._masks[names] = self.mask_of(names)
+    return bits
+
+  def prefix_mask(self, prefix):
+    """Returns the bitmask of all labels whose name starts with prefix."""
+    bits = self._masks.get(prefix)
+    if bits is None:
+      bits = 0
+      for label_id, label in enumerate(self._labels):
+        if label.name.startswith(prefix):
+          bits |= 1 << label_id
+      self._masks[prefix] = bits
+    return bits
+
+  def label_info(self, label_id):
+    """Returns (name, color) of the label with the given id."""
+    label = self._labels[label_id]
+    return label.name, label.color
+
+  def names(self, bits):
+    """Yields the names of the labels in a bitmask, in id order."""
+    while bits:
+      low = bits & -bits
+      yield self._labels[low.bit_length() - 1].name
+      bits ^= low
+
 
 # export the singleton
 label_db = LabelDB(PRIMARY_LABEL_DB)
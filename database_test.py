@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+"""Tests for database."""
+
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import clock
+import database
+
+
+def make_issue(repo, number, state='open', labels=(), pull_request=False,
+               author='alice', assignee=None, updated_at='2019-08-01T10:00:00Z'):
+  repository_url = 'https://api.github.com/repos/' + repo
+  issue = {
+      'url': '%s/issues/%d' % (repository_url, number),
+      'repository_url': repository_url,
+      'html_url': 'https://github.com/%s/%s/%d' % (
+          repo, 'pull' if pull_request else 'issues', number),
+      'number': number,
+      'title': 'Issue %d' % number,
+      'body': 'Body of issue %d' % number,
+      'state': state,
+      'created_at': '2019-01-01T00:00:00Z',
+      'updated_at': updated_at,
+      'closed_at': None,
+      'user': {'login': author, 'html_url': 'https://github.com/' + author},
+      'assignee': None,
+      'assignees': [],
+      'labels': [{'name': name, 'color': 'ededed', 'url': ''}
+                 for name in labels],
+  }
+  if assignee:
+    issue['assignee'] = {'login': assignee,
+                         'html_url': 'https://github.com/' + assignee}
+    issue['assignees'] = [issue['assignee']]
+  if pull_request:
+    issue['pull_request'] = {'url': '%s/pulls/%d' % (repository_url, number)}
+  return issue
+
+
+SAMPLE_ISSUES = [
+    make_issue('bazelbuild/bazel', 1, labels=['P1', 'team-Core']),
+    make_issue('bazelbuild/bazel', 2, state='closed', labels=['P2']),
+    make_issue('bazelbuild/bazel', 3, pull_request=True, labels=['cla: yes'],
+               author='bob'),
+    make_issue('bazelbuild/starlark', 1, assignee='carol',
+               labels=['team-Starlark']),
+]
+
+
+class IssueTest(unittest.TestCase):
+
+  def test_from_json(self):
+    issue = database.Issue(SAMPLE_ISSUES[2])
+    self.assertEqual(issue.repo, 'bazelbuild/bazel')
+    self.assertEqual(issue.number, 3)
+    self.assertEqual(issue.state, 'open')
+    self.assertTrue(issue.is_pr)
+    self.assertEqual(issue.author, 'bob')
+    self.assertIsNone(issue.assignee)
+    self.assertEqual(issue.labels, frozenset(['cla: yes']))
+    self.assertEqual(issue.updated_at, datetime.datetime(2019, 8, 1, 10, 0))
+    self.assertIsNone(issue.closed_at)
+
+  def test_derived_fields(self):
+    with mock.patch.multiple(clock, _now=None, _now_epoch=None):
+      clock.freeze(datetime.datetime(2019, 9, 1, 9, 59))
+      issue = database.Issue(SAMPLE_ISSUES[2])
+    self.assertEqual(issue.updated_epoch, 1564653600)
+    self.assertEqual(issue.age_days, 30)
+    self.assertEqual(issue.staleness, 3)
+
+  def test_assignees(self):
+    issue = database.Issue(SAMPLE_ISSUES[3])
+    self.assertFalse(issue.is_pr)
+    self.assertEqual(issue.assignee, 'carol')
+    self.assertEqual(issue.assignees, ('carol',))
+    self.assertEqual(database.label_db.get('team-Starlark').color, 'ededed')
+
+
+class LabelDBTest(unittest.TestCase):
+
+  def setUp(self):
+    self.db = database.LabelDB('no-such-file.json')
+
+  def test_bits(self):
+    bits = self.db.mask_of([{'name': 'P1', 'color': 'ff0000'},
+                            {'name': 'team-Core', 'color': '00ff00'}])
+    self.assertTrue(bits & self.db.bit('P1'))
+    self.assertFalse(bits & self.db.bit('P2'))
+    self.assertEqual(bits & self.db.mask(['P0', 'P1']), self.db.bit('P1'))
+    self.assertEqual(sorted(self.db.names(bits)), ['P1', 'team-Core'])
+
+  def test_normalized_labels_share_a_bit(self):
+    bits = self.db.mask_of([{'name': 'cla: yes', 'color': '00ff00'}])
+    self.assertEqual(self.db.mask_of([{'name': 'CLA-yes', 'color': 'x'}]),
+                     bits)
+    self.assertEqual(self.db.bit('cla:yes'), bits)
+    self.assertEqual(list(self.db.names(bits)), ['cla: yes'])
+
+  def test_prefix_mask_sees_new_labels(self):
+    core = self.db.bit({'name': 'team-Core', 'color': 'x'})
+    self.assertEqual(self.db.prefix_mask('team-'), core)
+    rules = self.db.bit({'name': 'team-Rules', 'color': 'x'})
+    self.assertEqual(self.db.prefix_mask('team-'), core | rules)
+
+  def test_queried_labels_are_not_listed(self):
+    self.db.bit('release')
+    self.assertEqual(list(self.db.all()), [])
+    self.db.bit({'name': 'release', 'color': 'abcdef'})
+    self.assertEqual(self.db.get('release').color, 'abcdef')
+
+
+class ProjectTest(unittest.TestCase):
+
+  def test_project(self):
+    issue = make_issue('bazelbuild/bazel', 1, labels=['P1'], assignee='carol',
+                       pull_request=True)
+    bloated = json.loads(json.dumps(issue))
+    bloated['reactions'] = {'+1': 3}
+    bloated['milestone'] = {'title': '1.0'}
+    bloated['user']['gravatar_id'] = ''
+    bloated['assignees'][0]['type'] = 'User'
+    self.assertEqual(database.project(bloated, database.ISSUE_PROJECTION),
+                     issue)
+    projection = database.issue_projection(['milestone'])
+    self.assertEqual(database.project(bloated, projection)['milestone'],
+                     {'title': '1.0'})
+    self.assertIs(database.project(bloated, None), bloated)
+
+  def test_issue_hash(self):
+    issue = make_issue('bazelbuild/bazel', 1, labels=['P1'])
+    digest = database.issue_hash(issue)
+    bloated = json.loads(json.dumps(issue))
+    bloated['reactions'] = {'+1': 3}
+    self.assertEqual(database.issue_hash(bloated), digest)
+    reordered = dict(reversed(list(issue.items())))
+    self.assertEqual(database.issue_hash(reordered), digest)
+    bloated['labels'] = []
+    self.assertNotEqual(database.issue_hash(bloated), digest)
+
+  def test_issue_hash_includes_update_time(self):
+    issue = make_issue('bazelbuild/bazel', 1)
+    touched = make_issue('bazelbuild/bazel', 1,
+                         updated_at='2019-08-02T10:00:00Z')
+    self.assertNotEqual(database.issue_hash(touched),
+                        database.issue_hash(issue))
+
+  def test_load_issue_hashes(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      store = database.JsonIssueStore(os.path.join(tmp, 'issues.json'))
+      with mock.patch.object(database, 'issue_hashes_file',
+                             os.path.join(tmp, 'hashes.json')):
+        self.assertEqual(database.load_issue_hashes(store), {})
+        self.assertFalse(os.path.exists(database.issue_hashes_file))
+        store.save(SAMPLE_ISSUES)
+        expected = {issue['url']: database.issue_hash(issue)
+                    for issue in SAMPLE_ISSUES}
+        self.assertEqual(database.load_issue_hashes(store), expected)
+        # Computed once, then read from the file.
+        with mock.patch.object(store, 'load', side_effect=AssertionError):
+          self.assertEqual(database.load_issue_hashes(store), expected)
+        database.save_issue_hashes({'url': 'hash'})
+        self.assertEqual(database.load_issue_hashes(store), {'url': 'hash'})
+
+
+class IssueStoreTestBase(object):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.store = self.make_store(self.tmp.name)
+    self.store.save(SAMPLE_ISSUES)
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def numbers(self, issues):
+    return [(database.repo_name(i), i['number']) for i in issues]
+
+  def in_store_order(self, issues):
+    """Returns issues in the order the store returns them, given the order
+    they were added in."""
+    return issues
+
+  def test_load(self):
+    self.assertEqual(self.store.load(), self.in_store_order(SAMPLE_ISSUES))
+
+  def test_query(self):
+    self.assertEqual(
+        self.numbers(self.store.query(state='open')),
+        [('bazelbuild/bazel', 1), ('bazelbuild/bazel', 3),
+         ('bazelbuild/starlark', 1)])
+    self.assertEqual(
+        self.numbers(self.store.query(repo='bazelbuild/starlark')),
+        [('bazelbuild/starlark', 1)])
+    self.assertEqual(
+        self.numbers(self.store.query(is_pull_request=True)),
+        [('bazelbuild/bazel', 3)])
+    self.assertEqual(
+        self.numbers(self.store.query(author=['bob', 'dave'])),
+        [('bazelbuild/bazel', 3)])
+    self.assertEqual(
+        self.numbers(self.store.query(assignee='carol')),
+        [('bazelbuild/starlark', 1)])
+    self.assertEqual(
+        self.numbers(self.store.query(state='open', label='P1')),
+        [('bazelbuild/bazel', 1)])
+
+  def test_scan(self):
+    self.store.update([make_issue('bazelbuild/bazel', 2, labels=['P1']),
+                       make_issue('bazelbuild/bazel', 4)])
+    for filters in ({}, {'state': 'open'}, {'repo': 'bazelbuild/starlark'},
+                    {'label': 'P1'}):
+      self.assertEqual(list(self.store.scan(**filters)),
+                       self.store.query(**filters), filters)
+
+  def test_update(self):
+    changed = make_issue('bazelbuild/bazel', 2, labels=['P1'])
+    added = make_issue('bazelbuild/bazel', 4)
+    result = self.store.update([changed, added])
+    self.assertEqual(result, [(changed, False), (added, True)])
+    self.assertEqual(
+        self.store.load(),
+        self.in_store_order(
+            [SAMPLE_ISSUES[0], changed] + SAMPLE_ISSUES[2:] + [added]))
+    self.assertEqual(
+        self.numbers(self.store.query(label='P1')),
+        [('bazelbuild/bazel', 1), ('bazelbuild/bazel', 2)])
+
+  def test_replace_repos(self):
+    replaced = make_issue('bazelbuild/bazel', 4)
+    self.store.replace_repos(['bazelbuild/bazel'], [replaced])
+    self.assertEqual(
+        self.numbers(self.store.load()),
+        self.numbers(self.in_store_order([SAMPLE_ISSUES[3], replaced])))
+    self.store.replace_repos(['bazelbuild/bazel'], [])
+    self.assertEqual(self.store.load(), [SAMPLE_ISSUES[3]])
+
+  def test_compact(self):
+    bloated = make_issue('bazelbuild/bazel', 4, labels=['P1'])
+    bloated['reactions'] = {'+1': 3, 'url': 'https://api.github.com/x'}
+    bloated['user']['gravatar_id'] = ''
+    bloated['labels'][0]['default'] = False
+    self.store.update([bloated])
+    self.assertEqual(self.store.compact(), 5)
+    self.assertEqual(
+        self.store.load(),
+        self.in_store_order(
+            SAMPLE_ISSUES + [make_issue('bazelbuild/bazel', 4,
+                                        labels=['P1'])]))
+
+  def test_cold_fields(self):
+    issue = self.store.query(repo='bazelbuild/starlark')[0]
+    self.assertNotIn('body', issue)
+    self.assertEqual(self.store.get_cold(issue['url']),
+                     {'body': 'Body of issue 1'})
+    self.assertEqual(database.Issue(issue, cold=self.store.get_cold).body,
+                     'Body of issue 1')
+
+
+class IterJsonArrayTest(unittest.TestCase):
+
+  def parse(self, text, chunk_size):
+    return list(database.iter_json_array(io.StringIO(text), chunk_size))
+
+  def test_chunks(self):
+    values = [{'a': [1, 2, {'b': 'x' * 10}]}, 12345, 'string', None, [], 1.5]
+    text = json.dumps(values, indent=1)
+    for chunk_size in range(1, len(text) + 2):
+      self.assertEqual(self.parse(text, chunk_size), values, chunk_size)
+    self.assertEqual(self.parse(' [ ] ', 1), [])
+
+  def test_invalid(self):
+    with self.assertRaises(ValueError):
+      self.parse('{"a": 1}', 4)
+    with self.assertRaises(ValueError):
+      self.parse('[{"a": 1}, {"b"', 4)
+
+
+class JsonIssueStoreTest(IssueStoreTestBase, unittest.TestCase):
+
+  def make_store(self, tmp_dir):
+    return database.JsonIssueStore(os.path.join(tmp_dir, 'issues.json'))
+
+  def test_inline_cold_fields_move_out(self):
+    # A store written before the cold fields were split off.
+    with open(self.store.path, 'w') as out:
+      json.dump(SAMPLE_ISSUES, out)
+    os.remove(self.store.cold_path)
+    store = database.JsonIssueStore(self.store.path)
+    self.assertEqual(store.query()[0]['body'], 'Body of issue 1')
+    store.update([make_issue('bazelbuild/bazel', 4)])
+    store.merge_log()
+    with open(store.path) as inp:
+      self.assertFalse(any('body' in issue for issue in json.load(inp)))
+    self.assertEqual(store.load()[:4], SAMPLE_ISSUES)
+
+  def test_update_appends_to_log(self):
+    mtime = os.stat(self.store.path).st_mtime_ns
+    changed = make_issue('bazelbuild/bazel', 2, labels=['P1'])
+    self.store.update([changed])
+    self.assertEqual(os.stat(self.store.path).st_mtime_ns, mtime)
+    self.assertTrue(os.path.exists(self.store.log_path))
+    reopened = database.JsonIssueStore(self.store.path)
+    self.assertEqual(reopened.load()[1], changed)
+    reopened.merge_log()
+    self.assertFalse(os.path.exists(self.store.log_path))
+    self.assertEqual(reopened.load()[1], changed)
+
+  def test_torn_log_record_is_ignored(self):
+    self.store.update([make_issue('bazelbuild/bazel', 4)])
+    with open(self.store.log_path, 'a') as log:
+      log.write('{"url": "https://api.gi')
+    self.assertEqual(len(self.store.load()), 5)
+
+  def test_update_after_torn_log_record(self):
+    self.store.update([make_issue('bazelbuild/bazel', 4)])
+    with open(self.store.log_path, 'a') as log:
+      log.write('{"url": "https://api.gi')
+    changed = make_issue('bazelbuild/bazel', 2, labels=['P1'])
+    self.store.update([changed])
+    reopened = database.JsonIssueStore(self.store.path)
+    self.assertEqual(len(reopened.load()), 5)
+    self.assertEqual(reopened.load()[1], changed)
+
+  def test_log_is_merged_past_threshold(self):
+    store = database.JsonIssueStore(self.store.path, max_log_bytes=1000)
+    store.update([make_issue('bazelbuild/bazel', 4)])
+    self.assertTrue(os.path.exists(store.log_path))
+    store.update([make_issue('bazelbuild/bazel', n) for n in range(5, 10)])
+    self.assertFalse(os.path.exists(store.log_path))
+    self.assertEqual(len(store.load()), 10)
+
+
+class GzipJsonIssueStoreTest(IssueStoreTestBase, unittest.TestCase):
+
+  def make_store(self, tmp_dir):
+    return database.JsonIssueStore(os.path.join(tmp_dir, 'issues.json.gz'))
+
+  def test_file_is_compressed(self):
+    with gzip.open(self.store.path, 'rt') as inp:
+      self.assertEqual(len(json.load(inp)), len(SAMPLE_ISSUES))
+
+  def test_convert(self):
+    with mock.patch.object(database, 'all_issues_file',
+                           os.path.join(self.tmp.name, 'issues.json')):
+      count, _, _ = database.convert_json_store('', self.store.path)
+      self.assertEqual(count, len(SAMPLE_ISSUES))
+      self.assertEqual(database.json_store_path(), database.all_issues_file)
+      self.assertFalse(os.path.exists(self.store.path))
+      self.assertEqual(database.open_store().load(), SAMPLE_ISSUES)
+
+
+@unittest.skipUnless(database.zstandard, 'needs the zstandard module')
+class ZstdJsonIssueStoreTest(IssueStoreTestBase, unittest.TestCase):
+
+  def make_store(self, tmp_dir):
+    return database.JsonIssueStore(os.path.join(tmp_dir, 'issues.json.zst'))
+
+
+class JsonIssueStoreSnapshotTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp.name, 'issues.json')
+    database.JsonIssueStore(self.path, use_snapshot=False).save(SAMPLE_ISSUES)
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_snapshot_is_built_and_used(self):
+    store = database.JsonIssueStore(self.path)
+    self.assertEqual(store.load(), SAMPLE_ISSUES)
+    self.assertTrue(os.path.exists(store.snapshot_path))
+    # Make the JSON unreadable, without changing the snapshot key.
+    st = os.stat(self.path)
+    with open(self.path, 'r+') as f:
+      f.write('X')
+    os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    with self.assertRaises(ValueError):
+      database.JsonIssueStore(self.path, use_snapshot=False).load()
+    # The sampled hash still notices.
+    with self.assertRaises(ValueError):
+      store.load()
+
+  def test_stale_snapshot_is_rebuilt(self):
+    store = database.JsonIssueStore(self.path)
+    store.load()
+    database.JsonIssueStore(self.path, use_snapshot=False).save(
+        SAMPLE_ISSUES[:1])
+    self.assertEqual(store.load(), SAMPLE_ISSUES[:1])
+
+  def test_scan_reads_snapshot(self):
+    store = database.JsonIssueStore(self.path)
+    store._SNAPSHOT_CHUNK = 3
+    store.save(SAMPLE_ISSUES)
+    expected = database.JsonIssueStore(self.path, use_snapshot=False).query()
+    with mock.patch.object(database, 'iter_json_array',
+                           side_effect=AssertionError('JSON read')):
+      self.assertEqual(list(store.scan()), expected)
+
+  def test_scan_after_truncated_snapshot(self):
+    store = database.JsonIssueStore(self.path)
+    store._SNAPSHOT_CHUNK = 3
+    store.save(SAMPLE_ISSUES)
+    expected = database.JsonIssueStore(self.path, use_snapshot=False).query()
+    # Cut off the end marker and the last chunk, the first chunk still reads.
+    size = os.path.getsize(store.snapshot_path)
+    with open(store.snapshot_path, 'r+b') as f:
+      f.truncate(size - 10)
+    self.assertEqual(list(store.scan()), expected)
+    self.assertEqual(store.query(), expected)
+
+
+class ShardedIssueStoreTest(IssueStoreTestBase, unittest.TestCase):
+
+  def make_store(self, tmp_dir):
+    return database.ShardedIssueStore(os.path.join(tmp_dir, 'issues'))
+
+  def in_store_order(self, issues):
+    return sorted(issues, key=database.repo_name)
+
+  def test_update_writes_only_its_shard(self):
+    starlark = self.store.shard('bazelbuild/starlark')
+    mtime = os.stat(starlark.path).st_mtime_ns
+    self.store.update([make_issue('bazelbuild/bazel', 4)])
+    self.assertEqual(os.stat(starlark.path).st_mtime_ns, mtime)
+    self.assertFalse(os.path.exists(starlark.log_path))
+    self.store.update([make_issue('bazelbuild/buildtools', 1)])
+    self.assertEqual(self.store.repos(), ['bazelbuild/bazel',
+                                          'bazelbuild/buildtools',
+                                          'bazelbuild/starlark'])
+
+  def test_replace_repos_writes_only_their_shards(self):
+    starlark = self.store.shard('bazelbuild/starlark')
+    mtime = os.stat(starlark.path).st_mtime_ns
+    self.store.replace_repos(['bazelbuild/bazel'],
+                             [make_issue('bazelbuild/bazel', 4)])
+    self.assertEqual(os.stat(starlark.path).st_mtime_ns, mtime)
+    self.assertEqual(self.store.repos(), ['bazelbuild/bazel',
+                                          'bazelbuild/starlark'])
+
+  def test_save_drops_missing_repos(self):
+    self.store.save(SAMPLE_ISSUES[:3])
+    self.assertEqual(self.store.repos(), ['bazelbuild/bazel'])
+
+  def test_shard_store(self):
+    json_path = os.path.join(self.tmp.name, 'all.json')
+    shard_dir = os.path.join(self.tmp.name, 'shards')
+    database.JsonIssueStore(json_path).save(SAMPLE_ISSUES)
+    self.assertEqual(database.shard_store(json_path, shard_dir), 2)
+    self.assertEqual(database.ShardedIssueStore(shard_dir).load(),
+                     SAMPLE_ISSUES)
+
+
+class SqliteIssueStoreTest(IssueStoreTestBase, unittest.TestCase):
+
+  def make_store(self, tmp_dir):
+    return database.SqliteIssueStore(os.path.join(tmp_dir, 'issues.db'))
+
+  def tearDown(self):
+    self.store.close()
+    super(SqliteIssueStoreTest, self).tearDown()
+
+  def test_migrate(self):
+    json_path = os.path.join(self.tmp.name, 'all.json')
+    db_path = os.path.join(self.tmp.name, 'all.db')
+    database.JsonIssueStore(json_path).save(SAMPLE_ISSUES)
+    self.assertEqual(database.migrate_to_sqlite(json_path, db_path), 4)
+    store = database.SqliteIssueStore(db_path)
+    self.assertEqual(store.load(), SAMPLE_ISSUES)
+    store.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
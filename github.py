@@ -1,23 +1,50 @@
 """Methods for talking to the github API."""
 
+import concurrent.futures
 import datetime
 import json
-import urllib.request
 import ssl
+import urllib.error
+import urllib.parse
 
 import database
+import http_cache
+import http_client
+import rate_limit
 import reports
 
 ssl._create_default_https_context = ssl._create_unverified_context
 secrets = json.load(open("secrets.json"))
 client_id = secrets["client_id"]
 client_secret = secrets["client_secret"]
+# The GraphQL API does not accept OAuth app credentials, only tokens.
+token = secrets.get("token")
 
 
 GITHUB_API_URL_BASE = 'https://api.github.com/repos/'
+GITHUB_GRAPHQL_URL = 'https://api.github.com/graphql'
+
+_PER_PAGE = 100
 
 _DEBUG = False
 
+# Responses which rarely change are revalidated against this cache rather than
+# downloaded again. Set to None to disable.
+response_cache = http_cache.ResponseCache()
+
+# All requests go through this, so it sees the whole rate limit budget.
+scheduler = rate_limit.Scheduler()
+
+
+def set_max_requests_per_host(max_requests):
+    """Caps the number of concurrent requests to a single host.
+
+    Fetchers may run in several threads, but GitHub does not like too many
+    parallel connections from one client.
+    """
+    http_client.default_pool.set_max_per_host(max_requests)
+
+
 def add_client_secret(url):
     sep = '&'
     if not '?' in url:
@@ -25,66 +52,476 @@ def add_client_secret(url):
     return url + sep + 'client_id=' + client_id + '&client_secret=' + client_secret
 
 
-def get_next_url(response):
+def _strip_client_secret(url):
+    """Removes the credentials GitHub echoes back in Link URLs.
+
+    We add them to every request anyway, and do not want them in checkpoints
+    or cache keys.
+    """
+    parts = urllib.parse.urlsplit(url)
+    query = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query)
+             if k not in ('client_id', 'client_secret')]
+    return urllib.parse.urlunsplit(
+        parts._replace(query=urllib.parse.urlencode(query, safe=':')))
+
+
+def get_links(response):
+    """Parses the Link header of a response into a dict of rel -> url."""
     if "Link" not in response:
+        return {}
+    ret = {}
+    for link_segment in response["Link"].split(","):
+        start = link_segment.find('rel="')
+        if start == -1:
+            continue
+        rel = link_segment[start + 5:link_segment.index('"', start + 5)]
+        ret[rel] = _strip_client_secret(
+            link_segment[link_segment.index('<') + 1:link_segment.index('>')])
+    return ret
+
+
+def get_next_url(response):
+    return get_links(response).get("next")
+
+
+def _set_page(url, page):
+    parts = urllib.parse.urlsplit(url)
+    query = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query)
+             if k != 'page']
+    query.append(('page', str(page)))
+    return urllib.parse.urlunsplit(
+        parts._replace(query=urllib.parse.urlencode(query, safe=':')))
+
+
+def get_remaining_page_urls(response):
+    """Returns the URLs of all pages after the current one.
+
+    GitHub includes a rel="last" link for page numbered result sets, which
+    tells us up front how many pages there are. Returns None if the response
+    does not carry enough information to compute that.
+    """
+    links = get_links(response)
+    if "next" not in links or "last" not in links:
         return None
-    link_header = response["Link"]
-    links = link_header.split(",")
-    for link_segment in links:
-        if link_segment.find("rel=\"next\"") == -1:
+    try:
+        first = int(dict(urllib.parse.parse_qsl(
+            urllib.parse.urlsplit(links["next"]).query))["page"])
+        last = int(dict(urllib.parse.parse_qsl(
+            urllib.parse.urlsplit(links["last"]).query))["page"])
+    except (KeyError, ValueError):
+        return None
+    return [_set_page(links["next"], page) for page in range(first, last + 1)]
+
+
+def _get(url, use_cache=False, etag=None):
+    """Fetches a URL over a pooled keep-alive connection.
+
+    Args:
+      url: (str) the URL, without client credentials.
+      use_cache: (bool) revalidate against and update response_cache.
+      etag: (str) optional ETag of a response the caller already has.
+    Returns:
+      (decoded JSON body, response headers). The body is None if the
+      response matched etag.
+    """
+    if _DEBUG:
+        print(url)
+    cache = response_cache if use_cache else None
+    entry = cache.get(url) if cache else None
+    headers = cache.conditional_headers(entry) if entry else {}
+    if etag:
+        headers['If-None-Match'] = etag
+    response = _request('GET', add_client_secret(url), headers)
+    if response.status == 304:
+        scheduler.record_cache_hit()
+        if not entry:
+            return None, response.info()
+        response = cache.hit(entry)
+    elif cache:
+        cache.put(url, response)
+    return json.loads(response.read()), response.info()
+
+
+def _request(method, url, headers, body=None):
+    """Sends a request, waiting out and retrying rate limit errors."""
+    attempt = 0
+    while True:
+        scheduler.before_request()
+        try:
+            response = http_client.default_pool.request(
+                method, url, headers=headers, body=body)
+        except urllib.error.HTTPError as e:
+            error_body = e.read() if e.code in (403, 429) else None
+            if not scheduler.should_retry(e.code, e.headers, error_body,
+                                          attempt):
+                raise
+            attempt += 1
             continue
-        link = link_segment[link_segment.index('<') +
-                            1:link_segment.index('>')]
-        return link
-    return None
+        scheduler.after_response(response.info())
+        return response
 
 
-def fetch_issues(repo, query, modified_after=None, verbose=False):
+def fetch_issues(repo, query, modified_after=None, verbose=False,
+                 page_jobs=1, checkpoint=None, sync_state=None):
     """Fetches issues from a repo.
 
     Args:
       repo: (str) '<organization>/<repo>'
       query: (str) optional query
       modified_after: (float) only fetch issues modified after this (UTC) time.
+      page_jobs: (int) number of pages to fetch concurrently. Only used if the
+          first page tells us how many pages there are.
+      checkpoint: (checkpoint.RepoCheckpoint) optional checkpoint to resume
+          from and record each fetched page to.
+      sync_state: (dict) optional. If it has the 'etag' of an earlier fetch
+          of the same query, the first page is requested conditionally, and
+          nothing is fetched if it did not change. Updated with the new ETag.
     """
     query_args = [
         'state=all',  # needed to get closed issues
-        'per_page=100',
+        'per_page=%d' % _PER_PAGE,
     ]
     if query:
         query_args.append(query)
     if modified_after:
-        utc_time_s = datetime.datetime.utcfromtimestamp(
-            modified_after).strftime('%Y-%m-%dT%H:%M:%SZ')
+        utc_time_s = _format_time(modified_after)
         query_args.append('since=%s' % utc_time_s)
         if verbose:
             print('Fetching issues changed since: %s' % utc_time_s)
     url = GITHUB_API_URL_BASE + repo + '/issues?' + '&'.join(query_args)
     result = dict()
-    i = 0
-    while url:
-        if _DEBUG:
-            print(url)
-        response = urllib.request.urlopen(add_client_secret(url))
-        issues = json.loads(response.read())
+    start_url = url
+    if checkpoint:
+        url, issues = checkpoint.resume(start_url)
         for issue in issues:
             result[issue["number"]] = issue
-        url = get_next_url(response.info())
+        if verbose and url != start_url:
+            print('Resuming %s with %d issues at %s' % (repo, len(result), url))
+    etag = sync_state.get('etag') if sync_state else None
+    try:
+        while url:
+            issues, headers = _get(url, etag=etag if url == start_url else None)
+            if issues is None:
+                if verbose:
+                    print('No changes in %s' % repo)
+                break
+            if url == start_url and sync_state is not None:
+                # An unchanged first page only means nothing changed if it
+                # held the whole result. Otherwise an update could have
+                # landed on a later page.
+                complete = len(issues) < _PER_PAGE and not get_next_url(headers)
+                sync_state['etag'] = headers.get('ETag') if complete else None
+            for issue in issues:
+                result[issue["number"]] = issue
+            page_urls = get_remaining_page_urls(headers)
+            if page_jobs > 1 and page_urls:
+                if checkpoint:
+                    checkpoint.page_done(page_urls[0], issues)
+                with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=page_jobs) as executor:
+                    # map() yields in page order, so later pages still win when
+                    # an issue moved between pages during the fetch, and the
+                    # checkpoint always covers a contiguous run of pages.
+                    pages = executor.map(_get, page_urls)
+                    for i, (issues, _) in enumerate(pages):
+                        for issue in issues:
+                            result[issue["number"]] = issue
+                        if checkpoint:
+                            checkpoint.page_done(
+                                page_urls[i + 1] if i + 1 < len(page_urls)
+                                else None, issues)
+                break
+            url = get_next_url(headers)
+            if checkpoint:
+                checkpoint.page_done(url, issues)
+    finally:
+        if checkpoint:
+            checkpoint.close()
     if verbose or _DEBUG:
       print('%d issues' % len(result))
     return list(result.values())
 
 
+#
+# GraphQL backend
+#
+
+class GraphQLError(Exception):
+    pass
+
+
+# Fields of the items of the lists an issue has.
+_GRAPHQL_ITEM_FIELDS = {
+    'assignees': 'login url',
+    'labels': 'name color',
+}
+
+
+# Number of issues whose remaining assignees or labels are fetched together.
+_GRAPHQL_ISSUES_PER_QUERY = 50
+
+
+def _graphql_items(connection, args):
+    return '%s(%s) { pageInfo { hasNextPage endCursor } nodes { %s } }' % (
+        connection, args, _GRAPHQL_ITEM_FIELDS[connection])
+
+
+# Only what reports.py and the HTML page read. Everything else the REST API
+# sends (reactions, full user objects, *_url templates) is never looked at.
+# Issues with more assignees or labels than fit in here get the rest in
+# follow-up queries.
+_GRAPHQL_FIELDS = """
+    number title body state url createdAt updatedAt closedAt
+    author { login url }
+    %s
+    %s
+""" % (_graphql_items('assignees', 'first: 20'),
+       _graphql_items('labels', 'first: 50'))
+
+_GRAPHQL_FRAGMENTS = {
+    'IssueFields': 'fragment IssueFields on Issue { %s }' % _GRAPHQL_FIELDS,
+    'PullRequestFields':
+        'fragment PullRequestFields on PullRequest { %s }' % _GRAPHQL_FIELDS,
+}
+
+
+def _graphql(query):
+    if not token:
+        raise GraphQLError('The GraphQL API needs a "token" in secrets.json')
+    if _DEBUG:
+        print(query)
+    response = _request(
+        'POST', GITHUB_GRAPHQL_URL,
+        {'Authorization': 'bearer ' + token,
+         'Content-Type': 'application/json'},
+        body=json.dumps({'query': query}).encode('utf-8'))
+    return json.loads(response.read())
+
+
+def _format_time(t):
+    return datetime.datetime.fromtimestamp(t, datetime.timezone.utc).strftime(
+        '%Y-%m-%dT%H:%M:%SZ')
+
+
+def _graphql_user(user):
+    # Deleted accounts come back as null.
+    if not user:
+        return {'login': 'ghost', 'html_url': 'https://github.com/ghost'}
+    return {'login': user['login'], 'html_url': user['url']}
+
+
+def _graphql_label(repository_url, label):
+    return {
+        'name': label['name'],
+        'color': label['color'],
+        'url': '%s/labels/%s' % (
+            repository_url, urllib.parse.quote(label['name'])),
+    }
+
+
+def _add_graphql_items(issue, connection, nodes):
+    """Adds assignees or labels from a GraphQL page to a converted issue."""
+    if connection == 'assignees':
+        issue['assignees'].extend(_graphql_user(u) for u in nodes)
+        if issue['assignees'] and not issue['assignee']:
+            issue['assignee'] = issue['assignees'][0]
+    else:
+        issue['labels'].extend(_graphql_label(issue['repository_url'], label)
+                               for label in nodes)
+
+
+def _graphql_to_issue(repo, node, is_pull_request):
+    """Converts a GraphQL node to the subset of the REST issue we use."""
+    repository_url = GITHUB_API_URL_BASE + repo
+    issue = {
+        'url': '%s/issues/%d' % (repository_url, node['number']),
+        'repository_url': repository_url,
+        'html_url': node['url'],
+        'number': node['number'],
+        'title': node['title'],
+        'body': node['body'],
+        # Merged pull requests are closed as far as the REST API is concerned.
+        'state': 'open' if node['state'] == 'OPEN' else 'closed',
+        'created_at': node['createdAt'],
+        'updated_at': node['updatedAt'],
+        'closed_at': node['closedAt'],
+        'user': _graphql_user(node['author']),
+        'assignee': None,
+        'assignees': [],
+        'labels': [],
+    }
+    for connection in _GRAPHQL_ITEM_FIELDS:
+        _add_graphql_items(issue, connection, node[connection]['nodes'])
+    if is_pull_request:
+        issue['pull_request'] = {
+            'url': '%s/pulls/%d' % (repository_url, node['number']),
+            'html_url': node['url'],
+        }
+    return issue
+
+
+def fetch_issues_graphql(repos, repo_to_since=None, verbose=False):
+    """Fetches issues and pull requests of several repos with GraphQL.
+
+    All repos are queried together, 100 issues and 100 pull requests per repo
+    per request, and only the fields we use are transferred. The records have
+    the same shape as the REST ones, restricted to those fields.
+
+    Args:
+      repos: (list of str) '<organization>/<repo>'
+      repo_to_since: (dict) repo -> (float) only fetch issues modified after
+          this (UTC) time.
+    Returns:
+      (repo -> list of issues, repo -> error) for the repos which could and
+      could not be fetched.
+    """
+    repo_to_since = repo_to_since or {}
+    results = {repo: {} for repo in repos}
+    errors = {}
+    # (alias, connection) -> cursor of the next page, for connections with
+    # more pages.
+    pending = {}
+    # (repo, number, 'assignees' or 'labels') -> cursor of the next page, for
+    # issues with more of them than the first query fetched.
+    truncated = {}
+    for i in range(len(repos)):
+        pending[('r%d' % i, 'issues')] = None
+        pending[('r%d' % i, 'pullRequests')] = None
+
+    while pending:
+        parts = []
+        # GraphQL rejects queries with unused fragments.
+        fragments = set()
+        for i, repo in enumerate(repos):
+            alias = 'r%d' % i
+            since = repo_to_since.get(repo)
+            connections = []
+            for connection in ('issues', 'pullRequests'):
+                if (alias, connection) not in pending:
+                    continue
+                args = ['first: 100']
+                cursor = pending[(alias, connection)]
+                if cursor:
+                    args.append('after: %s' % json.dumps(cursor))
+                if connection == 'issues':
+                    args.append('orderBy: {field: UPDATED_AT, direction: ASC}')
+                    if since:
+                        args.append('filterBy: {since: "%s"}'
+                                    % _format_time(since))
+                    fragment = 'IssueFields'
+                else:
+                    # Pull requests can not be filtered by update time, so
+                    # page from newest to oldest and stop at `since`.
+                    args.append(
+                        'orderBy: {field: UPDATED_AT, direction: DESC}')
+                    fragment = 'PullRequestFields'
+                fragments.add(fragment)
+                connections.append(
+                    '%s(%s) { pageInfo { hasNextPage endCursor } '
+                    'nodes { ...%s } }' % (connection, ', '.join(args),
+                                           fragment))
+            if connections:
+                owner, name = repo.split('/')
+                parts.append('%s: repository(owner: %s, name: %s) { %s }' % (
+                    alias, json.dumps(owner), json.dumps(name),
+                    ' '.join(connections)))
+        data = _graphql('query { %s }\n%s' % (
+            ' '.join(parts),
+            '\n'.join(_GRAPHQL_FRAGMENTS[f] for f in sorted(fragments))))
+        if not data.get('data'):
+            raise GraphQLError(data.get('errors'))
+        for error in data.get('errors') or []:
+            alias = (error.get('path') or [None])[0]
+            if alias and alias.startswith('r'):
+                errors[repos[int(alias[1:])]] = GraphQLError(error['message'])
+
+        for (alias, connection) in list(pending):
+            repo = repos[int(alias[1:])]
+            repository = data['data'].get(alias)
+            if repo in errors or not repository:
+                errors.setdefault(repo, GraphQLError('%s not found' % repo))
+                del pending[(alias, connection)]
+                continue
+            page = repository[connection]
+            since = repo_to_since.get(repo)
+            since_s = _format_time(since) if since else None
+            done = not page['pageInfo']['hasNextPage']
+            for node in page['nodes']:
+                if since_s and node['updatedAt'] < since_s:
+                    done = True
+                    continue
+                issue = _graphql_to_issue(repo, node,
+                                          connection == 'pullRequests')
+                results[repo][issue['number']] = issue
+                for items in _GRAPHQL_ITEM_FIELDS:
+                    if node[items]['pageInfo']['hasNextPage']:
+                        truncated[(repo, issue['number'], items)] = (
+                            node[items]['pageInfo']['endCursor'])
+            if done:
+                del pending[(alias, connection)]
+            else:
+                pending[(alias, connection)] = page['pageInfo']['endCursor']
+
+    _fetch_remaining_items(
+        {key: cursor for key, cursor in truncated.items()
+         if key[0] not in errors},
+        results)
+
+    ret = {}
+    for repo in repos:
+        if repo not in errors:
+            ret[repo] = list(results[repo].values())
+            if verbose or _DEBUG:
+                print('%s: %d issues' % (repo, len(ret[repo])))
+    return ret, errors
+
+
+def _fetch_remaining_items(truncated, results):
+    """Fetches the assignees and labels the issue queries left out.
+
+    Args:
+      truncated: (dict) (repo, number, 'assignees' or 'labels') -> cursor to
+          continue from.
+      results: (dict) repo -> number -> issue, the issues to add them to.
+    """
+    while truncated:
+        parts = []
+        keys = list(truncated)[:_GRAPHQL_ISSUES_PER_QUERY]
+        for i, (repo, number, connection) in enumerate(keys):
+            items = _graphql_items(connection, 'first: 100, after: %s'
+                                   % json.dumps(truncated.pop(
+                                       (repo, number, connection))))
+            owner, name = repo.split('/')
+            parts.append(
+                't%d: repository(owner: %s, name: %s) { '
+                'issueOrPullRequest(number: %d) { '
+                '... on Issue { %s } ... on PullRequest { %s } } }' % (
+                    i, json.dumps(owner), json.dumps(name), number, items,
+                    items))
+        data = _graphql('query { %s }' % ' '.join(parts))
+        if not data.get('data'):
+            raise GraphQLError(data.get('errors'))
+        for i, key in enumerate(keys):
+            repo, number, connection = key
+            # Issues deleted since the first query come back as null.
+            node = (data['data'].get('t%d' % i) or {}).get(
+                'issueOrPullRequest')
+            if not node:
+                continue
+            page = node[connection]
+            _add_graphql_items(results[repo][number], connection,
+                               page['nodes'])
+            if page['pageInfo']['hasNextPage']:
+                truncated[key] = page['pageInfo']['endCursor']
+
+
 def _fetch_all_from_repo(repo, resource):
     ret = []
     url = GITHUB_API_URL_BASE + repo + '/' + resource
     while url:
-        if _DEBUG:
-            print(url)
-        response = urllib.request.urlopen(add_client_secret(url))
-        more_data = json.loads(response.read())
+        more_data, headers = _get(url, use_cache=True)
         ret += more_data
-        url = get_next_url(response.info())
+        url = get_next_url(headers)
     return ret
 
 
@@ -100,11 +537,8 @@ def fetch_repos(org):
   url = 'https://api.github.com/orgs/' + org + '/repos'
   ret = []
   while url:
-    if _DEBUG:
-      print(url)
-    response = urllib.request.urlopen(add_client_secret(url))
-    more_repos = json.loads(response.read())
+    more_repos, headers = _get(url, use_cache=True)
     for repo in more_repos:
       ret.append(repo['full_name'])
-    url = get_next_url(response.info())
+    url = get_next_url(headers)
   return ret
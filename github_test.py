@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""Tests for github."""
+
+import datetime
+import http.client
+import io
+import time
+import unittest
+import urllib.error
+from unittest import mock
+
+import github
+import http_client
+import rate_limit
+
+
+class RequestTest(unittest.TestCase):
+
+  def setUp(self):
+    self.sent = []
+    self.responses = []
+    patcher = mock.patch.object(github, 'scheduler', rate_limit.Scheduler(
+        clock=lambda: 1000.0, sleep=lambda seconds: None))
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    patcher = mock.patch.object(http_client.default_pool, 'request',
+                                self.request)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def request(self, method, url, headers=None, body=None):
+    self.sent.append((method, body))
+    status, error_body = self.responses.pop(0)
+    headers = http.client.HTTPMessage()
+    if status != 200:
+      headers['Retry-After'] = '0'
+      raise urllib.error.HTTPError(url, status, 'Forbidden', headers,
+                                   io.BytesIO(error_body))
+    return http_client.Response(url, status, headers, b'{}')
+
+  def test_retried_post_sends_body_again(self):
+    self.responses = [(403, b'{"message": "rate limit exceeded"}'),
+                      (429, b'{"message": "too many requests"}'),
+                      (200, None)]
+    response = github._request('POST', github.GITHUB_GRAPHQL_URL, {},
+                               body=b'{"query": "{ viewer { login } }"}')
+    self.assertEqual(response.status, 200)
+    self.assertEqual(self.sent,
+                     [('POST', b'{"query": "{ viewer { login } }"}')] * 3)
+
+
+ISSUES_URL = ('https://api.github.com/repos/bazelbuild/bazel/issues?'
+              'state=all&per_page=100')
+
+
+def page_url(page):
+  return ISSUES_URL + '&page=%d' % page
+
+
+def issue(number, title='Issue'):
+  return {'number': number, 'title': title}
+
+
+class FakeGitHub(object):
+  """Serves pages of issues in place of github._get."""
+
+  def __init__(self):
+    # url -> (issues, headers)
+    self.pages = {}
+    self.requests = []
+
+  def add_page(self, url, issues, next_page=None, last_page=None, etag=None):
+    links = []
+    if next_page:
+      links.append('<%s>; rel="next"' % page_url(next_page))
+    if last_page:
+      links.append('<%s>; rel="last"' % page_url(last_page))
+    headers = {}
+    if links:
+      headers['Link'] = ', '.join(links)
+    if etag:
+      headers['ETag'] = etag
+    self.pages[url] = (issues, headers)
+
+  def get(self, url, use_cache=False, etag=None):
+    self.requests.append(url)
+    issues, headers = self.pages[url]
+    if etag and headers.get('ETag') == etag:
+      return None, headers
+    return issues, headers
+
+
+class FetchIssuesTestBase(unittest.TestCase):
+
+  def setUp(self):
+    self.github = FakeGitHub()
+    patcher = mock.patch.object(github, '_get', self.github.get)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def fetch(self, **kwargs):
+    return github.fetch_issues('bazelbuild/bazel', '', **kwargs)
+
+
+class PagingTest(FetchIssuesTestBase):
+
+  def test_remaining_pages_with_last(self):
+    self.assertEqual(
+        github.get_remaining_page_urls(
+            {'Link': '<%s>; rel="next", <%s>; rel="last"' % (
+                page_url(2), page_url(4))}),
+        [page_url(2), page_url(3), page_url(4)])
+
+  def test_remaining_pages_without_last(self):
+    self.assertIsNone(github.get_remaining_page_urls(
+        {'Link': '<%s>; rel="next"' % page_url(2)}))
+    self.assertIsNone(github.get_remaining_page_urls({}))
+
+  def test_set_page_replaces_page(self):
+    url = ISSUES_URL + '&page=2&since=2019-08-01T10:00:00Z'
+    self.assertEqual(
+        github._set_page(url, 5),
+        ISSUES_URL + '&since=2019-08-01T10:00:00Z&page=5')
+
+  def test_links_without_credentials(self):
+    links = github.get_links(
+        {'Link': '<%s&client_id=x&client_secret=y>; rel="next"' %
+                 page_url(2)})
+    self.assertEqual(links, {'next': page_url(2)})
+
+  def test_sequential_without_last(self):
+    self.github.add_page(ISSUES_URL, [issue(1)], next_page=2)
+    self.github.add_page(page_url(2), [issue(2)], next_page=3)
+    self.github.add_page(page_url(3), [issue(3)])
+    self.assertEqual(self.fetch(page_jobs=4),
+                     [issue(1), issue(2), issue(3)])
+    self.assertEqual(self.github.requests,
+                     [ISSUES_URL, page_url(2), page_url(3)])
+
+  def test_parallel_pages_merge_in_order(self):
+    self.github.add_page(ISSUES_URL, [issue(1), issue(2)], next_page=2,
+                         last_page=4)
+    self.github.add_page(page_url(2), [issue(3), issue(1, 'Moved')])
+    self.github.add_page(page_url(3), [issue(4)])
+    self.github.add_page(page_url(4), [issue(1, 'Moved again')])
+    get = self.github.get
+
+    def slow_early_pages(url, use_cache=False, etag=None):
+      # Later pages finish first.
+      if url != ISSUES_URL:
+        time.sleep(0.01 * (4 - int(url[-1])))
+      return get(url, use_cache, etag)
+
+    with mock.patch.object(github, '_get', slow_early_pages):
+      issues = self.fetch(page_jobs=3)
+    self.assertEqual(sorted(self.github.requests),
+                     sorted([ISSUES_URL] + [page_url(p) for p in (2, 3, 4)]))
+    self.assertEqual(sorted((i['number'], i['title']) for i in issues),
+                     [(1, 'Moved again'), (2, 'Issue'), (3, 'Issue'),
+                      (4, 'Issue')])
+
+
+class ConditionalFetchTest(FetchIssuesTestBase):
+
+  def test_not_modified(self):
+    self.github.add_page(ISSUES_URL, [issue(1)], etag='"v1"')
+    sync_state = {'etag': '"v1"', 'last_update': '2019-08-01T10:00:00Z'}
+    self.assertEqual(self.fetch(sync_state=sync_state), [])
+    self.assertEqual(sync_state,
+                     {'etag': '"v1"', 'last_update': '2019-08-01T10:00:00Z'})
+
+  def test_etag_of_single_page(self):
+    self.github.add_page(ISSUES_URL, [issue(1), issue(2)], etag='"v2"')
+    sync_state = {'etag': '"v1"'}
+    self.assertEqual(self.fetch(sync_state=sync_state), [issue(1), issue(2)])
+    self.assertEqual(sync_state, {'etag': '"v2"'})
+
+  def test_no_etag_of_several_pages(self):
+    self.github.add_page(ISSUES_URL, [issue(1)], next_page=2, etag='"v2"')
+    self.github.add_page(page_url(2), [issue(2)], etag='"p2"')
+    sync_state = {'etag': '"v1"'}
+    self.assertEqual(self.fetch(sync_state=sync_state), [issue(1), issue(2)])
+    self.assertEqual(sync_state, {'etag': None})
+
+  def test_since_in_utc(self):
+    url = ISSUES_URL + '&since=2019-08-01T10:00:00Z'
+    self.github.add_page(url, [issue(1)])
+    modified_after = datetime.datetime(
+        2019, 8, 1, 10, tzinfo=datetime.timezone.utc).timestamp()
+    self.assertEqual(self.fetch(modified_after=modified_after), [issue(1)])
+    self.assertEqual(self.github.requests, [url])
+
+
+def graphql_page(nodes, cursor=None):
+  return {'pageInfo': {'hasNextPage': bool(cursor), 'endCursor': cursor},
+          'nodes': nodes}
+
+
+def graphql_issue(number, assignees, labels):
+  return {
+      'number': number, 'title': 'Issue %d' % number, 'body': '',
+      'state': 'OPEN',
+      'url': 'https://github.com/bazelbuild/bazel/issues/%d' % number,
+      'createdAt': '2019-08-01T00:00:00Z', 'updatedAt': '2019-08-01T00:00:00Z',
+      'closedAt': None, 'author': {'login': 'alice', 'url': 'u/alice'},
+      'assignees': assignees, 'labels': labels,
+  }
+
+
+class GraphQLTest(unittest.TestCase):
+
+  def setUp(self):
+    self.queries = []
+    self.responses = []
+    patcher = mock.patch.object(github, '_graphql', self.graphql)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def graphql(self, query):
+    self.queries.append(query)
+    return {'data': self.responses.pop(0)}
+
+  def test_fetches_remaining_labels_and_assignees(self):
+    self.responses = [
+        {'r0': {
+            'issues': graphql_page([
+                graphql_issue(1, graphql_page([]),
+                              graphql_page([{'name': 'P1', 'color': 'f'}],
+                                           cursor='l1')),
+                graphql_issue(2, graphql_page([{'login': 'bob',
+                                                'url': 'u/bob'}]),
+                              graphql_page([])),
+            ]),
+            'pullRequests': graphql_page([]),
+        }},
+        {'t0': {'issueOrPullRequest': {
+            'labels': graphql_page([{'name': 'team-Core', 'color': 'f'}],
+                                   cursor='l2')}}},
+        {'t0': {'issueOrPullRequest': {
+            'labels': graphql_page([{'name': 'bug', 'color': 'f'}])}}},
+    ]
+    results, errors = github.fetch_issues_graphql(['bazelbuild/bazel'])
+    self.assertEqual(errors, {})
+    issues = {issue['number']: issue for issue in results['bazelbuild/bazel']}
+    self.assertEqual([label['name'] for label in issues[1]['labels']],
+                     ['P1', 'team-Core', 'bug'])
+    self.assertIsNone(issues[1]['assignee'])
+    self.assertEqual(issues[2]['assignee']['login'], 'bob')
+    self.assertEqual(len(self.queries), 3)
+    self.assertIn('issueOrPullRequest(number: 1)', self.queries[1])
+    self.assertIn('after: "l1"', self.queries[1])
+    self.assertIn('after: "l2"', self.queries[2])
+
+  def test_format_time(self):
+    t = datetime.datetime(
+        2019, 8, 1, 10, tzinfo=datetime.timezone.utc).timestamp()
+    self.assertEqual(github._format_time(t), '2019-08-01T10:00:00Z')
+
+
+if __name__ == '__main__':
+  unittest.main()
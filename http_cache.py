@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""On disk cache of GitHub API responses, revalidated with conditional requests.
+
+Labels, releases and the list of repositories in an org rarely change, but we
+used to download them in full on every run. The cache keeps the last response
+for each URL together with its ETag and Last-Modified headers. The next
+request for the URL sends If-None-Match / If-Modified-Since, and if GitHub
+answers 304 Not Modified we serve the body from disk. GitHub does not count
+304 responses against the rate limit.
+
+Usage:
+  http_cache.py stats   - show the number and size of cached responses
+  http_cache.py list    - list the cached URLs
+  http_cache.py clear   - remove all cached responses
+  http_cache.py evict   - shrink the cache to --max_bytes
+"""
+
+import argparse
+import collections
+import hashlib
+import http.client
+import json
+import os
+import tempfile
+import time
+
+import http_client
+
+
+DEFAULT_CACHE_DIR = '.http_cache'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Response headers worth replaying from the cache. Link is needed to keep
+# paging through a cached result set.
+_KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Link')
+
+CacheEntry = collections.namedtuple(
+    'CacheEntry', ['url', 'etag', 'last_modified', 'headers', 'body'])
+
+
+class ResponseCache(object):
+  """A size bounded cache of responses, one file per URL.
+
+  Entries are evicted least recently used first, using the file modification
+  time as the access time.
+  """
+
+  def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+
+  def _path(self, url):
+    return os.path.join(self.cache_dir,
+                        hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+  @staticmethod
+  def _read(path):
+    with open(path, 'rb') as inp:
+      meta = json.loads(inp.readline())
+      body = inp.read()
+    return CacheEntry(
+        url=meta['url'],
+        etag=meta.get('etag'),
+        last_modified=meta.get('last_modified'),
+        headers=meta.get('headers', {}),
+        body=body)
+
+  def get(self, url):
+    """Returns the CacheEntry for url, or None."""
+    try:
+      return self._read(self._path(url))
+    except (FileNotFoundError, ValueError):
+      return None
+
+  @staticmethod
+  def conditional_headers(entry):
+    """Returns the request headers to revalidate a cache entry."""
+    ret = {}
+    if entry.etag:
+      ret['If-None-Match'] = entry.etag
+    if entry.last_modified:
+      ret['If-Modified-Since'] = entry.last_modified
+    return ret
+
+  def hit(self, entry):
+    """Returns a Response built from a still valid cache entry."""
+    try:
+      os.utime(self._path(entry.url))
+    except FileNotFoundError:
+      pass
+    headers = http.client.HTTPMessage()
+    for name, value in entry.headers.items():
+      headers[name] = value
+    return http_client.Response(entry.url, 200, headers, entry.body,
+                                from_cache=True)
+
+  def put(self, url, response):
+    """Stores a response, if it carries a validator we can revalidate with."""
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if not etag and not last_modified:
+      return
+    meta = {
+        'url': url,
+        'etag': etag,
+        'last_modified': last_modified,
+        'headers': {name: response.headers[name] for name in _KEPT_HEADERS
+                    if name in response.headers},
+    }
+    os.makedirs(self.cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp')
+    with os.fdopen(fd, 'wb') as out:
+      out.write(json.dumps(meta).encode('utf-8'))
+      out.write(b'\n')
+      out.write(response.body)
+    os.replace(tmp_path, self._path(url))
+    self.evict()
+
+  def _files(self):
+    try:
+      with os.scandir(self.cache_dir) as it:
+        return [(e.path, e.stat()) for e in it
+                if e.is_file() and not e.name.startswith('.tmp')]
+    except FileNotFoundError:
+      return []
+
+  def size(self):
+    """Returns (number of cached responses, total bytes)."""
+    files = self._files()
+    return len(files), sum(st.st_size for _, st in files)
+
+  def evict(self, max_bytes=None):
+    """Removes the least recently used entries until under max_bytes."""
+    if max_bytes is None:
+      max_bytes = self.max_bytes
+    files = sorted(self._files(), key=lambda f: f[1].st_mtime)
+    total = sum(st.st_size for _, st in files)
+    removed = 0
+    for path, st in files:
+      if total <= max_bytes:
+        break
+      os.remove(path)
+      total -= st.st_size
+      removed += 1
+    return removed
+
+  def entries(self):
+    """Yields (CacheEntry, size, access time) for each cached response."""
+    for path, st in self._files():
+      try:
+        yield self._read(path), st.st_size, st.st_mtime
+      except ValueError:
+        continue
+
+  def clear(self):
+    files = self._files()
+    for path, _ in files:
+      os.remove(path)
+    return len(files)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Inspect or clear the GitHub API response cache')
+  parser.add_argument(
+      '--cache_dir', default=DEFAULT_CACHE_DIR,
+      help='Cache directory (default %s)' % DEFAULT_CACHE_DIR)
+  subparsers = parser.add_subparsers(dest='command', help='select a command')
+  subparsers.add_parser('stats', help='show cache size')
+  subparsers.add_parser('list', help='list cached URLs')
+  subparsers.add_parser('clear', help='remove all cached responses')
+  evict_parser = subparsers.add_parser(
+      'evict', help='shrink the cache to a size limit')
+  evict_parser.add_argument(
+      '--max_bytes', type=int, default=DEFAULT_MAX_BYTES,
+      help='size to shrink the cache to')
+
+  args = parser.parse_args()
+  cache = ResponseCache(args.cache_dir)
+  if args.command == 'stats':
+    print('%d responses, %d bytes' % cache.size())
+  elif args.command == 'list':
+    for entry, size, atime in sorted(cache.entries(), key=lambda e: e[2]):
+      print('%s | %8d | %s' % (
+          time.strftime('%Y-%m-%d %H:%M', time.localtime(atime)), size,
+          entry.url))
+  elif args.command == 'clear':
+    print('Removed %d responses' % cache.clear())
+  elif args.command == 'evict':
+    print('Removed %d responses' % cache.evict(args.max_bytes))
+  else:
+    parser.print_usage()
+
+
+if __name__ == '__main__':
+  main()
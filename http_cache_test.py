@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Tests for http_cache."""
+
+import http.client
+import os
+import tempfile
+import unittest
+
+import http_cache
+import http_client
+
+
+def make_response(body, etag=None, link=None):
+  headers = http.client.HTTPMessage()
+  if etag:
+    headers['ETag'] = etag
+  if link:
+    headers['Link'] = link
+  return http_client.Response('http://example.com', 200, headers, body)
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.cache = http_cache.ResponseCache(
+        os.path.join(self.tmp.name, 'cache'), max_bytes=1000)
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_round_trip(self):
+    self.cache.put('http://a/labels', make_response(
+        b'[1, 2]', etag='"x"', link='<http://a/labels?page=2>; rel="next"'))
+    entry = self.cache.get('http://a/labels')
+    self.assertEqual(entry.etag, '"x"')
+    self.assertEqual(self.cache.conditional_headers(entry),
+                     {'If-None-Match': '"x"'})
+    response = self.cache.hit(entry)
+    self.assertTrue(response.from_cache)
+    self.assertEqual(response.read(), b'[1, 2]')
+    self.assertEqual(response.info()['link'],
+                     '<http://a/labels?page=2>; rel="next"')
+
+  def test_no_validator_is_not_cached(self):
+    self.cache.put('http://a/labels', make_response(b'[]'))
+    self.assertIsNone(self.cache.get('http://a/labels'))
+
+  def test_evicts_least_recently_used(self):
+    for i in range(3):
+      url = 'http://a/%d' % i
+      self.cache.put(url, make_response(b'x' * 300, etag='"%d"' % i))
+      # Make the access order explicit, mtime resolution may be coarse.
+      os.utime(self.cache._path(url), (i, i))
+    self.cache.put('http://a/3', make_response(b'x' * 300, etag='"3"'))
+    self.assertIsNone(self.cache.get('http://a/0'))
+    self.assertIsNotNone(self.cache.get('http://a/3'))
+    count, size = self.cache.size()
+    self.assertLessEqual(size, 1000)
+    self.assertEqual(count, 2)
+
+  def test_clear(self):
+    self.cache.put('http://a/0', make_response(b'[]', etag='"0"'))
+    self.assertEqual(self.cache.clear(), 1)
+    self.assertEqual(self.cache.size(), (0, 0))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,166 @@
+"""A small HTTP client which keeps connections alive between requests.
+
+urllib.request opens a new connection, with a fresh TLS handshake, for every
+request. When paging through thousands of issues that handshake dominates the
+run time, so this module keeps a pool of idle connections per host and reuses
+them. It also asks for gzip'ed responses, which shrinks the JSON we download
+by an order of magnitude.
+"""
+
+import collections
+import gzip
+import http.client
+import io
+import threading
+import urllib.error
+import urllib.parse
+
+
+_USER_AGENT = 'bazel-gardening-tools'
+_MAX_REDIRECTS = 5
+
+
+class Response(object):
+  """The parts of an HTTP response we care about."""
+
+  def __init__(self, url, status, headers, body, from_cache=False):
+    self.url = url
+    self.status = status
+    self.headers = headers
+    self.body = body
+    self.from_cache = from_cache
+
+  def info(self):
+    """Returns the headers, like urllib's response.info() does."""
+    return self.headers
+
+  def read(self):
+    return self.body
+
+
+class ConnectionPool(object):
+  """A pool of keep-alive connections, keyed by (scheme, host).
+
+  The pool also bounds the number of requests in flight to each host, so that
+  multi-threaded callers do not open an unbounded number of connections.
+  """
+
+  def __init__(self, max_per_host=4, timeout=60):
+    self.max_per_host = max_per_host
+    self.timeout = timeout
+    self._idle = collections.defaultdict(list)
+    self._semaphores = {}
+    self._lock = threading.Lock()
+
+  def set_max_per_host(self, max_per_host):
+    """Sets the per host concurrency cap. Affects hosts not yet contacted."""
+    with self._lock:
+      self.max_per_host = max_per_host
+      self._semaphores.clear()
+
+  def _semaphore(self, key):
+    with self._lock:
+      semaphore = self._semaphores.get(key)
+      if not semaphore:
+        semaphore = threading.BoundedSemaphore(self.max_per_host)
+        self._semaphores[key] = semaphore
+    return semaphore
+
+  def _acquire(self, key):
+    """Returns (connection, reused)."""
+    with self._lock:
+      if self._idle[key]:
+        return self._idle[key].pop(), True
+    scheme, netloc = key
+    if scheme == 'https':
+      return http.client.HTTPSConnection(netloc, timeout=self.timeout), False
+    return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+
+  def _release(self, key, connection):
+    with self._lock:
+      if len(self._idle[key]) < self.max_per_host:
+        self._idle[key].append(connection)
+        return
+    connection.close()
+
+  def close(self):
+    with self._lock:
+      for connections in self._idle.values():
+        for connection in connections:
+          connection.close()
+      self._idle.clear()
+
+  def _request_once(self, method, url, headers, body):
+    parts = urllib.parse.urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    path = parts.path or '/'
+    if parts.query:
+      path += '?' + parts.query
+    with self._semaphore(key):
+      connection, reused = self._acquire(key)
+      try:
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        data = response.read()
+      except (http.client.RemoteDisconnected, ConnectionResetError,
+              BrokenPipeError):
+        connection.close()
+        # The server may close an idle connection at any time. That is only
+        # worth a retry if we did not just open it.
+        if reused:
+          return None
+        raise
+      except Exception:
+        connection.close()
+        raise
+      if response.will_close:
+        connection.close()
+      else:
+        self._release(key, connection)
+    if response.getheader('Content-Encoding') == 'gzip':
+      data = gzip.decompress(data)
+    return Response(url, response.status, response.msg, data)
+
+  def request(self, method, url, headers=None, body=None):
+    """Sends a request and reads the full response.
+
+    Redirects are followed, up to _MAX_REDIRECTS of them. Responses with a
+    status of 400 or above, and redirects beyond that, raise
+    urllib.error.HTTPError, so callers can handle errors the same way they
+    did with urllib.request.urlopen.
+
+    Returns:
+      Response
+    """
+    send_headers = {
+        'Accept-Encoding': 'gzip',
+        'User-Agent': _USER_AGENT,
+    }
+    send_headers.update(headers or {})
+    for _ in range(_MAX_REDIRECTS + 1):
+      response = None
+      while response is None:
+        # Stale idle connections are dropped one by one, so this ends with a
+        # fresh connection at the latest.
+        response = self._request_once(method, url, send_headers, body)
+      if response.status in (301, 302, 303, 307, 308):
+        url = urllib.parse.urljoin(url, response.headers['Location'])
+        if response.status == 303:
+          method = 'GET'
+          body = None
+        continue
+      break
+    if response.status >= 400 or response.status in (301, 302, 303, 307, 308):
+      # Also gives up on redirect loops, like urllib does.
+      raise urllib.error.HTTPError(
+          url, response.status, http.client.responses.get(response.status, ''),
+          response.headers, io.BytesIO(response.body))
+    return response
+
+
+# export the singleton
+default_pool = ConnectionPool()
+
+
+def get(url, headers=None):
+  return default_pool.request('GET', url, headers=headers)
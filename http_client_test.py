@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Tests for http_client."""
+
+import gzip
+import http.server
+import threading
+import unittest
+import urllib.error
+
+import http_client
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def setup(self):
+    super(Handler, self).setup()
+    self.server.connections += 1
+
+  def log_message(self, *args):
+    pass
+
+  def send(self, status, body, headers=()):
+    self.send_response(status)
+    for name, value in headers:
+      self.send_header(name, value)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):
+    self.server.requests.append(('GET', self.path, None))
+    if self.path == '/gzip':
+      self.send(200, gzip.compress(b'zipped'), [('Content-Encoding', 'gzip')])
+    elif self.path == '/redirect':
+      self.send(302, b'', [('Location', '/plain')])
+    elif self.path == '/loop':
+      self.send(302, b'', [('Location', '/loop')])
+    elif self.path == '/missing':
+      self.send(404, b'{"message": "Not Found"}')
+    elif self.path == '/drop':
+      # Looks like a keep-alive response, but the server hangs up right
+      # after, like servers do with idle connections.
+      self.send(200, b'dropped')
+      self.close_connection = True
+    else:
+      self.send(200, b'plain')
+
+  def do_POST(self):
+    body = self.rfile.read(int(self.headers['Content-Length']))
+    self.server.requests.append(('POST', self.path, body))
+    if self.path == '/see-other':
+      self.send(303, b'', [('Location', '/plain')])
+    else:
+      self.send(200, body)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    self.server.daemon_threads = True
+    self.server.connections = 0
+    self.server.requests = []
+    thread = threading.Thread(target=self.server.serve_forever,
+                              args=(0.01,))
+    thread.daemon = True
+    thread.start()
+    self.addCleanup(self.server.server_close)
+    self.addCleanup(self.server.shutdown)
+    self.pool = http_client.ConnectionPool(timeout=5)
+    self.addCleanup(self.pool.close)
+
+  def url(self, path):
+    return 'http://127.0.0.1:%d%s' % (self.server.server_port, path)
+
+  def test_keeps_connection_alive(self):
+    for _ in range(3):
+      self.assertEqual(self.pool.request('GET', self.url('/plain')).read(),
+                       b'plain')
+    self.assertEqual(self.server.connections, 1)
+
+  def test_gzip(self):
+    response = self.pool.request('GET', self.url('/gzip'))
+    self.assertEqual(response.read(), b'zipped')
+    self.assertEqual(response.status, 200)
+
+  def test_redirect(self):
+    response = self.pool.request('GET', self.url('/redirect'))
+    self.assertEqual((response.url, response.read()),
+                     (self.url('/plain'), b'plain'))
+
+  def test_see_other_turns_post_into_get(self):
+    response = self.pool.request('POST', self.url('/see-other'), body=b'q')
+    self.assertEqual(response.read(), b'plain')
+    self.assertEqual(self.server.requests,
+                     [('POST', '/see-other', b'q'), ('GET', '/plain', None)])
+
+  def test_too_many_redirects(self):
+    with self.assertRaises(urllib.error.HTTPError) as e:
+      self.pool.request('GET', self.url('/loop'))
+    self.assertEqual(e.exception.code, 302)
+
+  def test_error_status(self):
+    with self.assertRaises(urllib.error.HTTPError) as e:
+      self.pool.request('GET', self.url('/missing'))
+    self.assertEqual(e.exception.code, 404)
+    self.assertEqual(e.exception.reason, 'Not Found')
+    self.assertEqual(e.exception.url, self.url('/missing'))
+    self.assertEqual(e.exception.read(), b'{"message": "Not Found"}')
+
+  def test_retry_on_stale_connection(self):
+    self.assertEqual(self.pool.request('GET', self.url('/drop')).read(),
+                     b'dropped')
+    # The pooled connection was closed by the server, the request goes out
+    # again on a new one.
+    self.assertEqual(self.pool.request('GET', self.url('/plain')).read(),
+                     b'plain')
+    self.assertEqual(self.server.connections, 2)
+    self.assertEqual([path for _, path, _ in self.server.requests],
+                     ['/drop', '/plain'])
+
+  def test_no_retry_on_fresh_connection(self):
+    self.server.shutdown()
+    self.server.server_close()
+    with self.assertRaises(OSError):
+      self.pool.request('GET', self.url('/plain'))
+
+
+if __name__ == '__main__':
+  unittest.main()
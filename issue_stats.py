@@ -1,10 +1,16 @@
 #! /usr/bin/env python3
 
 import argparse
+import concurrent.futures
+import datetime
 import json
+import os
+import sys
 
+import checkpoint
 import database
 import github
+import query
 import reports
 
 
@@ -48,53 +54,190 @@ def build_issue_index(issues, reset_repos):
         latest_change = repo_to_latest.get(repo) or None
         if latest_change == None or latest_change < dt:
             repo_to_latest[repo] = dt
-    db_time = latest_change.timestamp()
     for repo in reset_repos or []:
       repo_to_latest[repo] = None
     return url_to_issue, repo_to_latest
 
 
-def update(repos, full_update=False, reset_repos=None, verbose=False):
-    # Find the most recent issue per repo so we can do incremental update
-    # for different repos in each run.
-    if full_update:
-        issues = []
-        url_to_issue = {}
-        repo_to_latest = {}
-    else:
-        with open(database.all_issues_file) as issues_db:
-            issues = json.load(issues_db)
-        url_to_issue, repo_to_latest = build_issue_index(issues, reset_repos)
-
-    for repo in repos:
-        db_time = repo_to_latest.get(repo) or None
-        if db_time:
-            db_time = db_time.timestamp()
+# Number of repositories fetched together in one GraphQL query.
+_GRAPHQL_REPOS_PER_QUERY = 5
+
+
+def fetch_repo_issues(repos, sync_state, jobs=1, page_jobs=1,
+                      backend='rest', verbose=False):
+    """Fetches the issues changed since the last update for each repo.
+
+    Args:
+      repos: (list of str) repositories to fetch.
+      sync_state: (dict) repo -> sync state, see database.load_sync_state.
+          The ETags are updated in place.
+      jobs: (int) number of repositories, or with the 'graphql' backend groups
+          of repositories, to fetch concurrently.
+      page_jobs: (int) number of pages to fetch concurrently per repository.
+      backend: (str) 'rest' or 'graphql'.
+    Returns:
+      list of (repo, issues), in the order of repos. Repositories which could
+      not be fetched are reported and left out, so one bad repo does not
+      keep the others from being updated. With the 'rest' backend every page
+      is checkpointed, so fetching a repo again resumes where it stopped.
+    """
+    def since(repo):
+        last_update = sync_state.get(repo, {}).get('last_update')
         if verbose:
-            print("Getting issues for", repo, "after", str(db_time))
-        try:
-            new_issues = github.fetch_issues(repo, "", modified_after=db_time,
-                                             verbose=verbose)
-        except:
-            continue
+            print("Getting issues for", repo, "after", str(last_update))
+        if not last_update:
+            return None
+        return database.parse_datetime(last_update).replace(
+            tzinfo=datetime.timezone.utc).timestamp()
 
-        if full_update:
-            issues.extend(new_issues)
-        else:
-            for issue in new_issues:
-                url = issue['url']
-                if url in url_to_issue:
-                    print("updating %s" % url)
-                    issues[url_to_issue.get(url)] = issue
+    def fetch_rest(group):
+        return [(repo, github.fetch_issues(
+            repo, "", modified_after=since(repo), verbose=verbose,
+            page_jobs=page_jobs, checkpoint=checkpoint.RepoCheckpoint(repo),
+            sync_state=sync_state.setdefault(repo, {})))
+                for repo in group]
+
+    def fetch_graphql(group):
+        results, errors = github.fetch_issues_graphql(
+            group, {repo: since(repo) for repo in group}, verbose=verbose)
+        return [(repo, results[repo] if repo in results else errors[repo])
+                for repo in group]
+
+    if backend == 'graphql':
+        tasks = [(repos[i:i + _GRAPHQL_REPOS_PER_QUERY], fetch_graphql)
+                 for i in range(0, len(repos), _GRAPHQL_REPOS_PER_QUERY)]
+    else:
+        tasks = [([repo], fetch_rest) for repo in repos]
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, jobs)) as executor:
+        futures = [(group, executor.submit(task, group))
+                   for group, task in tasks]
+        # Collect in submission order so the merge is deterministic no
+        # matter which fetch finishes first.
+        ret = []
+        for group, future in futures:
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [(repo, e) for repo in group]
+            for repo, issues in results:
+                if isinstance(issues, Exception):
+                    print("Failed to fetch issues for %s: %s" % (repo, issues),
+                          file=sys.stderr)
                 else:
-                    print("new issue %s" % url)
-                    issues.append(issue)
+                    ret.append((repo, issues))
+    return ret
 
-    json.dump(issues, open(database.all_issues_file, "w+"), indent=2)
-    for repo in repos:
+
+def update(repos, full_update=False, reset_repos=None, verbose=False, jobs=1,
+           page_jobs=1, backend='rest', projection=database.ISSUE_PROJECTION):
+    store = database.open_store()
+    sync_state = database.load_sync_state()
+    if not full_update:
+        unknown_repos = [repo for repo in repos if repo not in sync_state]
+        if unknown_repos:
+            # The store predates the sync state. Find the most recent change
+            # of those repos the slow way, once.
+            _, repo_to_latest = build_issue_index(
+                store.query(repo=unknown_repos), [])
+            for repo in unknown_repos:
+                if repo_to_latest.get(repo):
+                    sync_state[repo] = {
+                        'last_update': repo_to_latest[repo].strftime(
+                            '%Y-%m-%dT%H:%M:%SZ'),
+                    }
+    for repo in reset_repos or []:
+        sync_state.pop(repo, None)
+    # A full update starts the repos it fetches over. The others keep their
+    # state, like they keep their issues.
+    repo_state = {repo: {} if full_update else dict(sync_state.get(repo, {}))
+                  for repo in repos}
+
+    fetched = fetch_repo_issues(repos, repo_state, jobs=jobs,
+                                page_jobs=page_jobs, backend=backend,
+                                verbose=verbose)
+    hashes = database.load_issue_hashes(store, projection)
+    new_issues = []
+    changed_issues = []
+    for repo, repo_issues in fetched:
+        state = repo_state[repo]
+        # Only keep what we use, GitHub sends a lot more.
+        repo_issues = [database.project(issue, projection)
+                       for issue in repo_issues]
+        counts = {'new': 0, 'changed': 0, 'unchanged': 0}
+        for issue in repo_issues:
+            # GitHub timestamps compare correctly as strings.
+            if issue['updated_at'] > (state.get('last_update') or ''):
+                state['last_update'] = issue['updated_at']
+            digest = database.issue_hash(issue, projection)
+            old_digest = hashes.get(issue['url'])
+            hashes[issue['url']] = digest
+            if digest == old_digest:
+                # Nothing we keep has changed, leave the store alone.
+                counts['unchanged'] += 1
+                continue
+            counts['new' if old_digest is None else 'changed'] += 1
+            changed_issues.append(issue)
+        print("%s: %d new, %d changed, %d unchanged" % (
+            repo, counts['new'], counts['changed'], counts['unchanged']))
+        new_issues.extend(repo_issues)
+
+    if full_update:
+        # Repositories which were not fetched keep their issues.
+        fetched_repos = set(repo for repo, _ in fetched)
+        store.replace_repos(fetched_repos, new_issues)
+        new_urls = set(issue['url'] for issue in new_issues)
+        hashes = {url: digest for url, digest in hashes.items()
+                  if url in new_urls
+                  or database.repo_of_url(url) not in fetched_repos}
+    elif changed_issues:
+        for issue, is_new in store.update(changed_issues):
+            if verbose:
+                print("%s %s" % ("new issue" if is_new else "updating",
+                                 issue['url']))
+    store_changed = full_update or bool(changed_issues)
+    if store_changed:
+        database.save_issue_hashes(hashes)
+    # The issues are in the store now. Move the watermarks forward and drop
+    # the checkpoints, the next update starts afresh.
+    for repo, _ in fetched:
+        sync_state[repo] = repo_state[repo]
+    database.save_sync_state(sync_state)
+    if store_changed and os.path.exists(database.issues_table_file):
+        database.build_table()
+    for repo, _ in fetched:
+        checkpoint.RepoCheckpoint(repo).remove()
+    for repo, _ in fetched:
         if verbose:
             print("Getting labels for ", repo)
-        update_labels(repo)
+        try:
+            update_labels(repo)
+        except Exception as e:
+            print("Failed to fetch labels for %s: %s" % (repo, e),
+                  file=sys.stderr)
+    if verbose:
+        print("GitHub requests: %(requests)d, cache hits: %(cache_hits)d, "
+              "retries: %(retries)d, throttled: %(throttled_seconds).1fs"
+              % github.scheduler.metrics())
+
+
+def _query(text):
+    try:
+        return query.compile(text)
+    except query.QueryError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _non_negative_int(text):
+    try:
+        value = int(text)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise argparse.ArgumentTypeError(
+            '"%s" is not a non-negative number' % text)
+    return value
 
 
 def main():
@@ -122,6 +265,26 @@ def main():
     update_parser.add_argument(
         '--reset_repo', action='append',
         help='Specific repository to do a full update for. May be repeated')
+    update_parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='Number of repositories to fetch concurrently (default 1)')
+    update_parser.add_argument(
+        '--page_jobs', type=int, default=1,
+        help='Number of pages to fetch concurrently per repository (default 1)')
+    update_parser.add_argument(
+        '--max_per_host', type=int, default=4,
+        help='Maximum number of concurrent requests to one host (default 4)')
+    update_parser.add_argument(
+        '--request_budget', type=int, default=None,
+        help='Stop fetching after this many GitHub API requests')
+    update_parser.add_argument(
+        '--backend', choices=['rest', 'graphql'], default='rest',
+        help='GitHub API to fetch issues with. graphql only transfers the '
+             'fields we use, but needs a "token" in secrets.json')
+    update_parser.add_argument(
+        '--keep_field', action='append', default=[],
+        help='Issue field to store in addition to the ones the reports use. '
+             'May be repeated.')
 
     garden_parser = subparsers.add_parser(
         "garden",
@@ -144,10 +307,51 @@ def main():
         help=
         "list issues/prs that have not been updated for more than the specified number of days (number, default is 0)"
     )
+    garden_parser.add_argument(
+        '-q',
+        '--query',
+        action='append',
+        default=[],
+        type=_query,
+        help='list the open issues matching a query, like '
+             '\'pr -wip stale>=30 -team:*\', see query.py (multiple values '
+             'possible)')
+    garden_parser.add_argument(
+        '--limit',
+        type=_non_negative_int,
+        help='list at most this many issues per list')
 
     html_parser = subparsers.add_parser(
         "html", help="generate HTML for issues/pull requests that need attention")
 
+    subparsers.add_parser(
+        "migrate", help="move the issues from %s to the SQLite store %s"
+        % (database.all_issues_file, database.issues_db_file))
+
+    subparsers.add_parser(
+        "shard", help="split the issues in %s into one store per repository"
+        " in %s/" % (database.all_issues_file, database.issues_shard_dir))
+
+    compact_parser = subparsers.add_parser(
+        "compact", help="drop the issue fields the reports do not use from "
+        "the store, and store it compactly")
+    compact_parser.add_argument(
+        '--keep_field', action='append', default=[],
+        help='Issue field to keep in addition to the ones the reports use. '
+             'May be repeated.')
+
+    compress_parser = subparsers.add_parser(
+        "compress", help="store %s compressed, or uncompressed again"
+        % database.all_issues_file)
+    compress_parser.add_argument(
+        '--format', choices=['json', 'gz', 'zst'], default='gz',
+        help='json: uncompressed, gz: gzip, zst: zstd, which needs the '
+             'zstandard module (default gz)')
+
+    subparsers.add_parser(
+        "table", help="write the issues into the columnar table %s, which"
+        " reports read much faster" % database.issues_table_file)
+
     report_parser = subparsers.add_parser(
         "report", help="generate a full report")
     report_selector = report_parser.add_mutually_exclusive_group()
@@ -163,6 +367,20 @@ def main():
         action="append",
         choices=reports.report_names(),
         help="show selected report (multiple values possible)")
+    report_parser.add_argument(
+        '-q',
+        '--query',
+        action='append',
+        default=[],
+        type=_query,
+        help='list the issues matching a query, like \'open pr '
+             'label:"cla: yes" -wip stale>=30\', see query.py (multiple '
+             'values possible)')
+    report_parser.add_argument(
+        '--limit',
+        type=_non_negative_int,
+        help='list at most this many issues per report, or per team of the '
+             'reports grouped by team')
 
     args = parser.parse_args()
     user_list = None
@@ -176,14 +394,42 @@ def main():
         elif args.repo_list_file:
           with open(args.repo_list_file, 'r') as rf:
             repos = [l.strip() for l in rf.read().strip().split('\n')]
-        update(repos, args.full, args.reset_repo, args.verbose)
+        github.set_max_requests_per_host(args.max_per_host)
+        github.scheduler.set_budget(args.request_budget)
+        update(repos, args.full, args.reset_repo, args.verbose, jobs=args.jobs,
+               page_jobs=args.page_jobs, backend=args.backend,
+               projection=database.issue_projection(args.keep_field))
     elif args.command == "report":
-        reports.report(args.report if args.report else reports.report_names(),
-                       user_list=user_list)
+        if args.report:
+            which_reports = args.report
+        elif args.query and not args.all_reports:
+            which_reports = []
+        else:
+            which_reports = reports.report_names()
+        reports.report(which_reports, user_list=user_list,
+                       queries=args.query, limit=args.limit)
     elif args.command == "garden":
-        reports.garden(args.list_issues, args.list_pull_requests, args.stale_for_days)
+        reports.garden(args.list_issues, args.list_pull_requests,
+                       args.stale_for_days, queries=args.query,
+                       limit=args.limit)
     elif args.command == "html":
         reports.html_garden()
+    elif args.command == "migrate":
+        print("Migrated %d issues" % database.migrate_to_sqlite())
+    elif args.command == "shard":
+        print("Split the issues into %d repositories" % database.shard_store())
+    elif args.command == "compact":
+        print("Compacted %d issues, %d bytes -> %d bytes" %
+              database.compact_store(
+                  database.issue_projection(args.keep_field)))
+    elif args.command == "compress":
+        suffix = '' if args.format == 'json' else '.' + args.format
+        count, before, after = database.convert_json_store(suffix)
+        print("Wrote %d issues to %s, %d bytes -> %d bytes" % (
+            count, database.all_issues_file + suffix, before, after))
+    elif args.command == "table":
+        print("Wrote %d issues to %s" % (database.build_table(),
+                                         database.issues_table_file))
     else:
         parser.print_usage()
 
@@ -1,10 +1,21 @@
 #!/usr/bin/env python3
 """Tests for issue-stats.py."""
 
+import argparse
+import contextlib
+import io
 import json
+import os
+import tempfile
+import time
 import unittest
+from unittest import mock
 
+import database
+import github
 import issue_stats
+from database_test import make_issue
+from github_test import FakeGitHub, ISSUES_URL
 
 class IssueStatsTest(unittest.TestCase):
 
@@ -33,5 +44,145 @@ class IssueStatsTest(unittest.TestCase):
                      30)
 
 
+class UpdateTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    cwd = os.getcwd()
+    os.chdir(self.tmp.name)
+    self.addCleanup(os.chdir, cwd)
+    self.addCleanup(self.tmp.cleanup)
+    self.fetched = {}
+    self.since = {}
+    for name, stub in (('fetch_issues', self.fetch_issues),
+                       ('fetch_labels', lambda repo: [])):
+      patcher = mock.patch.object(github, name, stub)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def fetch_issues(self, repo, query, modified_after=None, **kwargs):
+    self.since[repo] = modified_after
+    return self.fetched.get(repo, [])
+
+  def test_build_issue_index_without_issues(self):
+    self.assertEqual(issue_stats.build_issue_index([], []), ({}, {}))
+
+  def test_incremental_update_adds_new_repo(self):
+    self.fetched['bazelbuild/bazel'] = [make_issue('bazelbuild/bazel', 1)]
+    issue_stats.update(['bazelbuild/bazel'], full_update=True)
+    self.fetched['bazelbuild/starlark'] = [
+        make_issue('bazelbuild/starlark', 1,
+                   updated_at='2019-08-02T00:00:00Z')]
+    issue_stats.update(['bazelbuild/bazel', 'bazelbuild/starlark'])
+    # The new repository is fetched in full.
+    self.assertIsNone(self.since['bazelbuild/starlark'])
+    self.assertEqual(
+        sorted((issue.repo, issue.number) for issue in database.get_issues()),
+        [('bazelbuild/bazel', 1), ('bazelbuild/starlark', 1)])
+    self.assertEqual(
+        database.load_sync_state()['bazelbuild/starlark']['last_update'],
+        '2019-08-02T00:00:00Z')
+
+  def test_refetched_issues(self):
+    self.fetched['bazelbuild/bazel'] = [make_issue('bazelbuild/bazel', 1),
+                                        make_issue('bazelbuild/bazel', 2)]
+    issue_stats.update(['bazelbuild/bazel'], full_update=True)
+    # Only the update time of issue 2 changed, which the reports read.
+    touched = make_issue('bazelbuild/bazel', 2,
+                         updated_at='2019-08-02T10:00:00Z')
+    self.fetched['bazelbuild/bazel'] = [make_issue('bazelbuild/bazel', 1),
+                                        touched]
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+      issue_stats.update(['bazelbuild/bazel'])
+    self.assertIn('bazelbuild/bazel: 0 new, 1 changed, 1 unchanged',
+                  out.getvalue())
+    self.assertEqual(
+        [issue.updated_at.day for issue in database.get_issues()], [1, 2])
+
+  def test_full_update_of_one_repo_keeps_others(self):
+    self.fetched['bazelbuild/bazel'] = [make_issue('bazelbuild/bazel', 1)]
+    self.fetched['bazelbuild/starlark'] = [make_issue('bazelbuild/starlark', 1)]
+    issue_stats.update(['bazelbuild/bazel', 'bazelbuild/starlark'],
+                       full_update=True)
+    database.shard_store()
+    starlark_state = database.load_sync_state()['bazelbuild/starlark']
+    self.fetched['bazelbuild/bazel'] = [make_issue('bazelbuild/bazel', 2)]
+    issue_stats.update(['bazelbuild/bazel'], full_update=True)
+    self.assertEqual(database.load_sync_state()['bazelbuild/starlark'],
+                     starlark_state)
+    self.assertEqual(
+        sorted((issue.repo, issue.number) for issue in database.get_issues()),
+        [('bazelbuild/bazel', 2), ('bazelbuild/starlark', 1)])
+    self.assertEqual(set(database.load_issue_hashes()),
+                     set(issue.url for issue in database.get_issues()))
+
+
+class FetchRepoIssuesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    cwd = os.getcwd()
+    os.chdir(self.tmp.name)
+    self.addCleanup(os.chdir, cwd)
+    self.addCleanup(self.tmp.cleanup)
+
+  def set_timezone(self, tz):
+    patcher = mock.patch.dict(os.environ, {'TZ': tz})
+    patcher.start()
+    self.addCleanup(time.tzset)
+    self.addCleanup(patcher.stop)
+    time.tzset()
+
+  def test_since_last_update(self):
+    # The watermark is UTC, whatever the local time zone.
+    self.set_timezone('America/Los_Angeles')
+    fake = FakeGitHub()
+    url = ISSUES_URL + '&since=2019-08-01T10:00:00Z'
+    fake.add_page(url, [make_issue('bazelbuild/bazel', 1)])
+    with mock.patch.object(github, '_get', fake.get):
+      fetched = issue_stats.fetch_repo_issues(
+          ['bazelbuild/bazel'],
+          {'bazelbuild/bazel': {'last_update': '2019-08-01T10:00:00Z'}})
+    self.assertEqual(fake.requests, [url])
+    self.assertEqual([(repo, len(issues)) for repo, issues in fetched],
+                     [('bazelbuild/bazel', 1)])
+
+
+  def test_results_in_repo_order(self):
+    repos = ['bazelbuild/bazel', 'bazelbuild/broken', 'bazelbuild/starlark',
+             'bazelbuild/buildtools']
+
+    def fetch_issues(repo, query, **kwargs):
+      # The first repositories finish last.
+      time.sleep(0.01 * (len(repos) - repos.index(repo)))
+      if repo == 'bazelbuild/broken':
+        raise IOError('Not Found')
+      return [make_issue(repo, 1)]
+
+    err = io.StringIO()
+    with mock.patch.object(github, 'fetch_issues', fetch_issues), \
+         contextlib.redirect_stderr(err):
+      fetched = issue_stats.fetch_repo_issues(repos, {}, jobs=4)
+    self.assertEqual([repo for repo, _ in fetched],
+                     ['bazelbuild/bazel', 'bazelbuild/starlark',
+                      'bazelbuild/buildtools'])
+    self.assertEqual([issues[0]['repository_url'] for _, issues in fetched],
+                     ['https://api.github.com/repos/' + repo
+                      for repo, _ in fetched])
+    self.assertIn('Failed to fetch issues for bazelbuild/broken: Not Found',
+                  err.getvalue())
+
+
+class ArgumentsTest(unittest.TestCase):
+
+  def test_non_negative_int(self):
+    self.assertEqual(issue_stats._non_negative_int('0'), 0)
+    self.assertEqual(issue_stats._non_negative_int('50'), 50)
+    for text in ('-1', 'many', ''):
+      with self.assertRaises(argparse.ArgumentTypeError, msg=text):
+        issue_stats._non_negative_int(text)
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,208 @@
+"""A small query language for selecting issues.
+
+A query is a list of terms separated by spaces, all of which an issue must
+match. A term preceded by '-' must not match. For example, the pull requests
+the garden command lists:
+
+  open pr label:"cla: yes" -wip stale>=30 -team:* -assigned
+
+Terms:
+  open, closed          the state of the issue
+  pr, issue             pull requests, or issues proper
+  assigned              the issue has an assignee
+  wip                   work in progress, by label or title
+  label:NAME            the issue has the label; NAME* any label starting
+                        with NAME
+  team:NAME             the label team-NAME; team:* any team label
+  repo:ORG/NAME         the repository
+  author:LOGIN          the creator
+  assignee:LOGIN        the (first) assignee
+  stale>N               days since the last update, also >=, <, <= and =
+
+Values of the ':' terms may be quoted, and may list alternatives separated
+by commas: label:P0,P1 matches issues with either label.
+
+parse() turns a query into a list of Clauses, compile() turns those into a
+Query, a predicate on database.Issue objects which makes the cheap checks
+first, and which knows the filters the store can apply for it.
+"""
+
+import collections
+import operator
+import re
+import shlex
+
+import database
+import reports
+
+
+class QueryError(ValueError):
+  pass
+
+
+# field is the word of a bare term, op is None for those.
+Clause = collections.namedtuple('Clause', ['negated', 'field', 'op', 'values'])
+
+_TERM_RE = re.compile(r'(\w+)(:|>=|<=|>|<|=)(.*)$', re.DOTALL)
+
+_WORDS = ('open', 'closed', 'pr', 'issue', 'assigned', 'wip')
+_LIST_FIELDS = ('label', 'team', 'repo', 'author', 'assignee')
+_NUMBER_FIELDS = ('stale',)
+
+_COMPARISONS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '=': operator.eq,
+}
+
+
+def parse(text):
+  """Returns the Clauses of a query.
+
+  Raises:
+    QueryError: if the query is malformed.
+  """
+  try:
+    terms = shlex.split(text)
+  except ValueError as e:
+    raise QueryError('%s: %s' % (text, e))
+  clauses = []
+  for term in terms:
+    negated = term.startswith('-')
+    if negated:
+      term = term[1:]
+    match = _TERM_RE.match(term)
+    if not match:
+      if term not in _WORDS:
+        raise QueryError('Unknown term "%s"' % term)
+      clauses.append(Clause(negated, term, None, ()))
+      continue
+    field, op, value = match.groups()
+    if field in _LIST_FIELDS and op == ':':
+      values = tuple(v for v in value.split(',') if v)
+      if not values:
+        raise QueryError('"%s" needs a value' % term)
+    elif field in _NUMBER_FIELDS and op in _COMPARISONS:
+      try:
+        values = (int(value),)
+      except ValueError:
+        raise QueryError('"%s" needs a number of days' % term)
+    else:
+      raise QueryError('Unknown term "%s"' % term)
+    clauses.append(Clause(negated, field, op, values))
+  return clauses
+
+
+def _has_label(names):
+  """Returns a function telling whether an issue has any of the labels."""
+  mask = 0
+  prefixes = []
+  for name in names:
+    if name.endswith('*'):
+      prefixes.append(name[:-1])
+    else:
+      mask |= database.label_db.bit(name)
+  if not prefixes:
+    return lambda issue: issue.label_bits & mask
+  prefix_mask = database.label_db.prefix_mask
+
+  def has_label(issue):
+    # Labels seen later can still match the prefix, so the mask is looked up
+    # every time. LabelDB caches it.
+    bits = mask
+    for prefix in prefixes:
+      bits |= prefix_mask(prefix)
+    return issue.label_bits & bits
+
+  return has_label
+
+
+def _check(clause):
+  """Returns (cost, function checking the clause, ignoring its negation)."""
+  field, values = clause.field, clause.values
+  # Attribute comparisons first, then bit masks and set lookups, then
+  # anything looking at text.
+  if field in ('open', 'closed'):
+    return 0, lambda issue: issue.state == field
+  if field == 'pr':
+    return 0, lambda issue: issue.is_pr
+  if field == 'issue':
+    return 0, lambda issue: not issue.is_pr
+  if field == 'assigned':
+    return 0, lambda issue: issue.assignee is not None
+  if field == 'wip':
+    return 3, reports.work_in_progress
+  if field in ('label', 'team'):
+    if field == 'team':
+      values = ['team-' + v for v in values]
+    return 1, _has_label(values)
+  if field in ('repo', 'author', 'assignee'):
+    wanted = frozenset(values)
+    get = operator.attrgetter(field)
+    return 1, lambda issue: get(issue) in wanted
+  if field == 'stale':
+    compare = _COMPARISONS[clause.op]
+    days = values[0]
+    return 1, lambda issue: compare(issue.age_days, days)
+  raise QueryError('Unknown field "%s"' % field)
+
+
+def _filter(clause):
+  """Returns (name, value) of the store filter for clause, or None."""
+  field = clause.field
+  if field == 'pr' or field == 'issue':
+    return 'is_pull_request', (field == 'pr') != clause.negated
+  if clause.negated:
+    return None
+  if field in ('open', 'closed'):
+    return 'state', field
+  # Label names are matched exactly by some stores, but normalized by
+  # database.label_db, so labels are not pushed down.
+  if field in ('repo', 'author', 'assignee'):
+    return field, list(clause.values)
+  return None
+
+
+class Query(object):
+  """A compiled query, callable as a predicate on issues.
+
+  Attributes:
+    text: (str) the query.
+    filters: (dict) conditions on indexed fields, see
+        database.IssueStore.query, which hold for every issue matching the
+        query. Applying them in the store saves loading most issues.
+  """
+
+  def __init__(self, text, clauses):
+    self.text = text
+    self.filters = {}
+    checks = []
+    for clause in clauses:
+      cost, check = _check(clause)
+      if clause.negated:
+        check = (lambda check: lambda issue: not check(issue))(check)
+      checks.append((cost, len(checks), check))
+      store_filter = _filter(clause)
+      if store_filter and store_filter[0] not in self.filters:
+        self.filters[store_filter[0]] = store_filter[1]
+    self._checks = tuple(check for _, _, check in sorted(checks))
+
+  def __call__(self, issue):
+    for check in self._checks:
+      if not check(issue):
+        return False
+    return True
+
+  def __repr__(self):
+    return 'Query(%r)' % self.text
+
+
+def compile(text):
+  """Parses a query and returns it as a Query.
+
+  Raises:
+    QueryError: if the query is malformed.
+  """
+  return Query(text, parse(text))
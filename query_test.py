@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Tests for query."""
+
+import datetime
+import types
+import unittest
+from unittest import mock
+
+import clock
+import database
+import query
+import reports
+from database_test import SAMPLE_ISSUES, make_issue
+
+
+class ParseTest(unittest.TestCase):
+
+  def test_parse(self):
+    self.assertEqual(query.parse('open -pr label:"cla: yes",P1 stale>=30'), [
+        query.Clause(False, 'open', None, ()),
+        query.Clause(True, 'pr', None, ()),
+        query.Clause(False, 'label', ':', ('cla: yes', 'P1')),
+        query.Clause(False, 'stale', '>=', (30,)),
+    ])
+
+  def test_errors(self):
+    for text in ('opened', 'label:', 'stale:30', 'stale>soon', 'team>1',
+                 'label:"cla'):
+      with self.assertRaises(query.QueryError, msg=text):
+        query.parse(text)
+
+
+class QueryTest(unittest.TestCase):
+
+  def setUp(self):
+    patcher = mock.patch.multiple(clock, _now=None, _now_epoch=None)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    clock.freeze(datetime.datetime(2019, 9, 1))
+    raw = SAMPLE_ISSUES + [
+        make_issue('bazelbuild/bazel', 4, pull_request=True,
+                   labels=['cla: yes', 'WIP'],
+                   updated_at='2019-08-31T00:00:00Z'),
+    ]
+    self.issues = [database.Issue(issue) for issue in raw]
+
+  def numbers(self, text):
+    return [(issue.repo, issue.number)
+            for issue in filter(query.compile(text), self.issues)]
+
+  def test_terms(self):
+    self.assertEqual(self.numbers('closed'), [('bazelbuild/bazel', 2)])
+    self.assertEqual(self.numbers('pr'),
+                     [('bazelbuild/bazel', 3), ('bazelbuild/bazel', 4)])
+    self.assertEqual(self.numbers('pr -wip'), [('bazelbuild/bazel', 3)])
+    self.assertEqual(self.numbers('assigned'), [('bazelbuild/starlark', 1)])
+    self.assertEqual(self.numbers('label:CLA-yes stale<7'),
+                     [('bazelbuild/bazel', 4)])
+    self.assertEqual(self.numbers('label:P1,P2'),
+                     [('bazelbuild/bazel', 1), ('bazelbuild/bazel', 2)])
+    self.assertEqual(self.numbers('team:Starlark'),
+                     [('bazelbuild/starlark', 1)])
+    self.assertEqual(self.numbers('open issue -team:*'), [])
+    self.assertEqual(self.numbers('repo:bazelbuild/starlark'),
+                     [('bazelbuild/starlark', 1)])
+    self.assertEqual(self.numbers('author:bob,dave'), [('bazelbuild/bazel', 3)])
+    self.assertEqual(self.numbers('-assignee:carol issue'),
+                     [('bazelbuild/bazel', 1), ('bazelbuild/bazel', 2)])
+
+  def test_matches_report_predicates(self):
+    def pr_backlog(issue):
+      return (reports.is_open(issue) and reports.is_pull_request(issue)
+              and reports.has_cla(issue) and reports.is_stale(issue, 30)
+              and not reports.work_in_progress(issue))
+
+    compiled = query.compile('open pr label:"cla: yes" stale>=30 -wip')
+    for issue in self.issues:
+      self.assertEqual(compiled(issue), pr_backlog(issue), issue)
+
+  def test_labels_seen_later_match_prefixes(self):
+    compiled = query.compile('label:area-*')
+    issue = database.Issue(make_issue('bazelbuild/bazel', 5,
+                                      labels=['area-Go']))
+    self.assertTrue(compiled(issue))
+
+  def test_filters(self):
+    self.assertEqual(
+        query.compile('open -issue repo:a/b -author:bob assignee:x,y wip '
+                      'label:P1 closed').filters,
+        {'state': 'open', 'is_pull_request': True, 'repo': ['a/b'],
+         'assignee': ['x', 'y']})
+
+  def test_cheap_checks_first(self):
+    # Checking for work in progress would need the title and labels, but
+    # the state check comes first and fails.
+    issue = types.SimpleNamespace(state='open')
+    self.assertFalse(query.compile('wip closed')(issue))
+
+
+class StoreFiltersTest(unittest.TestCase):
+
+  def test_common_filters(self):
+    engine = reports.ReportEngine()
+    for text in ('open pr stale>30', 'open pr repo:a/b'):
+      reports.query_report(engine.reporter(reports.print_report),
+                           query.compile(text))
+    self.assertEqual(engine.store_filters(),
+                     {'state': 'open', 'is_pull_request': True})
+    reports.more_than_one_team(engine.reporter(reports.print_report))
+    self.assertEqual(engine.store_filters(), {})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,144 @@
+"""Paces GitHub API requests to stay within the rate limits.
+
+GitHub reports the remaining request budget and the time it resets with every
+response (X-RateLimit-Remaining, X-RateLimit-Reset). When it thinks we are
+going too fast, it answers 403 or 429, sometimes with a Retry-After header
+(the "secondary" rate limits). The Scheduler tracks all of that, spreads the
+remaining budget over the time left until the reset, and tells callers when
+and whether to retry a throttled request.
+"""
+
+import threading
+import time
+
+
+# Start spreading requests out when fewer than this many are left.
+_PACE_BELOW = 100
+
+# Initial backoff for a secondary rate limit without a Retry-After hint.
+_SECONDARY_BACKOFF_S = 60
+
+MAX_RETRIES = 5
+
+
+class BudgetExhausted(Exception):
+  """Raised when a run has used up the request budget it declared."""
+
+
+class Scheduler(object):
+  """Tracks the rate limit and delays requests as needed.
+
+  Thread safe. A single instance should be shared by all fetchers.
+  """
+
+  def __init__(self, budget=None, clock=time.time, sleep=time.sleep):
+    self.budget = budget
+    self._clock = clock
+    self._sleep = sleep
+    self._lock = threading.Lock()
+    self._remaining = None
+    self._reset_at = None
+    self._blocked_until = 0
+    self.requests = 0
+    self.cache_hits = 0
+    self.retries = 0
+    self.throttled_seconds = 0.0
+
+  def set_budget(self, budget):
+    """Limits the number of requests for this run. None means unlimited."""
+    with self._lock:
+      self.budget = budget
+
+  def _delay(self, now):
+    delay = self._blocked_until - now
+    if self._remaining is not None and self._reset_at:
+      window = self._reset_at - now
+      if self._remaining <= 0:
+        delay = max(delay, window)
+      elif self._remaining < _PACE_BELOW:
+        delay = max(delay, window / self._remaining)
+    return max(0, delay)
+
+  def before_request(self):
+    """Blocks until the next request may be sent.
+
+    Raises:
+      BudgetExhausted: if the declared budget is used up.
+    """
+    with self._lock:
+      # Revalidations answered from the cache are free, so they do not count.
+      if (self.budget is not None
+          and self.requests - self.cache_hits >= self.budget):
+        raise BudgetExhausted(
+            'Request budget of %d exhausted' % self.budget)
+      self.requests += 1
+      delay = self._delay(self._clock())
+      if self._remaining is not None:
+        # Account for the request now, so concurrent callers pace as well.
+        self._remaining -= 1
+      if delay > 0:
+        self.throttled_seconds += delay
+    if delay > 0:
+      self._sleep(delay)
+
+  def _update(self, headers):
+    remaining = headers.get('X-RateLimit-Remaining')
+    reset_at = headers.get('X-RateLimit-Reset')
+    try:
+      if remaining is not None:
+        self._remaining = int(remaining)
+      if reset_at is not None:
+        self._reset_at = int(reset_at)
+    except ValueError:
+      pass
+
+  def after_response(self, headers):
+    """Records the rate limit state reported by a successful response."""
+    with self._lock:
+      self._update(headers)
+
+  def record_cache_hit(self):
+    with self._lock:
+      self.cache_hits += 1
+
+  def should_retry(self, status, headers, body, attempt):
+    """Decides whether a failed request hit a rate limit.
+
+    If so, the following before_request() will wait out the limit.
+
+    Args:
+      status: (int) HTTP status.
+      headers: response headers.
+      body: (bytes) response body.
+      attempt: (int) number of earlier retries of this request.
+    Returns:
+      True if the request should be retried.
+    """
+    if status not in (403, 429) or attempt >= MAX_RETRIES:
+      return False
+    with self._lock:
+      self._update(headers)
+      now = self._clock()
+      retry_after = headers.get('Retry-After')
+      if retry_after and retry_after.isdigit():
+        delay = int(retry_after)
+      elif self._remaining == 0 and self._reset_at:
+        delay = self._reset_at - now + 1
+      elif status == 429 or b'secondary rate limit' in (body or b''):
+        delay = _SECONDARY_BACKOFF_S * 2 ** attempt
+      else:
+        # A plain permission problem. Waiting will not help.
+        return False
+      self._blocked_until = max(self._blocked_until, now + delay)
+      self.retries += 1
+    return True
+
+  def metrics(self):
+    with self._lock:
+      return {
+          'requests': self.requests,
+          'cache_hits': self.cache_hits,
+          'retries': self.retries,
+          'throttled_seconds': self.throttled_seconds,
+          'remaining': self._remaining,
+      }
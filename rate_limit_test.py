@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Tests for rate_limit."""
+
+import unittest
+
+import rate_limit
+
+
+class FakeClock(object):
+
+  def __init__(self):
+    self.now = 1000.0
+    self.slept = []
+
+  def time(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.slept.append(seconds)
+    self.now += seconds
+
+
+class SchedulerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = FakeClock()
+    self.scheduler = rate_limit.Scheduler(
+        clock=self.clock.time, sleep=self.clock.sleep)
+
+  def test_no_delay_with_plenty_of_budget(self):
+    self.scheduler.after_response(
+        {'X-RateLimit-Remaining': '4000', 'X-RateLimit-Reset': '4600'})
+    self.scheduler.before_request()
+    self.assertEqual(self.clock.slept, [])
+
+  def test_paces_when_budget_is_low(self):
+    self.scheduler.after_response(
+        {'X-RateLimit-Remaining': '10', 'X-RateLimit-Reset': '1100'})
+    self.scheduler.before_request()
+    self.assertEqual(self.clock.slept, [10.0])
+
+  def test_waits_for_reset_when_exhausted(self):
+    self.scheduler.after_response(
+        {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '1300'})
+    self.scheduler.before_request()
+    self.assertEqual(self.clock.slept, [300.0])
+    self.assertEqual(self.scheduler.metrics()['throttled_seconds'], 300.0)
+
+  def test_retry_after(self):
+    self.assertTrue(self.scheduler.should_retry(
+        403, {'Retry-After': '30'}, b'', 0))
+    self.scheduler.before_request()
+    self.assertEqual(self.clock.slept, [30.0])
+    self.assertEqual(self.scheduler.metrics()['retries'], 1)
+
+  def test_secondary_limit_backs_off(self):
+    body = b'{"message": "You have exceeded a secondary rate limit"}'
+    self.assertTrue(self.scheduler.should_retry(403, {}, body, 0))
+    self.assertTrue(self.scheduler.should_retry(403, {}, body, 1))
+    self.scheduler.before_request()
+    self.assertEqual(self.clock.slept, [120.0])
+
+  def test_forbidden_is_not_retried(self):
+    self.assertFalse(self.scheduler.should_retry(
+        403, {}, b'{"message": "Resource not accessible"}', 0))
+    self.assertFalse(self.scheduler.should_retry(404, {}, b'', 0))
+    self.assertFalse(self.scheduler.should_retry(
+        429, {}, b'', rate_limit.MAX_RETRIES))
+
+  def test_budget(self):
+    self.scheduler.set_budget(2)
+    self.scheduler.before_request()
+    self.scheduler.before_request()
+    self.scheduler.record_cache_hit()
+    self.scheduler.before_request()
+    with self.assertRaises(rate_limit.BudgetExhausted):
+      self.scheduler.before_request()
+    metrics = self.scheduler.metrics()
+    self.assertEqual(metrics['requests'], 3)
+    self.assertEqual(metrics['cache_hits'], 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 
 import collections
-import datetime
+import heapq
 import itertools
 import re
 
+import clock
 import database
 import html_writer
+import vectorized
 
 
 CAT_2_TEAM = {
@@ -31,91 +33,75 @@ CAT_2_TEAM = {
 # Look for WIP markers in issue titles
 _WIP_RE = re.compile(r'\bwip:?\b')
 
-
-# GitHub API datetime-stamps are already in UTC / Zulu time (+0000)
-def parse_datetime(datetime_string):
-    return datetime.datetime.strptime(datetime_string, "%Y-%m-%dT%H:%M:%SZ")
+_PRIORITIES = ("P0", "P1", "P2", "P3", "P4")
 
 
 def issue_url(issue):
-    return issue["html_url"]
-
-
-def team_labels(labels):
-    for l in labels:
-        if l["name"].startswith("team-"):
-            yield l
+    return issue.html_url
 
 
 def category_labels(labels):
-    for l in labels:
-        name = l["name"]
+    for name in sorted(labels):
         if name.startswith("category:"):
             yield name
 
 
-def all_teams(labels):
-    for team_label in team_labels(labels):
-        yield team_label["name"]
-
-
 #
 # Issue predicates
 #
 
 
 def is_open(issue):
-    return issue["state"] == "open"
+    return issue.state == "open"
 
 
 def has_team_label(issue):
-    for _ in team_labels(issue["labels"]):
-        return True
-    return False
+    return bool(issue.label_bits & database.label_db.prefix_mask("team-"))
 
 
 def is_pull_request(issue):
-    return "pull_request" in issue
+    return issue.is_pr
 
 
 def has_label(issue, label):
-    for l in issue["labels"]:
-        if l["name"] == label:
-            return True
-    return False
+    return bool(issue.label_bits & database.label_db.bit(label))
 
 
 def get_any_of_labels(issue, labels):
-    for l in issue["labels"]:
-        if l["name"] in labels:
-            return l
-    return None
+    """Returns the first of labels that the issue has, or None."""
+    bits = issue.label_bits & database.label_db.mask(labels)
+    if not bits:
+        return None
+    for label in labels:
+        if bits & database.label_db.bit(label):
+            return label
 
 
 def has_priority(issue):
-    return get_priority(issue) != None
+    return bool(issue.label_bits & database.label_db.mask(_PRIORITIES))
 
 def get_priority(issue):
-    return get_any_of_labels(issue, ["P0", "P1", "P2", "P3", "P4"])
+    return get_any_of_labels(issue, _PRIORITIES)
 
 def needs_more_data(issue):
     return has_label(issue, "more data needed")
 
 
 def work_in_progress(issue):
-    return has_label(issue, "WIP") or _WIP_RE.search(issue["title"].lower())
+    return has_label(issue, "WIP") or _WIP_RE.search(issue.title.lower())
 
 
 def teams(issue):
-    return map(lambda i: i["name"], team_labels(issue["labels"]))
+    return iter(sorted(database.label_db.names(
+        issue.label_bits & database.label_db.prefix_mask("team-"))))
 
 
 def latest_update_days_ago(issue):
-    return (datetime.datetime.now() - parse_datetime(issue["updated_at"])).days
+    return issue.age_days
 
 
 def is_stale(issue, days_ago):
-    return latest_update_days_ago(issue) >= days_ago
+    return issue.age_days >= days_ago
 
 
 def has_cla(issue):
@@ -127,26 +113,140 @@ def has_cla(issue):
 #
 
 
-def print_report(issues, header, predicate, printer, sort_keys=None):
+class ReportEngine(object):
+    """Runs several reports in a single pass over the issues.
+
+    Each report registers a predicate, an accumulator, which is called with
+    every issue matching the predicate, and a function rendering the report
+    once all issues have been seen. run() renders the reports in the order
+    they were added.
+
+    Reports which can compute their result from the columns in arrays, a
+    vectorized.IssueArrays of the same issues if there is one, only add
+    their render function.
+    """
+
+    def __init__(self, arrays=None, limit=None):
+        self.arrays = arrays
+        self.limit = limit
+        self._reports = []
+
+    def add(self, predicate, accumulate, render):
+        self._reports.append((predicate, accumulate, render))
+
+    def add_vectorized(self, render):
+        """Adds a report which needs no pass over the issues."""
+        self._reports.append((None, None, render))
+
+    def reporter(self, render):
+        """Returns a reporter which collects the issues of its report.
+
+        Args:
+          render: a function like print_report. After the pass, it is called
+              with the matching issues, no predicate and the other arguments
+              the reporter was called with, plus the limit of the engine if
+              it has one.
+        """
+        def collect(header, predicate, printer, **kwargs):
+            if self.limit is not None:
+                kwargs["limit"] = self.limit
+            issues = []
+            self.add(predicate, issues.append,
+                     lambda: render(issues, header, None, printer, **kwargs))
+        return collect
+
+    def store_filters(self):
+        """Returns the store filters every report can be restricted to.
+
+        Only predicates which tell their filters, like query.Query, have
+        any. Applying the filters in the store saves loading the issues no
+        report wants.
+        """
+        common = None
+        for predicate, _, _ in self._reports:
+            if predicate is None:
+                continue
+            filters = getattr(predicate, 'filters', None)
+            if filters is None:
+                return {}
+            if common is None:
+                common = dict(filters)
+            else:
+                common = {key: value for key, value in common.items()
+                          if filters.get(key) == value}
+        return common or {}
+
+    def run(self, issues):
+        """Hands each issue to the reports matching it, then renders them."""
+        reports = [(predicate, accumulate)
+                   for predicate, accumulate, _ in self._reports if predicate]
+        if reports:
+            for issue in issues:
+                for predicate, accumulate in reports:
+                    if predicate(issue):
+                        accumulate(issue)
+        for _, _, render in self._reports:
+            render()
+
+
+def print_report(issues, header, predicate, printer, sort_keys=None,
+                 limit=None):
     print(header)
     count = 0
-    for issue in get_sorted_issues(issues, predicate, sort_keys):
+    for issue in get_sorted_issues(issues, predicate, sort_keys, limit):
         count = count + 1
         print(printer(issue))
     print("%d issues" % count)
     print("---------------------------")
 
 
-def get_sorted_issues(issues, predicate, sort_keys):
-    filtered = filter(predicate, issues)
+class _Descending(object):
+    """Wraps a sort key to order it in reverse within a composite key."""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _composite_key(sort_keys):
+    """Returns (key function, reverse) ordering like sort_keys."""
+    keys = [key for key, _ in sort_keys]
+    reverses = set(rev for _, rev in sort_keys)
+    if len(reverses) == 1:
+        if len(keys) == 1:
+            return keys[0], reverses.pop()
+        return lambda issue: tuple(key(issue) for key in keys), reverses.pop()
+    return (lambda issue: tuple(_Descending(key(issue)) if rev else key(issue)
+                                for key, rev in sort_keys)), False
+
+
+def get_sorted_issues(issues, predicate, sort_keys, limit=None):
+    """Returns the issues matching predicate, ordered by sort_keys.
+
+    Args:
+      sort_keys: (key function, reverse) pairs, the primary order first.
+          Every key is computed once per issue.
+      limit: if given, only the first limit issues are returned. They are
+          selected with a heap, without sorting all issues.
+    """
+    filtered = filter(predicate, issues) if predicate else issues
     if not sort_keys:
-        return filtered
-    for key, rev in sort_keys:
-        filtered = sorted(filtered, key=key, reverse=rev)
-    return filtered
+        return itertools.islice(filtered, limit)
+    key, reverse = _composite_key(sort_keys)
+    if limit is None:
+        return sorted(filtered, key=key, reverse=reverse)
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    return select(limit, filtered, key=key)
 
 
-def print_report_group_by_team(issues, header, predicate, printer):
+def print_report_group_by_team(issues, header, predicate, printer,
+                               limit=None):
     def teamof(issue):
         t = list(teams(issue))
         if len(t) == 0:
@@ -155,10 +255,12 @@ def print_report_group_by_team(issues, header, predicate, printer):
             return t[0]
 
     print(header)
-    sorted_issues = sorted(filter(predicate, issues), key=teamof)
+    if predicate:
+        issues = filter(predicate, issues)
+    sorted_issues = sorted(issues, key=teamof)
     for team, issues in itertools.groupby(sorted_issues, teamof):
         print("%s:" % team)
-        for issue in issues:
+        for issue in itertools.islice(issues, limit):
             print(printer(issue))
     print("---------------------------")
 
@@ -182,13 +284,13 @@ def make_console_printer(
         if show_age:
             output.append(("{: <4}", latest_update_days_ago(issue)))
         if show_number:
-            output.append(("{: <5}", issue["number"]))
+            output.append(("{: <5}", issue.number))
         if show_author:
-            output.append(("{: <12}", issue["user"]["login"]))
+            output.append(("{: <12}", issue.author))
         if show_url:
             output.append(("{: <48}", issue_url(issue)))
         if show_title:
-            issue_title = truncate(issue["title"], 48) if truncate_title else issue["title"]
+            issue_title = truncate(issue.title, 48) if truncate_title else issue.title
             output.append(("{: <50}", issue_title))
         if show_teams:
             output.append(("{: <30}", truncate(",".join(teams(issue)), 28)))
@@ -199,9 +301,8 @@ def make_console_printer(
     return printer
 
 
-def documentation_issues(reporter, issues):
+def documentation_issues(reporter):
     reporter(
-        issues,
         header="Open documentation issues",
         predicate=lambda issue: (
             is_open(issue) and
@@ -217,9 +318,8 @@ def documentation_issues(reporter, issues):
     )
 
 
-def issues_without_team(reporter, issues):
+def issues_without_team(reporter):
     reporter(
-        issues,
         header="Open issues not assigned to any team",
         predicate=lambda issue: is_open(issue) and not (
             has_team_label(issue) or has_label(issue, 'release')),
@@ -227,42 +327,44 @@ def issues_without_team(reporter, issues):
     )
 
 
-def issues_with_category(reporter, issues):
+def issues_with_category(engine):
     c_groups = collections.defaultdict(list)
     predicate = lambda issue: is_open(issue) and not (
         has_team_label(issue) or has_label(issue, "release"))
-    for issue in filter(predicate, issues):
-        categories = category_labels(issue["labels"])
+
+    def accumulate(issue):
+        categories = category_labels(issue.labels)
         if not categories:
             categories = ["uncategorized"]
         for c in categories:
             c_groups[c].append(issue)
 
-    for category in c_groups.keys():
-       # print("------------------------")
-       # print("Category: %s (%d issues)" % (category, len(c_groups[category])))
-       for issue in c_groups[category]:
-           print("%s|%s|%d|%s" % (
-               category,
-               issue_url(issue),
-               latest_update_days_ago(issue),
-               issue["title"]))
+    def render():
+        for category in c_groups.keys():
+           # print("------------------------")
+           # print("Category: %s (%d issues)" % (category, len(c_groups[category])))
+           for issue in c_groups[category]:
+               print("%s|%s|%d|%s" % (
+                   category,
+                   issue_url(issue),
+                   latest_update_days_ago(issue),
+                   issue.title))
+
+    engine.add(predicate, accumulate, render)
 
 
-def more_than_one_team(reporter, issues):
+def more_than_one_team(reporter):
     def predicate(issue):
         return is_open(issue) and len(list(teams(issue))) > 1
 
     reporter(
-        issues,
         header="Issues assigned to more than one team:",
         predicate=predicate,
         printer=make_console_printer(show_teams=True))
 
 
-def have_team_no_untriaged_no_priority(reporter, issues):
+def have_team_no_untriaged_no_priority(reporter):
     reporter(
-        issues,
         header="Triaged issues without priority",
         predicate=lambda issue: is_open(issue)
                                 and has_team_label(issue)
@@ -273,7 +375,7 @@ def have_team_no_untriaged_no_priority(reporter, issues):
         printer=make_console_printer(show_teams=True))
 
 
-def stale_pull_requests(reporter, issues, days):
+def stale_pull_requests(reporter, days):
     def predicate(issue):
         return (
             is_open(issue)
@@ -283,7 +385,6 @@ def stale_pull_requests(reporter, issues, days):
         )
 
     reporter(
-        issues,
         header="Stale pull requests for %s days" % days,
         predicate=predicate,
         printer=make_console_printer(show_title=True, show_age=True))
@@ -296,20 +397,19 @@ def incompatible_flag_description(title):
     else:
       return "", title
 
-def breaking_changes_1_0(reporter, issues):
+def breaking_changes_1_0(reporter):
     def predicate(issue):
         return has_label(issue, "breaking-change-1.0")
     def printer(issue):
-        flag, desc = incompatible_flag_description(issue["title"])
+        flag, desc = incompatible_flag_description(issue.title)
         return "%s | %s" % (issue_url(issue), flag if flag else desc)
     reporter(
-        issues,
         header="Breaking changes 1.0",
         predicate=predicate,
         printer=printer)
 
 
-def pr_backlog(reporter, issues):
+def pr_backlog(reporter):
     def predicate(issue):
         return \
             is_open(issue) \
@@ -319,43 +419,89 @@ def pr_backlog(reporter, issues):
             and not work_in_progress(issue)
 
     reporter(
-        issues,
         header="age | pr | owner | url | title",
         predicate=predicate,
         printer=make_console_printer(
             show_age=True, show_number=True, show_author=True, show_title=True),
         sort_keys = [
-            # TODO(aiuto): secondary sort first
             (lambda issue: latest_update_days_ago(issue), True),
-            (lambda issue: issue["user"]["login"], False),
+            (lambda issue: issue.author, False),
         ]
     )
 
-def open_issues_by_repo(issues, labels=None):
+_DOC_LABELS = ['documentation', 'type: documentation']
+
+
+def open_issues_by_repo(engine, labels=None):
+    arrays = engine.arrays
+    if arrays is not None:
+        engine.add_vectorized(
+            lambda: _print_repo_counts(_count_by_repo(arrays, labels)))
+        return
+
     def predicate(issue):
       if not labels:
         return is_open(issue)
       return is_open(issue) and get_any_of_labels(issue, labels)
 
-    repos = {}
-    for issue in filter(predicate, issues):
-      repo = issue['repository_url'].split('/')[-1:][0]
-      if not repo in repos:
-        repos[repo] = collections.defaultdict(int)
-      repos[repo]['all'] += 1
-      if get_any_of_labels(issue, ['documentation', 'type: documentation']):
-        repos[repo]['docs'] += 1
+    # Count by full repository name, which the issues have at hand, and only
+    # then by the short name we print.
+    full_repos = {}
+
+    def accumulate(issue):
+      counts = full_repos.get(issue.repo)
+      if counts is None:
+        counts = full_repos[issue.repo] = collections.defaultdict(int)
+      counts['all'] += 1
+      if get_any_of_labels(issue, _DOC_LABELS):
+        counts['docs'] += 1
       has_priority = False
-      for priority in ('P0', 'P1', 'P2', 'P3', 'P4'):
+      for priority in _PRIORITIES:
         if has_label(issue, priority):
-          repos[repo][priority] += 1
+          counts[priority] += 1
           has_priority = True
           break
       if not has_priority:
-          repos[repo]['unprioritized'] += 1
+          counts['unprioritized'] += 1
+
+    engine.add(predicate, accumulate, lambda: _print_repo_counts(full_repos))
+
+
+def _count_by_repo(arrays, labels):
+    """Counts like open_issues_by_repo, over vectorized.IssueArrays."""
+    selected = arrays.is_open
+    if labels:
+        selected = selected & arrays.has_any_of_labels(labels)
+    columns = {
+        'all': arrays.count_by_repo(selected),
+        'docs': arrays.count_by_repo(
+            selected & arrays.has_any_of_labels(_DOC_LABELS)),
+    }
+    priorities = arrays.first_of_labels(_PRIORITIES)
+    for i, priority in enumerate(_PRIORITIES):
+        columns[priority] = arrays.count_by_repo(selected & (priorities == i))
+    columns['unprioritized'] = arrays.count_by_repo(
+        selected & (priorities == -1))
+    return {repo: {key: int(counts[i]) for key, counts in columns.items()}
+            for i, repo in enumerate(arrays.repos) if columns['all'][i]}
+
+
+def _print_repo_counts(full_repos):
+    """Prints the counts of open_issues_by_repo.
+
+    Args:
+      full_repos: full repository name -> column -> number of issues.
+    """
+    repos = {}
+    for full_repo, counts in full_repos.items():
+      repo = full_repo.split('/')[-1]
+      if not repo in repos:
+        repos[repo] = collections.defaultdict(int)
+      for key, count in counts.items():
+        repos[repo][key] += count
 
     repo_names = sorted(repos.keys())
-    today_label = datetime.datetime.now().strftime('%Y-%m-%d')
+    today_label = clock.now().strftime('%Y-%m-%d')
     print(','.join([today_label, ''] +
                    ['%s' % r for r in repo_names]))
     print(','.join([today_label, 'all'] +
@@ -367,39 +513,62 @@ def open_issues_by_repo(issues, labels=None):
                      ['%d' % repos[r].get(priority, 0) for r in repo_names]))
 
 
+# name -> function adding the report to a ReportEngine.
 _REPORTS = {
     "more_than_one_team":
-        lambda issues: more_than_one_team(print_report, issues),
+        lambda engine: more_than_one_team(engine.reporter(print_report)),
     "issues_without_team":
-        lambda issues: issues_without_team(print_report, issues),
+        lambda engine: issues_without_team(engine.reporter(print_report)),
     "triaged_no_priority":
-        lambda issues: have_team_no_untriaged_no_priority(
-            print_report_group_by_team, issues),
+        lambda engine: have_team_no_untriaged_no_priority(
+            engine.reporter(print_report_group_by_team)),
     "unmigrated":
-        lambda issues: issues_with_category(print_report, issues),
+        lambda engine: issues_with_category(engine),
     "stale_pull_requests_14d":
-        lambda issues: stale_pull_requests(print_report, issues, 14),
+        lambda engine: stale_pull_requests(engine.reporter(print_report), 14),
     "breaking_changes_1.0":
-        lambda issues: breaking_changes_1_0(print_report, issues),
+        lambda engine: breaking_changes_1_0(engine.reporter(print_report)),
     "team_pr_backlog":
-        lambda issues: pr_backlog(print_report, issues),
+        lambda engine: pr_backlog(engine.reporter(print_report)),
     "open_issues_by_repo":
-        lambda issues: open_issues_by_repo(issues),
+        lambda engine: open_issues_by_repo(engine),
     "open_doc_issues_by_repo":
-    lambda issues: open_issues_by_repo(
-        issues, labels=['documentation', 'type: documentation']),
+    lambda engine: open_issues_by_repo(engine, labels=_DOC_LABELS),
     "documentation":
-        lambda issues: documentation_issues(print_report, issues),
+        lambda engine: documentation_issues(engine.reporter(print_report)),
 }
 
 
-def report(which_reports, user_list=None):
-    pred = None
-    if user_list:
-        pred = lambda issue: issue["user"]["login"] in user_list
-    issues = database.get_issues(predicate=pred)
+def query_report(reporter, query):
+    """Lists the issues matching a query.Query."""
+    reporter(
+        header="Issues matching: %s" % query.text,
+        predicate=query,
+        printer=make_console_printer(show_age=True, show_title=True))
+
+
+def report(which_reports, user_list=None, queries=(), limit=None):
+    """Prints reports.
+
+    Args:
+      which_reports: names of the reports, see report_names().
+      user_list: optional logins to restrict the reports to issues of.
+      queries: query.Query objects to list the matching issues of.
+      limit: optional number of issues to list at most per report, or per
+          team of the reports grouped by team.
+    """
+    arrays = vectorized.open_arrays()
+    if arrays is not None and user_list:
+        arrays = arrays.select(arrays.by_users('author', user_list))
+    engine = ReportEngine(arrays, limit)
     for r in which_reports:
-       _REPORTS[r](issues)
+       _REPORTS[r](engine)
+    for query in queries:
+        query_report(engine.reporter(print_report), query)
+    filters = engine.store_filters()
+    if user_list:
+        filters['author'] = user_list
+    engine.run(database.iter_issues(**filters))
 
 
 def report_names():
@@ -412,12 +581,11 @@ def label_html(label):
 
 
 def html_garden():
-    issues = database.get_issues()
     c_groups = collections.defaultdict(list)
     predicate = lambda issue: is_open(issue) and not (
         has_team_label(issue) or has_label(issue, "release"))
-    for issue in filter(predicate, issues):
-        categories = category_labels(issue["labels"])
+    for issue in database.iter_issues(predicate):
+        categories = category_labels(issue.labels)
         if not categories:
             categories = ["uncategorized"]
         for c in categories:
@@ -461,7 +629,7 @@ def html_garden():
                     row.cell(issue_url(issue), rowspan=2, make_links=True)
                     with html_writer.HTMLWriter.TableCell(row,
                                                css_class='issue_text') as c:
-                        c.write(p.B(issue['title']))
+                        c.write(p.B(issue.title))
                         c.write(p.space(5))
                         # TODO(aiuto): If they are a Googler, put a G logo next to them.
                         # This is availble through github.corp.google.com API.
@@ -480,10 +648,10 @@ def html_garden():
 
                         p.nl();
                         c.write(p.B('Assignees:'))
-                        assignees = issue['assignees']
+                        assignees = issue.assignees
                         if len(assignees) > 0:
-                          for user_data in assignees:
-                            user = database.User(user_data)
+                          for login in assignees:
+                            user = database.User.from_login(login)
                             p.nl();
                             c.write(p.space(5))
                             c.write(p.Link(user.name, user.link))
@@ -493,14 +661,13 @@ def html_garden():
 
                         c.write(p.B('Labels:'))
                         p.nl();
-                        for label in issue['labels']:
-                          name = label['name']
+                        for name in sorted(issue.labels):
                           if not (name.startswith('P') and len(name) == 2):
                             c.write(p.space(5))
-                            c.write(label_html(database.label_db.get(label)))
+                            c.write(label_html(database.label_db.get(name)))
                             p.nl();
 
-                        for cat in category_labels(issue['labels']):
+                        for cat in category_labels(issue.labels):
                           proposed_team = CAT_2_TEAM.get(cat)
                           if proposed_team:
                             p.nl();
@@ -508,11 +675,11 @@ def html_garden():
                                 """<button onclick="replaceLabel('%s', '%s', '%s')">"""
                                 """Move to %s"""
                                 """</button>""" % (
-                                    issue['url'], cat, proposed_team,
+                                    issue.url, cat, proposed_team,
                                     proposed_team))
 
                 with table.row() as row:
-                    row.cell(issue['body'], css_class='issue_text',
+                    row.cell(issue.body, css_class='issue_text',
                              make_links=True)
     p.done()
 
@@ -521,11 +688,11 @@ def html_garden():
 # Gardening
 #
 
-def issues_to_garden(reporter, issues, stale_for_days):
+def issues_to_garden(reporter, stale_for_days):
     def predicate(issue):
         return \
             not has_team_label(issue) \
-            and not issue["assignee"] \
+            and not issue.assignee \
             and not is_pull_request(issue) \
             and is_stale(issue, stale_for_days) \
             and not work_in_progress(issue) \
@@ -533,35 +700,39 @@ def issues_to_garden(reporter, issues, stale_for_days):
             and not has_label(issue, "incompatible-change")
 
     reporter(
-        issues,
         header="Open issues not assigned to any team or person",
         predicate=predicate,
         printer=make_console_printer(
             show_age=True, show_number=False, show_title=True))
 
 
-def pull_requests_to_garden(reporter, issues, stale_for_days):
+def pull_requests_to_garden(reporter, stale_for_days):
     def predicate(issue):
         return \
             not has_team_label(issue) \
-            and not issue["assignee"] \
+            and not issue.assignee \
             and is_pull_request(issue) \
             and is_stale(issue, stale_for_days) \
             and not work_in_progress(issue) \
             and has_cla(issue)
 
     reporter(
-        issues,
         header="Open pull requests not assigned to any team or person",
         predicate=predicate,
         printer=make_console_printer(
             show_age=True, show_number=False, show_title=True))
 
 
-def garden(list_issues, list_pull_requests, stale_for_days):
-    # We are only gardening open issues
-    issues = database.get_issues(is_open)
+def garden(list_issues, list_pull_requests, stale_for_days, queries=(),
+           limit=None):
+    engine = ReportEngine(limit=limit)
     if list_issues:
-        issues_to_garden(print_report, issues, stale_for_days)
+        issues_to_garden(engine.reporter(print_report), stale_for_days)
     if list_pull_requests:
-        pull_requests_to_garden(print_report, issues, stale_for_days)
+        pull_requests_to_garden(engine.reporter(print_report), stale_for_days)
+    for query in queries:
+        query_report(engine.reporter(print_report), query)
+    # We are only gardening open issues
+    filters = engine.store_filters()
+    filters['state'] = "open"
+    engine.run(database.iter_issues(**filters))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Tests for reports."""
+
+import unittest
+
+import database
+import reports
+from database_test import SAMPLE_ISSUES
+
+
+class ReportEngineTest(unittest.TestCase):
+
+  def setUp(self):
+    self.issues = [database.Issue(issue) for issue in SAMPLE_ISSUES]
+
+  def numbers(self, issues):
+    return [(issue.repo, issue.number) for issue in issues]
+
+  def test_one_pass_feeds_every_report(self):
+    rendered = []
+
+    def render(issues, header, predicate, printer, sort_keys=None):
+      self.assertIsNone(predicate)
+      rendered.append((header, self.numbers(issues)))
+
+    engine = reports.ReportEngine()
+    engine.reporter(render)(header='open', predicate=reports.is_open,
+                            printer=None)
+    engine.reporter(render)(header='prs', predicate=reports.is_pull_request,
+                            printer=None)
+    counts = []
+    engine.add(lambda issue: True, counts.append,
+               lambda: rendered.append(('all', len(counts))))
+    # A generator can only be read once, all reports still see every issue.
+    engine.run(issue for issue in self.issues)
+    self.assertEqual(rendered, [
+        ('open', [('bazelbuild/bazel', 1), ('bazelbuild/bazel', 3),
+                  ('bazelbuild/starlark', 1)]),
+        ('prs', [('bazelbuild/bazel', 3)]),
+        ('all', 4),
+    ])
+
+  def test_print_report_without_predicate(self):
+    issues = list(reports.get_sorted_issues(
+        self.issues, None, [(lambda issue: issue.number, True)]))
+    self.assertEqual([issue.number for issue in issues], [3, 2, 1, 1])
+
+  def test_sort_keys_primary_first(self):
+    sort_keys = [(lambda issue: issue.number, True),
+                 (lambda issue: issue.repo, False)]
+    issues = reports.get_sorted_issues(self.issues, None, sort_keys)
+    self.assertEqual(self.numbers(issues), [
+        ('bazelbuild/bazel', 3), ('bazelbuild/bazel', 2),
+        ('bazelbuild/bazel', 1), ('bazelbuild/starlark', 1)])
+    sort_keys[1] = (lambda issue: issue.repo, True)
+    issues = reports.get_sorted_issues(self.issues, None, sort_keys)
+    self.assertEqual(self.numbers(issues)[2:], [
+        ('bazelbuild/starlark', 1), ('bazelbuild/bazel', 1)])
+
+  def test_limit(self):
+    for sort_keys in ([(lambda issue: issue.number, True),
+                       (lambda issue: issue.repo, False)],
+                      [(lambda issue: issue.number, False)],
+                      None):
+      everything = list(reports.get_sorted_issues(
+          self.issues, reports.is_open, sort_keys))
+      for limit in range(5):
+        self.assertEqual(
+            list(reports.get_sorted_issues(self.issues, reports.is_open,
+                                           sort_keys, limit)),
+            everything[:limit])
+
+
+if __name__ == '__main__':
+  unittest.main()
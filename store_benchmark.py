@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""Measures how long loading the issue store takes, and how much memory.
+
+Every report starts by loading all issues, so this is the number to watch
+when changing the store format. Each variant is loaded in a fresh
+interpreter, so that the peak RSS of one does not hide the next. The
+compressed variants trade CPU time for fewer bytes to read, copy and store,
+so the CPU time and the size of the file each variant reads are reported
+too.
+
+Usage:
+  store_benchmark.py [--issues testdata/issue_db.json] [--runs 3]
+  store_benchmark.py --generate 100000   - benchmark a synthetic store
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import columnar
+import database
+
+
+DEFAULT_ISSUES = 'testdata/issue_db.json'
+
+
+def _load_json(path):
+  return database.JsonIssueStore(path, use_snapshot=False).load()
+
+
+def _load_snapshot(path):
+  return database.JsonIssueStore(path).load()
+
+
+def _load_issues(path):
+  # Like database.get_issues(), which streams the issues out of the
+  # snapshot when it is up to date.
+  return [database.Issue(issue)
+          for issue in database.JsonIssueStore(path).scan()]
+
+
+def _compress(suffix):
+  def prepare(path):
+    database.JsonIssueStore(path + suffix, use_snapshot=False).save(
+        _load_json(path))
+  return prepare
+
+
+def _load_compressed(suffix):
+  def load(path):
+    return _load_json(path + suffix)
+  return load
+
+
+def _build_table(path):
+  columnar.write_table(path + '.table', _load_issues(path),
+                       database.label_db.label_info)
+
+
+def _open_table(path):
+  return columnar.IssueTable(path + '.table', database.label_db.bit)
+
+
+# name -> (function to prepare the variant, function to load it, suffix of
+# the file it reads).
+VARIANTS = {
+    'json': (None, _load_json, ''),
+    'gzip': (_compress('.gz'), _load_compressed('.gz'), '.gz'),
+    'snapshot': (_load_snapshot, _load_snapshot, '.snapshot'),
+    'issues': (_load_snapshot, _load_issues, '.snapshot'),
+    'table': (_build_table, _open_table, '.table'),
+}
+if database.zstandard:
+  VARIANTS['zstd'] = (_compress('.zst'), _load_compressed('.zst'), '.zst')
+
+
+def measure(variant, path):
+  """Loads the store once.
+
+  Returns:
+    (seconds, CPU seconds, issues, peak RSS in KiB).
+  """
+  _, load, _ = VARIANTS[variant]
+  start = time.perf_counter()
+  start_cpu = time.process_time()
+  issues = load(path)
+  cpu_seconds = time.process_time() - start_cpu
+  seconds = time.perf_counter() - start
+  return seconds, cpu_seconds, len(issues), _peak_rss()
+
+
+def _peak_rss():
+  # ru_maxrss survives exec on Linux, so it would include the memory of the
+  # parent at the time of the fork. VmHWM does not.
+  try:
+    with open('/proc/self/status') as status:
+      for line in status:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1])
+  except FileNotFoundError:
+    pass
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _run(variant, path):
+  out = subprocess.check_output(
+      [sys.executable, os.path.abspath(__file__), '--measure', variant, path])
+  return json.loads(out)
+
+
+def generate_issues(count):
+  """Returns count made up issues, shaped like the ones GitHub returns."""
+  repos = ['bazelbuild/bazel', 'bazelbuild/rules_go', 'bazelbuild/starlark',
+           'bazelbuild/buildtools']
+  labels = ['P1', 'P2', 'P3', 'team-Core', 'team-Starlark', 'type: bug',
+            'untriaged', 'cla: yes']
+  issues = []
+  for i in range(count):
+    repo = repos[i % len(repos)]
+    repository_url = 'https://api.github.com/repos/' + repo
+    login = 'user%d' % (i % 997)
+    user = {'login': login, 'html_url': 'https://github.com/' + login}
+    issue = {
+        'url': '%s/issues/%d' % (repository_url, i),
+        'repository_url': repository_url,
+        'html_url': 'https://github.com/%s/%s/%d' % (
+            repo, 'issues' if i % 5 else 'pull', i),
+        'number': i,
+        'title': 'Issue number %d' % i,
+        'body': 'Some text describing issue %d. ' % i * 10,
+        'state': 'open' if i % 3 else 'closed',
+        'created_at': '2019-01-01T00:00:00Z',
+        'updated_at': '2019-08-%02dT10:00:00Z' % (i % 28 + 1),
+        'closed_at': None,
+        'user': user,
+        'assignee': None,
+        'assignees': [],
+        'labels': [{'name': labels[(i + j) % len(labels)], 'color': 'ededed',
+                    'url': ''}
+                   for j in range(i % 3)],
+    }
+    if i % 5 == 0:
+      issue['pull_request'] = {'url': '%s/pulls/%d' % (repository_url, i)}
+    issues.append(issue)
+  return issues
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Benchmark loading the issue store')
+  parser.add_argument(
+      '--issues', default=DEFAULT_ISSUES,
+      help='JSON issue file to benchmark (default %s)' % DEFAULT_ISSUES)
+  parser.add_argument(
+      '--generate', type=int, default=0,
+      help='benchmark this many synthetic issues instead')
+  parser.add_argument(
+      '--runs', type=int, default=3,
+      help='number of loads per variant, the fastest one is reported')
+  parser.add_argument(
+      '--measure', nargs=2, metavar=('VARIANT', 'PATH'),
+      help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.measure:
+    seconds, cpu_seconds, count, rss = measure(*args.measure)
+    print(json.dumps({'seconds': seconds, 'cpu_seconds': cpu_seconds,
+                      'issues': count, 'rss_kib': rss}))
+    return
+  if not args.generate and not os.path.exists(args.issues):
+    parser.error('%s does not exist, pass an issue file with --issues or '
+                 'benchmark synthetic issues with --generate' % args.issues)
+
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    path = os.path.join(tmp_dir, 'issues.json')
+    if args.generate:
+      database.JsonIssueStore(path, use_snapshot=False).save(
+          generate_issues(args.generate))
+    else:
+      shutil.copy(args.issues, path)
+    print('%s: %d bytes' % (args.issues if not args.generate else 'synthetic',
+                            os.path.getsize(path)))
+    print('%-10s | %8s | %8s | %8s | %12s | %10s' % (
+        'variant', 'issues', 'seconds', 'CPU', 'bytes read', 'peak RSS'))
+    for variant, (prepare, _, suffix) in VARIANTS.items():
+      if prepare:
+        prepare(path)
+      runs = [_run(variant, path) for _ in range(args.runs)]
+      best = min(runs, key=lambda r: r['seconds'])
+      print('%-10s | %8d | %8.3f | %8.3f | %12d | %7d MiB' % (
+          variant, best['issues'], best['seconds'], best['cpu_seconds'],
+          os.path.getsize(path + suffix),
+          max(r['rss_kib'] for r in runs) // 1024))
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,159 @@
+"""Report predicates evaluated over whole columns with NumPy.
+
+Breakdowns like open_issues_by_repo call a handful of Python predicates for
+every issue, which dominates their run time on a large store. IssueArrays
+holds the fields those predicates read as NumPy arrays, one element per
+issue. A predicate becomes a boolean mask over all issues, computed in a few
+array operations, and counting by repository becomes a bincount.
+
+The arrays of a columnar.IssueTable share the memory of the table, so
+nothing is copied. NumPy is optional; without it, or without an up to date
+table, open_arrays() returns None and the reports take the per issue path.
+"""
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+import clock
+import database
+
+
+class IssueArrays(object):
+  """The fields of issues the report predicates use, one array each.
+
+  Attributes:
+    repos: (list of str) repository names, indexed by the values of repo.
+    users: (list of str) logins, indexed by the values of author and
+        assignee.
+    repo, author, assignee: (int32) ids into repos and users, -1 for none.
+    is_open, is_pr: (bool)
+    updated: (int64) time of the last update in seconds since the epoch.
+    labels: (uint64, issues x words) label bits in the numbering given by
+        label_mask, 64 per word.
+  """
+
+  def __init__(self, repos, users, repo, author, assignee, is_open, is_pr,
+               updated, labels, label_mask=None):
+    """Args are the attributes, except for
+
+    label_mask: function returning the label bits of the numbering of
+        database.label_db in that of labels. By default they are the same.
+    """
+    self.repos = repos
+    self.users = users
+    self.repo = repo
+    self.author = author
+    self.assignee = assignee
+    self.is_open = is_open
+    self.is_pr = is_pr
+    self.updated = updated
+    self.labels = labels
+    self._label_mask = label_mask or (lambda bits: bits)
+
+  @classmethod
+  def from_table(cls, table):
+    """Returns the arrays of a columnar.IssueTable, without copying them."""
+    columns = table.columns
+    return cls(
+        repos=table.repos,
+        users=table.users,
+        repo=numpy.asarray(columns['repo']),
+        author=numpy.asarray(columns['author']),
+        assignee=numpy.asarray(columns['assignee']),
+        is_open=numpy.asarray(columns['state']) == 0,
+        is_pr=numpy.asarray(columns['is_pr']).astype(bool),
+        updated=numpy.asarray(columns['updated']),
+        labels=numpy.asarray(columns['labels']).reshape(
+            len(table), table.label_words),
+        label_mask=table.raw_mask)
+
+  @classmethod
+  def from_issues(cls, issues):
+    """Returns the arrays of database.Issue objects."""
+    repos = {}
+    users = {}
+
+    def user(login):
+      if login is None:
+        return -1
+      return users.setdefault(login, len(users))
+
+    fields = [(repos.setdefault(issue.repo, len(repos)), user(issue.author),
+               user(issue.assignee), issue.state == 'open', issue.is_pr,
+               issue.updated_epoch, issue.label_bits)
+              for issue in issues]
+    words = max([1] + [(f[-1].bit_length() + 63) // 64 for f in fields])
+    labels = numpy.zeros((len(fields), words), dtype=numpy.uint64)
+    for row, f in enumerate(fields):
+      labels[row] = _split_words(f[-1], words)
+    column = lambda i, dtype: numpy.array([f[i] for f in fields], dtype=dtype)
+    return cls(repos=list(repos), users=list(users),
+               repo=column(0, numpy.int32), author=column(1, numpy.int32),
+               assignee=column(2, numpy.int32), is_open=column(3, bool),
+               is_pr=column(4, bool), updated=column(5, numpy.int64),
+               labels=labels)
+
+  def __len__(self):
+    return len(self.repo)
+
+  def select(self, mask):
+    """Returns the arrays of the issues selected by a boolean mask."""
+    return IssueArrays(self.repos, self.users, self.repo[mask],
+                       self.author[mask], self.assignee[mask],
+                       self.is_open[mask], self.is_pr[mask],
+                       self.updated[mask], self.labels[mask],
+                       self._label_mask)
+
+  def age_days(self):
+    """Days since the last update, see clock.days_since."""
+    return clock.days_since(self.updated)
+
+  def has_any(self, label_bits):
+    """Returns the mask of issues with any of the labels of label_bits."""
+    words = _split_words(self._label_mask(label_bits), self.labels.shape[1])
+    return (self.labels & words).any(axis=1)
+
+  def has_label(self, label):
+    return self.has_any(database.label_db.bit(label))
+
+  def has_any_of_labels(self, labels):
+    return self.has_any(database.label_db.mask(labels))
+
+  def first_of_labels(self, labels):
+    """Returns the index into labels of the first label each issue has, or
+    -1, like get_any_of_labels in reports."""
+    first = numpy.full(len(self), -1, dtype=numpy.int8)
+    for i, label in reversed(list(enumerate(labels))):
+      first[self.has_label(label)] = i
+    return first
+
+  def by_users(self, column, logins):
+    """Returns the mask of issues whose author or assignee is in logins."""
+    logins = set(logins)
+    ids = [i for i, login in enumerate(self.users) if login in logins]
+    return numpy.isin(getattr(self, column), ids)
+
+  def count_by_repo(self, mask):
+    """Returns the number of issues selected by mask, per repository id."""
+    return numpy.bincount(self.repo[mask], minlength=len(self.repos))
+
+
+def _split_words(bits, words):
+  return numpy.array([(bits >> (64 * i)) & 0xffffffffffffffff
+                      for i in range(words)], dtype=numpy.uint64)
+
+
+def open_arrays():
+  """Returns the IssueArrays of the columnar table, or None.
+
+  There are none without NumPy, or without an up to date table, see
+  database.open_table.
+  """
+  if numpy is None:
+    return None
+  table = database.open_table()
+  if table is None:
+    return None
+  return IssueArrays.from_table(table)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Tests for vectorized."""
+
+import contextlib
+import datetime
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import clock
+import columnar
+import database
+import reports
+import vectorized
+from database_test import SAMPLE_ISSUES, make_issue
+
+
+@unittest.skipUnless(vectorized.numpy, 'needs numpy')
+class IssueArraysTest(unittest.TestCase):
+
+  def setUp(self):
+    patcher = mock.patch.multiple(clock, _now=None, _now_epoch=None)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    clock.freeze(datetime.datetime(2019, 9, 1))
+    raw = SAMPLE_ISSUES + [
+        make_issue('bazelbuild/bazel', 4, labels=['P2', 'P1', 'documentation'],
+                   updated_at='2019-08-31T00:00:00Z'),
+        make_issue('bazelbuild/rules_go', 1, labels=['type: documentation'],
+                   author='dave'),
+        make_issue('bazelbuild/rules_go', 2, state='closed',
+                   labels=['more data needed', 'team-Go', 'P0']),
+    ]
+    self.issues = [database.Issue(issue) for issue in raw]
+    self.tmp = tempfile.TemporaryDirectory()
+    path = os.path.join(self.tmp.name, 'issues.table')
+    columnar.write_table(path, self.issues, database.label_db.label_info)
+    self.table = columnar.IssueTable(path, database.label_db.bit)
+
+  def tearDown(self):
+    self.table.close()
+    self.tmp.cleanup()
+
+  def all_arrays(self):
+    return [vectorized.IssueArrays.from_issues(self.issues),
+            vectorized.IssueArrays.from_table(self.table)]
+
+  def test_masks_match_predicates(self):
+    predicates = {
+        'open': (reports.is_open, lambda a: a.is_open),
+        'pr': (reports.is_pull_request, lambda a: a.is_pr),
+        'team': (reports.has_team_label,
+                 lambda a: a.has_any(database.label_db.prefix_mask('team-'))),
+        'priority': (reports.has_priority,
+                     lambda a: a.has_any_of_labels(reports._PRIORITIES)),
+        'cla': (reports.has_cla, lambda a: a.has_label('cla: yes')),
+        'more data': (reports.needs_more_data,
+                      lambda a: a.has_label('more data needed')),
+        'stale': (lambda issue: reports.is_stale(issue, 14),
+                  lambda a: a.age_days() >= 14),
+    }
+    for arrays in self.all_arrays():
+      self.assertEqual(len(arrays), len(self.issues))
+      for name, (predicate, mask) in predicates.items():
+        self.assertEqual([bool(predicate(issue)) for issue in self.issues],
+                         mask(arrays).tolist(), name)
+
+  def test_first_of_labels(self):
+    expected = [reports._PRIORITIES.index(reports.get_priority(issue))
+                if reports.get_priority(issue) else -1
+                for issue in self.issues]
+    for arrays in self.all_arrays():
+      self.assertEqual(
+          arrays.first_of_labels(reports._PRIORITIES).tolist(), expected)
+
+  def test_select_by_users(self):
+    for arrays in self.all_arrays():
+      selected = arrays.select(arrays.by_users('author', ['bob', 'dave']))
+      self.assertEqual([arrays.repos[r] for r in selected.repo.tolist()],
+                       ['bazelbuild/bazel', 'bazelbuild/rules_go'])
+
+  def test_open_issues_by_repo(self):
+    def output(arrays, labels):
+      engine = reports.ReportEngine(arrays)
+      reports.open_issues_by_repo(engine, labels)
+      out = io.StringIO()
+      with contextlib.redirect_stdout(out):
+        engine.run(iter(self.issues))
+      return out.getvalue()
+
+    for labels in (None, reports._DOC_LABELS):
+      expected = output(None, labels)
+      for arrays in self.all_arrays():
+        self.assertEqual(output(arrays, labels), expected)
+
+
+if __name__ == '__main__':
+  unittest.main()